@@ -7,7 +7,8 @@ import argparse
 def render(scene, args):
     array = scene.render(
         args.dimensions, step=args.step, workers=args.workers,
-        method=args.method
+        method=args.method, tile=args.tile, max_step=args.max_step,
+        coarse=args.coarse, batch=args.batch, lod=args.lod
     )
     array = (255 * array).astype(np.uint8)
     return Image.fromarray(array)
@@ -18,6 +19,11 @@ def get_parser():
     parser.add_argument('-d', '--dimensions', nargs=2, type=int,
                         default=(1920, 1080))
     parser.add_argument('-s', '--step', type=float, default=0.001)
+    parser.add_argument('--max-step', type=float, default=None)
     parser.add_argument('-m', '--method', default='thread')
     parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--tile', nargs=2, type=int, default=(64, 64))
+    parser.add_argument('-C', '--coarse', type=int, default=None)
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--lod', type=float, default=0)
     return parser
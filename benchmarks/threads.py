@@ -0,0 +1,61 @@
+'''
+Benchmark script comparing the concurrency methods of volpy.Scene.render().
+
+Build volpy with ``VOLPY_OPENMP=1`` for the 'native' method to use more than
+one core.
+
+'''
+import numpy as np
+import volpy
+from libbenchmark import get_parser
+
+import sys
+import time
+
+CENTER = np.array([0, 0, 2.5, 1])
+RADIUS = 1.0
+
+
+def sphere(x):
+    norms = np.linalg.norm(x - CENTER, axis=1)
+    return np.where(norms < RADIUS, 1, 0)
+
+
+def main():
+    parser = _get_parser()
+    args = parser.parse_args()
+
+    if args.threads:
+        volpy.set_num_threads(args.threads)
+
+    if args.grid:
+        transform = volpy.scale(*[0.5 / RADIUS] * 3).dot(
+            volpy.translate(*-CENTER[:3]))
+        grid = volpy.Grid(np.ones(args.grid_shape), transform=transform)
+        grid.stamp(sphere)
+        scene = volpy.Scene(ambient=grid, scatter=args.scatter)
+    else:
+        scene = volpy.Scene(ambient=sphere, scatter=args.scatter)
+
+    sys.stdout.write('openmp: {}, threads: {}\n'.format(
+        volpy.openmp_enabled(), volpy.get_num_threads()))
+    for method in args.methods:
+        t0 = time.time()
+        scene.render(args.dimensions, step=args.step, workers=args.workers,
+                     method=method, tile=args.tile)
+        sys.stdout.write('{:>8} {:.3f}s\n'.format(method, time.time() - t0))
+
+
+def _get_parser():
+    parser = get_parser()
+    parser.add_argument('-k', '--scatter', type=float, default=10)
+    parser.add_argument('-t', '--threads', type=int)
+    parser.add_argument('-G', '--grid', action='store_true')
+    parser.add_argument('-g', '--grid-shape', type=int, nargs=3,
+                        default=(100, 100, 100))
+    parser.add_argument('-M', '--methods', nargs='+',
+                        default=('thread', 'fork', 'native'))
+    return parser
+
+if __name__ == '__main__':
+    main()
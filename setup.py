@@ -21,11 +21,21 @@ compiler_directives = {
     'boundscheck': False,
 }
 
+# Build the native kernels with OpenMP if requested, e.g.:
+#
+#     VOLPY_OPENMP=1 python3 setup.py install
+#
+openmp = os.environ.get('VOLPY_OPENMP', '') not in ('', '0')
+
 # Try to specify extension modules
 ext_modules = []
 if cythonize:
     ext_modules = cythonize('volpy/*.pyx',
                             compiler_directives=compiler_directives)
+    if openmp:
+        for ext_module in ext_modules:
+            ext_module.extra_compile_args.append('-fopenmp')
+            ext_module.extra_link_args.append('-fopenmp')
 
 # Try to get numpy's include directories
 include_dirs = []
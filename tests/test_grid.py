@@ -3,6 +3,11 @@ import volpy
 import numpy as np
 import numpy.testing as npt
 
+import gc
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
 
@@ -45,6 +50,25 @@ class ScalarGridTestCase(unittest.TestCase):
         expected = [0]
         npt.assert_almost_equal(expected, result)
 
+    def test_call_out1(self):
+        '''Grid samples into a given output array'''
+        out = np.full(3, -1, dtype=np.float32)
+        result = self.grid([[0, 0, 0, 1], [0.6, 0, 0, 1], [0.4, 0, 0, 1]],
+                           out=out)
+        self.assertIs(out, result)
+        npt.assert_almost_equal([1, 0, 1], out)
+
+    def test_call_out2(self):
+        '''Output array must match the samples'''
+        with self.assertRaises(ValueError) as cm:
+            self.grid([[0, 0, 0, 1]], out=np.empty(2, dtype=np.float32))
+        result, = cm.exception.args
+        self.assertEqual('Output must have shape (1,).', result)
+        with self.assertRaises(ValueError) as cm:
+            self.grid([[0, 0, 0, 1]], out=np.empty(1))
+        result, = cm.exception.args
+        self.assertEqual('Output must be float32.', result)
+
     def test_indices1(self):
         result = self.grid.indices()
         self.assertEqual((100**3, 3), result.shape)
@@ -80,6 +104,23 @@ class ScalarGridTestCase(unittest.TestCase):
         npt.assert_almost_equal(0.5, self.grid.array[99, :, :])
 
 
+class InterpolationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        array = np.zeros((11, 11, 11))
+        array[6:] = 1
+        self.grid = volpy.Grid(array)
+
+    def test_call1(self):
+        '''Samples are interpolated across the full grid resolution'''
+        result = self.grid([[-0.3, 0, 0, 1], [0.3, 0, 0, 1]])
+        npt.assert_almost_equal([0, 1], result)
+
+    def test_call2(self):
+        result = self.grid([[0.05, 0, 0, 1]])
+        npt.assert_almost_equal([0.5], result, decimal=5)
+
+
 class DefaultValueTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -140,4 +181,329 @@ class VectorGridTestCase(unittest.TestCase):
         expected = [[0, 0, 0]]
         npt.assert_almost_equal(expected, result)
 
+    def test_call_out1(self):
+        '''Vector grid samples into a given output array'''
+        out = np.full((2, 3), -1, dtype=np.float32)
+        result = self.grid([[0, 0, 0, 1], [0.6, 0.6, 0.6, 1]], out=out)
+        self.assertIs(out, result)
+        npt.assert_almost_equal([[1, 1, 1], [0, 0, 0]], out)
+
     # XXX: Tests for stamp() with vector grids.
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.arange(4 * 5 * 6).reshape((4, 5, 6)) % 7
+        self.xyz = np.random.RandomState(0).uniform(-0.6, 0.6, (100, 4))
+        self.xyz[:, 3] = 1
+        self.expected = volpy.Grid(self.values)(self.xyz)
+
+    def test_dtype1(self):
+        '''Compact arrays are stored without a copy'''
+        for dtype in (np.float32, np.float16, np.uint8, np.uint16):
+            array = self.values.astype(dtype)
+            grid = volpy.Grid(array)
+            self.assertIs(array, grid.array)
+            npt.assert_almost_equal(self.expected, grid(self.xyz), decimal=5)
+
+    def test_dtype2(self):
+        '''Other arrays are converted to float64'''
+        grid = volpy.Grid(self.values)
+        self.assertEqual(np.float64, grid.array.dtype)
+        grid = volpy.Grid(self.values.astype('>f4'))
+        self.assertEqual(np.float32, grid.array.dtype)
+        npt.assert_almost_equal(self.expected, grid(self.xyz), decimal=5)
+
+    def test_dtype3(self):
+        '''Half precision values are decoded exactly'''
+        values = np.array([0.5, -2, 65504, 2 ** -20, -2 ** -24, 0.1, 0, 0],
+                          dtype=np.float16)
+        grid = volpy.Grid(values.reshape((2, 2, 2)))
+        corners = [[i, j, k, 1] for i in (-0.5, 0.5) for j in (-0.5, 0.5)
+                   for k in (-0.5, 0.5)]
+        npt.assert_equal(values.astype(np.float32), grid(corners))
+
+    def test_dtype4(self):
+        '''Vector grids of compact arrays'''
+        array = np.ones((4, 4, 4, 3), dtype=np.float32)
+        result = volpy.Grid(array)([[0, 0, 0, 1], [0.6, 0.6, 0.6, 1]])
+        npt.assert_almost_equal([[1, 1, 1], [0, 0, 0]], result)
+
+    def test_quantized1(self):
+        '''Quantized values are scaled and offset, but the default is not'''
+        grid = volpy.Grid(self.values.astype(np.uint8), scale=0.5, offset=1,
+                          default=-1)
+        inside = (np.abs(self.xyz[:, :3]) <= 0.5).all(axis=1)
+        expected = np.where(inside, 0.5 * self.expected + 1, -1)
+        npt.assert_almost_equal(expected, grid(self.xyz), decimal=5)
+
+    def test_quantized2(self):
+        '''Stamping quantizes the values'''
+        grid = volpy.Grid(np.zeros((3, 3, 3), dtype=np.uint8),
+                          scale=1. / 255)
+        grid.stamp(lambda xyz: xyz[:, 0] * 4)
+        self.assertEqual(np.uint8, grid.array.dtype)
+        npt.assert_equal([0, 0, 255], grid.array[:, 0, 0])
+        grid.stamp(lambda xyz: np.full(len(xyz), 0.2))
+        npt.assert_equal(51, grid.array)
+        npt.assert_almost_equal([0.2], grid([[0, 0, 0, 1]]))
+
+    def test_macrocells1(self):
+        '''Macrocells summarize the scaled values'''
+        array = np.zeros((9, 9, 9), dtype=np.uint16)
+        array[1, 1, 1] = 1000
+        grid = volpy.Grid(array, scale=1e-3, offset=-0.5)
+        macrocells = grid.build_macrocells(block=4)
+        npt.assert_almost_equal(0.5, macrocells.maxs[0][0, 0, 0])
+        npt.assert_almost_equal(-0.5, macrocells.mins[0][0, 0, 0])
+        npt.assert_almost_equal(-0.5, macrocells.maxs[0][1, 1, 1])
+
+    def test_render1(self):
+        '''Compact density grids render like float64 ones'''
+        scene = volpy.Scene()
+        scene.ambient = volpy.Element(volpy.Grid(self.values))
+        expected = scene.render((16, 16), step=0.05)
+        scene.ambient = volpy.Element(
+            volpy.Grid(self.values.astype(np.uint8) * 2, scale=0.5))
+        result = scene.render((16, 16), step=0.05)
+        npt.assert_almost_equal(expected, result, decimal=5)
+
+
+class BBoxTestCase(unittest.TestCase):
+
+    def test_bbox1(self):
+        grid = volpy.Grid(np.ones((10, 10, 10)))
+        expected = [[-0.5, -0.5, -0.5, 1], [0.5, 0.5, 0.5, 1]]
+        npt.assert_almost_equal(expected, grid.bbox())
+
+    def test_bbox2(self):
+        '''Bounding box follows the grid transform'''
+        bbox = volpy.BBox([[1, 2, 3, 1], [2, 4, 6, 1]])
+        grid = volpy.Grid(np.ones((10, 10, 10)), transform=bbox.transform())
+        npt.assert_almost_equal(bbox.corners, grid.bbox(), decimal=5)
+
+
+class SpacingTestCase(unittest.TestCase):
+
+    def test_spacing1(self):
+        grid = volpy.Grid(np.ones((11, 5, 2)))
+        npt.assert_almost_equal([0.1, 0.25, 1], grid.spacing())
+
+    def test_spacing2(self):
+        '''Spacing follows the grid transform'''
+        bbox = volpy.BBox([[1, 2, 3, 1], [2, 4, 6, 1]])
+        grid = volpy.Grid(np.ones((11, 11, 1)), transform=bbox.transform())
+        npt.assert_almost_equal([0.1, 0.2, np.inf], grid.spacing(),
+                                decimal=5)
+
+
+class MacrocellsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        array = np.zeros((20, 20, 20))
+        array[2, 3, 4] = 1
+        array[15:, 15:, 15:] = 2
+        self.grid = volpy.Grid(array)
+        self.macrocells = self.grid.build_macrocells(block=4)
+
+    def test_levels1(self):
+        self.assertEqual(4, self.macrocells.levels)
+        npt.assert_equal([[5, 5, 5], [3, 3, 3], [2, 2, 2], [1, 1, 1]],
+                         self.macrocells.shapes)
+
+    def test_minmax1(self):
+        '''Level 0 blocks include the voxels on their far faces'''
+        maxs = self.macrocells.maxs[0]
+        self.assertEqual(1, maxs[0, 0, 0])
+        self.assertEqual(1, maxs[0, 0, 1])
+        self.assertEqual(0, maxs[1, 0, 0])
+        self.assertEqual(2, maxs[3, 3, 3])
+        self.assertEqual(2, maxs[4, 4, 4])
+        self.assertEqual(0, maxs[2, 2, 2])
+        self.assertEqual(0, self.macrocells.mins[0][3, 3, 3])
+        self.assertEqual(2, self.macrocells.mins[0][4, 4, 4])
+
+    def test_minmax2(self):
+        '''Coarse levels summarize the levels below them'''
+        self.assertEqual(2, self.macrocells.maxs[-1][0, 0, 0])
+        self.assertEqual(0, self.macrocells.mins[-1][0, 0, 0])
+        self.assertEqual(1, self.macrocells.maxs[1][0, 0, 0])
+
+    def test_update1(self):
+        '''Stamping keeps the macrocells up to date'''
+        self.grid.stamp(lambda xyz: np.zeros(len(xyz)))
+        self.assertEqual(0, self.macrocells.maxs[-1][0, 0, 0])
+
+    def test_update2(self):
+        '''Partial updates only touch the blocks of the changed region'''
+        self.grid.array[10, 10, 10] = 3
+        self.macrocells.update((10, 10, 10), (11, 11, 11))
+        self.assertEqual(3, self.macrocells.maxs[0][2, 2, 2])
+        self.assertEqual(0, self.macrocells.maxs[0][1, 1, 1])
+        self.assertEqual(3, self.macrocells.maxs[-1][0, 0, 0])
+
+    def test_empty_span1(self):
+        positions = np.array([[-0.5, 0, 0, 1], [0.3, 0.3, 0.3, 1]],
+                             dtype=np.float32)
+        directions = np.array([[1, 0, 0, 0], [1, 0, 0, 0]],
+                              dtype=np.float32)
+        limit = np.array([10, 10], dtype=np.float32)
+        result = self.macrocells.empty_span(positions, directions, limit)
+        # The first ray crosses empty space until it leaves the grid, the
+        # second starts in the occupied corner.
+        npt.assert_almost_equal([1, 0], result, decimal=3)
+
+    def test_vector1(self):
+        grid = volpy.Grid(np.ones((4, 4, 4, 3)))
+        with self.assertRaises(ValueError):
+            grid.build_macrocells()
+
+
+class MipmapsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        state = np.random.RandomState(0)
+        self.grid = volpy.Grid(state.rand(33, 20, 7))
+        self.mipmaps = self.grid.build_mipmaps()
+        self.xyz = state.uniform(-0.5, 0.5, (100, 4))
+        self.xyz[:, 3] = 1
+
+    def test_levels1(self):
+        self.assertEqual(7, self.mipmaps.levels)
+        self.assertIs(self.grid, self.mipmaps.grids[0])
+        self.assertEqual((17, 11, 4), self.mipmaps.grids[1].array.shape)
+        self.assertEqual((1, 1, 1), self.mipmaps.grids[-1].array.shape)
+        npt.assert_almost_equal([1. / 32, 1. / 16], self.mipmaps.spacings[:2])
+        self.assertEqual(2, self.grid.build_mipmaps(levels=2).levels)
+        with self.assertRaises(ValueError):
+            self.grid.build_mipmaps(levels=0)
+
+    def test_levels2(self):
+        '''Levels preserve constant values'''
+        grid = volpy.Grid(np.full((10, 9, 8), 2, dtype=np.uint8), scale=0.5)
+        for level in grid.build_mipmaps().grids[1:]:
+            self.assertEqual(np.float32, level.array.dtype)
+            npt.assert_almost_equal(1, level.array, decimal=6)
+
+    def test_levels3(self):
+        '''Levels are filtered with a tent filter'''
+        array = np.zeros((5, 1, 1))
+        array[2] = 1
+        level = volpy.Grid(array).build_mipmaps(levels=2).grids[1]
+        npt.assert_almost_equal([0, 0.5, 0], level.array.ravel())
+        array = np.zeros((5, 1, 1))
+        array[1] = 1
+        level = volpy.Grid(array).build_mipmaps(levels=2).grids[1]
+        npt.assert_almost_equal([1. / 3, 0.25, 0], level.array.ravel())
+
+    def test_sample1(self):
+        '''Small footprints sample the grid'''
+        npt.assert_equal(self.grid(self.xyz), self.mipmaps.sample(self.xyz, 0))
+
+    def test_sample2(self):
+        '''Footprints between levels blend them'''
+        fine = self.mipmaps.grids[1](self.xyz)
+        coarse = self.mipmaps.grids[2](self.xyz)
+        npt.assert_almost_equal(fine, self.mipmaps.sample(self.xyz, 1. / 16))
+        npt.assert_almost_equal((fine + coarse) / 2,
+                                self.mipmaps.sample(self.xyz, 3. / 32))
+        result = self.mipmaps.sample(self.xyz, 100)
+        npt.assert_almost_equal(self.mipmaps.grids[-1].array.ravel()[0],
+                                result, decimal=6)
+
+    def test_sample3(self):
+        '''Vector mipmaps'''
+        grid = volpy.Grid(np.ones((9, 9, 9, 3)))
+        out = np.empty((100, 3), dtype=np.float32)
+        result = grid.build_mipmaps().sample(self.xyz, 0.2, out=out)
+        self.assertIs(out, result)
+        npt.assert_almost_equal(1, out, decimal=6)
+
+    def test_update1(self):
+        '''Stamping keeps the mipmaps up to date'''
+        self.grid.stamp(lambda xyz: np.full(len(xyz), 3.))
+        npt.assert_almost_equal(3, self.mipmaps.grids[-1].array, decimal=5)
+
+
+class ShareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = volpy.Grid(np.arange(1000.).reshape((10, 10, 10)))
+
+    def test_share1(self):
+        '''Shared grids pickle by reference'''
+        size = len(pickle.dumps(self.grid))
+        self.assertIs(self.grid, self.grid.share())
+        self.assertLess(len(pickle.dumps(self.grid)), size / 4)
+        copy = pickle.loads(pickle.dumps(self.grid))
+        npt.assert_equal(self.grid.array, copy.array)
+        copy.array[0, 0, 0] = -1
+        self.assertEqual(-1, self.grid.array[0, 0, 0])
+
+    def test_share2(self):
+        '''Shared memory is released with the grid'''
+        self.grid.share()
+        path = self.grid.array.filename
+        self.assertTrue(os.path.exists(path))
+        del self.grid
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+
+    def test_share3(self):
+        '''Shared grids still evaluate and stamp'''
+        expected = self.grid([[0.1, 0.2, 0.3, 1]])
+        self.grid.share()
+        npt.assert_almost_equal(expected, self.grid([[0.1, 0.2, 0.3, 1]]))
+        self.grid.stamp(_scalar_stamp)
+        npt.assert_almost_equal(-0.5, self.grid.array[0, :, :])
+
+
+class LoadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'grid.npy')
+        array = (np.arange(1000) % 256).reshape((10, 10, 10))
+        self.grid = volpy.Grid(array.astype(np.uint8), scale=0.5)
+        self.grid.save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load1(self):
+        '''Loaded grids map their file without converting it'''
+        grid = volpy.Grid.load(self.path, scale=0.5)
+        self.assertIsInstance(grid.array, np.memmap)
+        self.assertEqual(np.uint8, grid.array.dtype)
+        xyz = [[0.1, 0.2, 0.3, 1], [0.6, 0, 0, 1]]
+        npt.assert_almost_equal(self.grid(xyz), grid(xyz))
+
+    def test_load2(self):
+        '''Read only grids cannot be stamped'''
+        grid = volpy.Grid.load(self.path)
+        with self.assertRaises(ValueError):
+            grid.stamp(_scalar_stamp)
+
+    def test_load3(self):
+        '''Stamping writes through to the file'''
+        grid = volpy.Grid.load(self.path, mmap_mode='r+')
+        grid.stamp(lambda xyz: np.full(len(xyz), 7))
+        grid.array.flush()
+        npt.assert_equal(7, np.load(self.path))
+
+    def test_load4(self):
+        '''Grids can be read into memory'''
+        grid = volpy.Grid.load(self.path, mmap_mode=None)
+        self.assertNotIsInstance(grid.array, np.memmap)
+        npt.assert_equal(self.grid.array, grid.array)
+
+    def test_pickle1(self):
+        '''Loaded grids pickle by reference'''
+        grid = volpy.Grid.load(self.path, scale=0.5)
+        self.assertIs(grid, grid.share())
+        self.assertLess(len(pickle.dumps(grid)), grid.array.nbytes)
+        copy = pickle.loads(pickle.dumps(grid))
+        self.assertIsInstance(copy.array, np.memmap)
+        npt.assert_equal(self.grid.array, copy.array)
+        self.assertEqual(0.5, copy.scale)
@@ -36,6 +36,34 @@ class PEvalTestCase(unittest.TestCase):
         result = volpy.peval(_func, self.xyz, workers=1)
         npt.assert_almost_equal(result, self.expected)
 
+    def test_peval_out(self):
+        for method in ('thread', 'fork'):
+            out = np.zeros(100)
+            result = volpy.peval(_func, self.xyz, method=method, workers=3,
+                                 out=out)
+            self.assertIs(out, result)
+            npt.assert_almost_equal(out, self.expected)
+
+    def test_peval_chunksize(self):
+        for method in ('thread', 'fork'):
+            result = volpy.peval(_func, self.xyz, method=method, workers=2,
+                                 chunksize=7)
+            npt.assert_almost_equal(result, self.expected)
+
+    def test_peval_chunksize_error(self):
+        with self.assertRaises(ValueError) as cm:
+            volpy.peval(_func, self.xyz, chunksize=0)
+        result, = cm.exception.args
+        expected = 'Chunk size must be positive.'
+        self.assertEqual(expected, result)
+
+    def test_peval_out_error(self):
+        with self.assertRaises(ValueError) as cm:
+            volpy.peval(_func, self.xyz, out=np.zeros(99))
+        result, = cm.exception.args
+        expected = 'Output must have 100 rows.'
+        self.assertEqual(expected, result)
+
     def test_peval_workers_error(self):
         with self.assertRaises(ValueError) as cm:
             result = volpy.peval(_func, self.xyz, workers=0)
@@ -49,3 +77,29 @@ class PEvalTestCase(unittest.TestCase):
         result, = cm.exception.args
         expected = 'Invalid method: spoon'
         self.assertEqual(expected, result)
+
+
+class NumThreadsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.threads = volpy.get_num_threads()
+
+    def tearDown(self):
+        volpy.set_num_threads(self.threads)
+
+    def test_default(self):
+        if volpy.openmp_enabled():
+            self.assertGreaterEqual(self.threads, 1)
+        else:
+            self.assertEqual(1, self.threads)
+
+    def test_set(self):
+        volpy.set_num_threads(3)
+        self.assertEqual(3, volpy.get_num_threads())
+
+    def test_set_error(self):
+        with self.assertRaises(ValueError) as cm:
+            volpy.set_num_threads(0)
+        result, = cm.exception.args
+        expected = 'Must have at least 1 thread.'
+        self.assertEqual(expected, result)
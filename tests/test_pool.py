@@ -0,0 +1,88 @@
+import numpy.testing as npt
+import numpy as np
+
+import unittest
+
+import volpy
+
+
+def _square(x):
+    return x * x
+
+
+def _func(xyz):
+    return np.linalg.norm(xyz, axis=1)
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def test_map_thread(self):
+        with volpy.WorkerPool('thread', workers=2) as pool:
+            self.assertEqual([0, 1, 4, 9], pool.map(_square, range(4)))
+
+    def test_map_fork(self):
+        with volpy.WorkerPool('fork', workers=2) as pool:
+            self.assertEqual([0, 1, 4, 9], pool.map(_square, range(4)))
+
+    def test_imap_unordered(self):
+        for method in ('thread', 'fork'):
+            with volpy.WorkerPool(method, workers=2) as pool:
+                result = pool.imap_unordered(_square, range(4))
+                self.assertEqual([0, 1, 4, 9], sorted(result))
+
+    def test_workers(self):
+        with volpy.WorkerPool() as pool:
+            self.assertEqual('thread', pool.method)
+            self.assertGreaterEqual(pool.workers, 1)
+
+    def test_close(self):
+        pool = volpy.WorkerPool(workers=1)
+        with pool:
+            self.assertFalse(pool.closed)
+        self.assertTrue(pool.closed)
+        with self.assertRaises(ValueError) as cm:
+            pool.map(_square, range(4))
+        result, = cm.exception.args
+        self.assertEqual('Pool is closed.', result)
+        pool.close()
+
+    def test_workers_error(self):
+        with self.assertRaises(ValueError) as cm:
+            volpy.WorkerPool(workers=0)
+        result, = cm.exception.args
+        expected = 'Must have at least 1 worker.'
+        self.assertEqual(expected, result)
+
+    def test_method_error(self):
+        with self.assertRaises(ValueError) as cm:
+            volpy.WorkerPool('spoon')
+        result, = cm.exception.args
+        expected = 'Invalid method: spoon'
+        self.assertEqual(expected, result)
+
+
+class SharedPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.xyz = np.ndarray((100, 4))
+        self.xyz[:, 0] = np.linspace(0.1, 0.5, 100)
+        self.xyz[:, 1] = np.linspace(-3, 0.2, 100)
+        self.xyz[:, 2] = np.linspace(-3, 20, 100)
+        self.xyz[:, 3] = 1
+
+    def test_reuse(self):
+        '''One pool serves renders, evaluations and stamps'''
+        scene = volpy.Scene(ambient=volpy.Element(1, (1, 0, 0)))
+        expected = scene.render((20, 20), workers=2)
+        grid = volpy.Grid(np.zeros((10, 10, 10)))
+        stamped = volpy.Grid(np.zeros((10, 10, 10)))
+        stamped.stamp(_func)
+        for method in ('thread', 'fork'):
+            with volpy.WorkerPool(method, workers=2) as pool:
+                for _ in range(2):
+                    image = scene.render((20, 20), pool=pool)
+                    npt.assert_almost_equal(expected, image)
+                    result = volpy.peval(_func, self.xyz, pool=pool)
+                    npt.assert_almost_equal(_func(self.xyz), result)
+                grid.pstamp(_func, pool=pool)
+                npt.assert_almost_equal(stamped.array, grid.array)
@@ -95,3 +95,642 @@ class SceneTestCase(unittest.TestCase):
         self.scene.ambient = volpy.Element(1)
         image = self.scene.render(self.shape, workers=2, method='fork')
         self.assertEqual((100, 100, 4), image.shape)
+
+    def test_render_fork_grid(self):
+        '''Fork mode renders grids through shared memory'''
+        bbox = volpy.BBox([[-0.4, -0.4, 1, 1], [0.4, 0.4, 1.8, 1]])
+        grid = volpy.Grid(np.random.random((8, 8, 8)),
+                          transform=bbox.transform())
+        array = grid.array
+        self.scene.ambient = volpy.Element(grid)
+        expected = self.scene.render(self.shape, workers=2)
+        result = self.scene.render(self.shape, workers=2, method='fork')
+        npt.assert_allclose(expected, result, atol=1e-6)
+        self.assertIs(array, grid.array)
+        grid.share()
+        result = self.scene.render(self.shape, workers=2, method='fork')
+        npt.assert_allclose(expected, result, atol=1e-6)
+
+    def test_render_native(self):
+        '''Scene.render() with native method'''
+        self.scene.ambient = volpy.Element(_half_plane)
+        expected = self.scene.render(self.shape, workers=2)
+        threads = volpy.get_num_threads()
+        try:
+            volpy.set_num_threads(4)
+            result = self.scene.render(self.shape, method='native')
+        finally:
+            volpy.set_num_threads(threads)
+        npt.assert_allclose(expected, result, atol=1e-6)
+
+    def test_render_out(self):
+        '''Scene.render() renders into a given output array'''
+        self.scene.ambient = volpy.Element(_half_plane)
+        expected = self.scene.render(self.shape, workers=2)
+        self.assertEqual(np.float32, expected.dtype)
+        for method in ('thread', 'fork', 'native'):
+            out = np.zeros((100, 100, 4))
+            result = self.scene.render(self.shape, workers=2, method=method,
+                                       out=out)
+            self.assertIs(out, result)
+            npt.assert_allclose(expected, out, atol=1e-6)
+
+    def test_render_out_error(self):
+        '''Output array must match the image'''
+        self.scene.ambient = volpy.Element(1)
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render((100, 50), out=np.zeros((100, 50, 4)))
+        result, = cm.exception.args
+        expected = 'Output must have shape (50, 100, 4).'
+        self.assertEqual(expected, result)
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render(self.shape, out=np.zeros((100, 100, 8))[..., :4])
+        result, = cm.exception.args
+        expected = 'Output must be C-contiguous.'
+        self.assertEqual(expected, result)
+
+    def test_render_tile(self):
+        '''The tile size does not change the rendered image'''
+        self.scene.ambient = volpy.Element(_half_plane)
+        expected = self.scene.render(self.shape, workers=1, tile=(100, 100))
+        for method in ('thread', 'fork'):
+            result = self.scene.render(self.shape, workers=3, method=method,
+                                       tile=(7, 30))
+            npt.assert_allclose(expected, result, atol=1e-6)
+
+    def test_render_tile_error(self):
+        '''Tiles must not be empty'''
+        self.scene.ambient = volpy.Element(1)
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render(self.shape, tile=(8, 0))
+        result, = cm.exception.args
+        expected = 'Tile shape must be positive.'
+        self.assertEqual(expected, result)
+
+    def test_render9(self):
+        '''Compaction does not change the rendered image'''
+        self.scene.ambient = volpy.Element(_half_plane)
+        expected = self.scene.render(self.shape, compact=False)
+        result = self.scene.render(self.shape, compact=True)
+        npt.assert_allclose(expected, result, atol=1e-5)
+
+    def test_render10(self):
+        '''Compaction stops evaluating opaque rays'''
+        counter = _CountingField(100)
+        self.scene.ambient = volpy.Element(counter)
+        self.scene.render(self.shape, workers=1, compact=False)
+        full = counter.count
+        counter.count = 0
+        self.scene.render(self.shape, workers=1, compact=True)
+        self.assertLess(counter.count, full / 2)
+
+
+def _half_plane(xyz):
+    return np.where(xyz[:, 0] > 0, 100, 0)
+
+
+class _CountingField(object):
+    '''Dense everywhere except a thin wedge at the left of the frustum.'''
+
+    def __init__(self, value):
+        self.value = value
+        self.count = 0
+        self.calls = 0
+
+    def __call__(self, xyz):
+        self.count += len(xyz)
+        self.calls += 1
+        return np.where(xyz[:, 0] > -0.5 * xyz[:, 2], self.value, 0)
+
+
+class BoundsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (50, 50)
+        self.bbox = volpy.BBox([[-0.2, -0.2, 1.2, 1], [0.2, 0.2, 1.6, 1]])
+        self.grid = volpy.Grid(np.ones((10, 10, 10)),
+                               transform=self.bbox.transform())
+
+    def test_bbox1(self):
+        '''Grid elements are bounded by the grid'''
+        element = volpy.Element(self.grid)
+        npt.assert_almost_equal(self.bbox.corners, element.bbox(), decimal=5)
+
+    def test_bbox2(self):
+        '''Callables are unbounded unless bounds are given'''
+        self.assertIsNone(volpy.Element(_half_plane).bbox())
+        element = volpy.Element(_half_plane, bounds=self.bbox)
+        npt.assert_almost_equal(self.bbox.corners, element.bbox())
+
+    def test_bbox3(self):
+        '''Scene bounds are the union of the element bounds'''
+        scene = volpy.Scene(
+            ambient=volpy.Element(_half_plane, bounds=[[0, 0, 0, 1],
+                                                       [1, 1, 1, 1]]),
+            diffuse=volpy.Element(_half_plane, bounds=[[-1, 0, 0.5, 1],
+                                                       [0.5, 2, 1, 1]]),
+        )
+        expected = [[-1, 0, 0, 1], [1, 2, 1, 1]]
+        npt.assert_almost_equal(expected, scene.bbox())
+        scene.diffuse = volpy.Element(_half_plane)
+        self.assertIsNone(scene.bbox())
+
+    def test_render1(self):
+        '''Clipping to the bounds does not change the rendered image'''
+        scene = volpy.Scene(ambient=lambda xyz: self.grid(xyz), scatter=10)
+        expected = scene.render(self.shape, workers=1)
+        scene.ambient = volpy.Element(self.grid)
+        for compact in (True, False):
+            result = scene.render(self.shape, workers=1, compact=compact)
+            npt.assert_allclose(expected, result, atol=1e-5)
+        self.assertTrue((expected[:, :, 3] > 0).any())
+
+    def test_render2(self):
+        '''Rays are only sampled inside the bounds'''
+        counter = _CountingField(1)
+        scene = volpy.Scene(ambient=volpy.Element(counter, bounds=self.bbox))
+        scene.render(self.shape, workers=1)
+        self.assertLess(counter.count, 50 * 50 * 100 / 4)
+
+
+
+class _FillingField(object):
+    '''Samples a field into the output array it is given.'''
+
+    def __init__(self, field):
+        self.field = field
+        self.fills = 0
+
+    def __call__(self, xyz, out=None):
+        if out is None:
+            return self.field(xyz)
+        self.fills += 1
+        out[...] = self.field(xyz)
+        return out
+
+
+def _stripes(xyz):
+    return np.where(xyz[:, 1:2] > 0, (1, 0, 0), (0, 0, 1))
+
+
+def _shadow(xyz):
+    return np.maximum(xyz[:, 1], 0)
+
+
+class FieldOutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (30, 30)
+        bbox = volpy.BBox([[-0.3, -0.3, 1.2, 1], [0.3, 0.3, 1.8, 1]])
+        xyz = np.indices((8, 8, 8)).transpose(1, 2, 3, 0) / 7.
+        self.grid = volpy.Grid(xyz[:, :, :, 0] * 4,
+                               transform=bbox.transform())
+
+    def _scene(self, wrap):
+        scene = volpy.Scene(
+            ambient=volpy.Element(wrap(_half_plane), color=wrap(_stripes)),
+            diffuse=volpy.Element(self.grid),
+        )
+        scene.lights.append(volpy.Light(wrap(_shadow)))
+        return scene
+
+    def test_render1(self):
+        '''Fields which take an output array are sampled into it'''
+        expected = self._scene(lambda field: field).render(self.shape,
+                                                           workers=1)
+        fields = []
+
+        def wrap(field):
+            fields.append(_FillingField(field))
+            return fields[-1]
+
+        scene = self._scene(wrap)
+        for compact in (True, False):
+            result = scene.render(self.shape, workers=1, compact=compact)
+            npt.assert_allclose(expected, result, atol=1e-6)
+        for field in fields:
+            self.assertGreater(field.fills, 0)
+
+
+class MacrocellsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (40, 40)
+        array = np.zeros((32, 32, 32))
+        array[20:26, 12:20, 14:18] = 1
+        bbox = volpy.BBox([[-0.4, -0.4, 1, 1], [0.4, 0.4, 1.8, 1]])
+        self.grid = _CountingGrid(array, transform=bbox.transform())
+
+    def test_render1(self):
+        '''Skipping empty macrocells does not change the rendered image'''
+        scene = volpy.Scene(ambient=self.grid, scatter=10)
+        expected = scene.render(self.shape, workers=1)
+        self.grid.build_macrocells(block=4)
+        for compact in (True, False):
+            result = scene.render(self.shape, workers=1, compact=compact)
+            npt.assert_allclose(expected, result, atol=1e-5)
+        self.assertTrue((expected[:, :, 3] > 0).any())
+
+    def test_render2(self):
+        '''Empty macrocells are not sampled'''
+        field = _GridCallback(self.grid)
+        scene = volpy.Scene(ambient=volpy.Element(field,
+                                                  bounds=self.grid.bbox()),
+                            scatter=10)
+        scene.render(self.shape, workers=1)
+        full, field.count = field.count, 0
+        field.macrocells = self.grid.build_macrocells(block=4)
+        scene.render(self.shape, workers=1)
+        self.assertLess(field.count, full / 4)
+
+
+class FusedTestCase(unittest.TestCase):
+    '''Scenes made only of grids and constants are marched natively.'''
+
+    def setUp(self):
+        self.shape = (40, 40)
+        bbox = volpy.BBox([[-0.4, -0.4, 1, 1], [0.4, 0.4, 1.8, 1]])
+        xyz = np.indices((16, 16, 16)).transpose(1, 2, 3, 0) / 15.
+        density = np.where(np.linalg.norm(xyz - 0.5, axis=3) < 0.4, 1., 0.)
+        self.density = _CountingGrid(density, transform=bbox.transform())
+        self.color = _CountingGrid(xyz, transform=bbox.transform())
+        self.shadow = _CountingGrid(xyz[:, :, :, 1],
+                                    transform=bbox.transform())
+
+    def test_render1(self):
+        '''Ambient grid density and color'''
+        scene = volpy.Scene(
+            ambient=volpy.Element(_GridCallback(self.density),
+                                  _GridCallback(self.color)),
+            scatter=10,
+        )
+        expected = scene.render(self.shape, workers=1)
+        scene.ambient = volpy.Element(self.density, self.color)
+        result = scene.render(self.shape, workers=1)
+        npt.assert_allclose(expected, result, atol=1e-5)
+        self.assertTrue((expected[:, :, 3] > 0).any())
+        self.assertEqual(0, self.density.count + self.color.count)
+
+    def test_render2(self):
+        '''Diffuse grid density with grid lights'''
+        scene = volpy.Scene(diffuse=volpy.Element(self.density, (1, 0, 1)),
+                            scatter=10)
+        scene.lights.append(volpy.Light(_GridCallback(self.shadow),
+                                        (1, 1, 0.5)))
+        expected = scene.render(self.shape, workers=1)
+        scene.lights[0].field = self.shadow
+        result = scene.render(self.shape, workers=1)
+        npt.assert_allclose(expected, result, atol=1e-5)
+        self.assertTrue((expected[:, :, 0] > 0).any())
+        self.assertEqual(0, self.shadow.count)
+        result = scene.render(self.shape, method='native')
+        npt.assert_allclose(expected, result, atol=1e-5)
+
+    def test_render3(self):
+        '''Macrocells are used by the native march'''
+        scene = volpy.Scene(ambient=volpy.Element(self.density, self.color),
+                            scatter=10)
+        expected = scene.render(self.shape, workers=1)
+        self.density.build_macrocells(block=2)
+        result = scene.render(self.shape, workers=1)
+        npt.assert_allclose(expected, result, atol=1e-5)
+
+
+class AdaptiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (40, 30)
+        self.camera = volpy.Camera(eye=(0, 0, 0, 1), view=(0, 0, 1, 0),
+                                   far=4)
+        self.bbox = volpy.BBox([[-1, -1, 1.5, 1], [1, 1, 3.5, 1]])
+        self.grid = volpy.Grid(np.ones((32, 32, 32)),
+                               transform=self.bbox.transform())
+        self.grid.stamp(_soft_sphere)
+
+    def _scenes(self):
+        yield volpy.Scene(ambient=volpy.Element(_soft_sphere, (1, 0, 0)),
+                          diffuse=_ball, scatter=3, camera=self.camera)
+        yield volpy.Scene(ambient=self.grid, scatter=3, camera=self.camera)
+
+    def test_render1(self):
+        '''Adaptive steps are close to fine steps'''
+        for scene in self._scenes():
+            expected = scene.render(self.shape, step=0.002, workers=1)
+            result = scene.render(self.shape, step=0.002, max_step=0.1,
+                                  workers=1)
+            npt.assert_allclose(expected, result, atol=5e-3)
+            self.assertTrue((result[:, :, 3] > 0.1).any())
+
+    def test_render2(self):
+        '''Adaptive steps take fewer samples'''
+        counter = _CountingField(0)
+        scene = volpy.Scene(ambient=counter, camera=self.camera)
+        scene.render(self.shape, step=0.002, workers=1)
+        fixed = counter.count
+        counter.count = 0
+        scene.render(self.shape, step=0.002, max_step=0.1, workers=1)
+        self.assertLess(counter.count, fixed / 10)
+
+    def test_render3(self):
+        '''A maximum step equal to the step changes nothing'''
+        for scene in self._scenes():
+            expected = scene.render(self.shape, step=0.01, workers=1)
+            result = scene.render(self.shape, step=0.01, max_step=0.01,
+                                  workers=1)
+            npt.assert_array_equal(expected, result)
+
+    def test_render4(self):
+        '''The step defaults to the voxel spacing of the density grids'''
+        scene = volpy.Scene(ambient=self.grid, camera=self.camera)
+        step = self.grid.spacing().min()
+        expected = scene.render(self.shape, step=step, max_step=0.1)
+        result = scene.render(self.shape, max_step=0.1)
+        npt.assert_array_equal(expected, result)
+
+    def test_render5(self):
+        '''Maximum step must be at least the step'''
+        scene = volpy.Scene(ambient=1)
+        with self.assertRaises(ValueError) as cm:
+            scene.render(self.shape, step=0.1, max_step=0.01)
+        result, = cm.exception.args
+        expected = 'Maximum step must be at least the step size.'
+        self.assertEqual(expected, result)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (40, 30)
+        camera = volpy.Camera(eye=(0, 0, 0, 1), view=(0, 0, 1, 0), far=4)
+        self.scene = volpy.Scene(
+            ambient=volpy.Element(_soft_sphere, _stripes),
+            diffuse=_ball, scatter=3, camera=camera,
+        )
+        self.scene.lights.append(volpy.Light(_shadow, (1, 0.5, 0)))
+
+    def test_render1(self):
+        '''Batches of samples do not change the rendered image'''
+        expected = self.scene.render(self.shape, step=0.01, workers=1)
+        self.assertTrue((expected[:, :, 3] > 0.1).any())
+        for batch in (2, 7):
+            for compact in (True, False):
+                result = self.scene.render(self.shape, step=0.01, workers=1,
+                                           compact=compact, batch=batch)
+                npt.assert_allclose(expected, result, atol=1e-5)
+
+    def test_render2(self):
+        '''Batches of adaptive steps are close to fine steps'''
+        expected = self.scene.render(self.shape, step=0.002, workers=1)
+        for method in ('thread', 'native'):
+            result = self.scene.render(self.shape, step=0.002, max_step=0.1,
+                                       workers=1, method=method, batch=4)
+            npt.assert_allclose(expected, result, atol=5e-3)
+
+    def test_render3(self):
+        '''Batches of samples take fewer calls'''
+        counter = _CountingField(1)
+        scene = volpy.Scene(ambient=counter)
+        scene.render(self.shape, workers=1)
+        calls = counter.calls
+        counter.calls = 0
+        scene.render(self.shape, workers=1, batch=10)
+        self.assertLessEqual(counter.calls, calls / 5)
+
+    def test_render4(self):
+        '''Batch size must be positive'''
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render(self.shape, batch=0)
+        result, = cm.exception.args
+        self.assertEqual('Batch size must be positive.', result)
+
+
+class CoarseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (41, 30)
+        camera = volpy.Camera(eye=(0, 0, 0, 1), view=(0, 0, 1, 0), far=4)
+        self.scene = volpy.Scene(ambient=_ball, scatter=3, camera=camera)
+        self.expected = self.scene.render(self.shape, step=0.02, workers=1)
+
+    def test_render1(self):
+        '''Coarse rendering refines the edges'''
+        for method in ('thread', 'fork', 'native'):
+            result = self.scene.render(self.shape, step=0.02, workers=2,
+                                       method=method, coarse=4, tile=(8, 8))
+            npt.assert_allclose(self.expected, result, atol=1e-2)
+
+    def test_render2(self):
+        '''Coarse rendering traces fewer rays'''
+        counter = _CountingField(0)
+        self.scene.ambient = volpy.Element(counter)
+        self.scene.render(self.shape, step=0.1, workers=1)
+        full = counter.count
+        counter.count = 0
+        image = self.scene.render(self.shape, step=0.1, workers=1, coarse=4)
+        self.assertLess(counter.count, full / 4)
+        npt.assert_array_equal(0, image)
+
+    def test_render3(self):
+        '''Tracing every pixel is the same as not being coarse'''
+        result = self.scene.render(self.shape, step=0.02, workers=2,
+                                   coarse=1)
+        npt.assert_array_equal(self.expected, result)
+        result = self.scene.render(self.shape, step=0.02, workers=2,
+                                   coarse=3, coarse_tol=0)
+        npt.assert_array_equal(self.expected, result)
+
+    def test_render4(self):
+        '''Images too small to be divided into blocks'''
+        expected = self.scene.render((1, 30), step=0.02, workers=1)
+        result = self.scene.render((1, 30), step=0.02, workers=1, coarse=4)
+        npt.assert_array_equal(expected, result)
+
+    def test_render5(self):
+        '''Coarse spacing must be positive'''
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render(self.shape, coarse=0)
+        result, = cm.exception.args
+        expected = 'Coarse spacing must be positive.'
+        self.assertEqual(expected, result)
+
+
+def _soft_sphere(xyz):
+    norms = np.linalg.norm(xyz[:, :3] - (0, 0, 2.5), axis=1)
+    return np.clip(1 - norms, 0, None)
+
+
+def _ball(xyz):
+    norms = np.linalg.norm(xyz[:, :3] - (0.3, 0, 2.2), axis=1)
+    return np.where(norms < 0.4, 2., 0.)
+
+
+class TilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (50, 30)
+        bbox = volpy.BBox([[-0.4, -0.4, 1, 1], [0.4, 0.4, 1.8, 1]])
+        xyz = np.indices((8, 8, 8)).transpose(1, 2, 3, 0) / 7.
+        self.scene = volpy.Scene(
+            ambient=volpy.Element(_half_plane),
+            diffuse=volpy.Grid(xyz[:, :, :, 0], transform=bbox.transform()),
+        )
+        self.expected = self.scene.render(self.shape, workers=1)
+
+    def _assemble(self, tiles):
+        image = np.full((30, 50, 4), np.nan, dtype=np.float32)
+        for rows, cols, tile in tiles:
+            self.assertEqual(np.float32, tile.dtype)
+            self.assertTrue(np.isnan(image[rows, cols]).all())
+            image[rows, cols] = tile
+        return image
+
+    def test_render_tiles1(self):
+        '''Tiles cover the rendered image'''
+        tiles = list(self.scene.render_tiles(self.shape, tile=(16, 8),
+                                             workers=2))
+        self.assertEqual(16, len(tiles))
+        self.assertEqual((8, 16, 4), tiles[0][2].shape)
+        npt.assert_allclose(self.expected, self._assemble(tiles), atol=1e-6)
+
+    def test_render_tiles2(self):
+        '''Tiles with each method'''
+        for method in ('thread', 'fork', 'native'):
+            tiles = self.scene.render_tiles(self.shape, tile=(20, 20),
+                                            workers=2, method=method)
+            npt.assert_allclose(self.expected, self._assemble(tiles),
+                                atol=1e-6)
+
+    def test_render_tiles3(self):
+        '''Tiles with a worker pool'''
+        with volpy.WorkerPool('fork', workers=2) as pool:
+            tiles = self.scene.render_tiles(self.shape, pool=pool)
+            npt.assert_allclose(self.expected, self._assemble(tiles),
+                                atol=1e-6)
+
+    def test_render_tiles4(self):
+        '''Invalid arguments are reported before rendering'''
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render_tiles(self.shape, tile=(0, 8))
+        result, = cm.exception.args
+        self.assertEqual('Tile shape must be positive.', result)
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render_tiles(self.shape, method='spoon')
+        result, = cm.exception.args
+        self.assertEqual('Invalid method: spoon', result)
+
+
+class _PythonCamera(volpy.Camera):
+
+    def cast(self, imx, imy):
+        return super(_PythonCamera, self).cast(imx, imy)
+
+
+class RaysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (40, 30)
+        self.camera = volpy.Camera(eye=(0.1, -0.2, 0.3, 1),
+                                   view=(0.2, 0.1, 1, 0), fov=45, near=0.5)
+        self.camera.aspect_ratio = 40. / 30.
+        self.scene = volpy.Scene(ambient=volpy.Element(_half_plane),
+                                 camera=self.camera)
+
+    def _python_rays(self, rows, cols):
+        imy = np.linspace(0, 1, 30)[::-1][rows]
+        imx = np.linspace(0, 1, 40)[::-1][cols]
+        if isinstance(rows, slice):
+            imy, imx = np.repeat(imy, len(imx)), np.tile(imx, len(imy))
+        return self.camera.cast(imx, imy)
+
+    def test_rays1(self):
+        '''Native rays match Camera.cast()'''
+        tiles = [
+            (slice(None), slice(None)),
+            (slice(3, 11), slice(20, 40)),
+            (np.array([0, 29, 7]), np.array([39, 0, 12])),
+        ]
+        for rows, cols in tiles:
+            expected = self._python_rays(rows, cols)
+            result = self.scene._linspace_rays(self.shape, rows, cols)
+            for e, r in zip(expected, result):
+                self.assertEqual(np.float32, r.dtype)
+                self.assertTrue(r.flags.c_contiguous)
+                npt.assert_allclose(e[:, :3].T, r, atol=1e-6)
+
+    def test_rays2(self):
+        '''Cameras which override cast() are still used'''
+        expected = self.scene.render(self.shape, workers=1)
+        self.scene.camera = _PythonCamera(eye=self.camera.eye,
+                                          view=self.camera.view, fov=45,
+                                          near=0.5)
+        self.scene.camera.aspect_ratio = 40. / 30.
+        for method in ('thread', 'native'):
+            result = self.scene.render(self.shape, workers=1, method=method)
+            npt.assert_allclose(expected, result, atol=1e-6)
+
+    def test_rays3(self):
+        '''Native renders in strips match a single tile'''
+        expected = self.scene.render(self.shape, workers=1, tile=(40, 30))
+        for tile in ((40, 7), (5, 1)):
+            result = self.scene.render(self.shape, method='native',
+                                       tile=tile)
+            npt.assert_allclose(expected, result, atol=1e-6)
+
+
+class _CountingGrid(volpy.Grid):
+
+    count = 0
+
+    def __call__(self, xyz):
+        self.count += len(xyz)
+        return super().__call__(xyz)
+
+
+class _GridCallback(object):
+    '''Hides a grid behind a plain callable.'''
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.count = 0
+
+    def __call__(self, xyz):
+        self.count += len(xyz)
+        return volpy.Grid.__call__(self.grid, xyz)
+
+
+class LodTestCase(unittest.TestCase):
+
+    def setUp(self):
+        state = np.random.RandomState(0)
+        bbox = volpy.BBox([[-1, -1, 3, 1], [1, 1, 5, 1]])
+        self.grid = volpy.Grid(state.rand(64, 64, 64),
+                               transform=bbox.transform())
+        camera = volpy.Camera(eye=(0, 0, 0, 1), view=(0, 0, 1, 0), far=6)
+        self.scene = volpy.Scene(ambient=self.grid, scatter=1, camera=camera)
+        self.shape = (40, 30)
+
+    def test_render1(self):
+        '''Mipmaps are only used with a level of detail'''
+        expected = self.scene.render(self.shape, step=0.05, lod=4)
+        self.grid.build_mipmaps()
+        result = self.scene.render(self.shape, step=0.05)
+        npt.assert_equal(expected, result)
+
+    def test_render2(self):
+        '''Levels of detail blur the image'''
+        expected = self.scene.render(self.shape, step=0.02)
+        self.grid.build_mipmaps()
+        for method in ('thread', 'native'):
+            result = self.scene.render(self.shape, step=0.02, method=method,
+                                       lod=2)
+            self.assertLess(np.abs(expected - result).mean(), 0.01)
+            inside = expected[:, :, 3] > 0.5
+            self.assertLess(result[inside, 3].std(),
+                            expected[inside, 3].std())
+
+    def test_render3(self):
+        '''Level of detail must not be negative'''
+        with self.assertRaises(ValueError) as cm:
+            self.scene.render(self.shape, lod=-1)
+        result, = cm.exception.args
+        self.assertEqual('Level of detail must not be negative.', result)
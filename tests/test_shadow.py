@@ -0,0 +1,142 @@
+import numpy.testing as npt
+import numpy as np
+
+import pickle
+import unittest
+
+import volpy
+
+
+def _slab(xyz):
+    # Dense between y = 0.2 and y = 0.4.
+    return ((xyz[:, 1] >= 0.2) & (xyz[:, 1] <= 0.4)).astype(np.float64)
+
+
+class ShadowMapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bbox = volpy.BBox([[-1, -1, -1, 1], [1, 1, 1, 1]])
+        self.grid = volpy.Grid(np.zeros((41, 41, 41)),
+                               transform=self.bbox.transform())
+        self.grid.stamp(_slab)
+        self.points = np.array([[0, -0.5, 0, 1], [0, 0.6, 0, 1],
+                                [0.3, 0, 0.2, 1]])
+
+    def _shadow(self, density=None, **kwargs):
+        if 'position' not in kwargs:
+            kwargs.setdefault('direction', (0, -1, 0, 0))
+        return volpy.ShadowMap(self.grid if density is None else density,
+                               (21, 21, 21), transform=self.bbox.transform(),
+                               **kwargs)
+
+    def test_bake1(self):
+        '''Optical depth towards a directional light'''
+        shadow = self._shadow()
+        self.assertIsInstance(shadow, volpy.Grid)
+        npt.assert_allclose([0.2, 0, 0.2], shadow(self.points), atol=1e-6)
+
+    def test_bake2(self):
+        '''Optical depth towards a point light'''
+        shadow = self._shadow(position=(0, 5, 0, 1))
+        vertical, oblique, beyond = shadow([[0, -0.5, 0, 1],
+                                            [0.5, -0.5, 0, 1],
+                                            [0, 0, 0, 1]])
+        npt.assert_allclose(0.2, vertical, atol=1e-6)
+        npt.assert_allclose(0.2 * np.hypot(0.5, 5.5) / 5.5, oblique,
+                            rtol=0.05)
+        # Nothing lies between the light and points above the slab.
+        shadow.position = (0, 0.3, 0, 1)
+        npt.assert_allclose(0, shadow([[0, 0.6, 0, 1]]), atol=1e-6)
+
+    def test_bake3(self):
+        '''Fields other than grids are baked at the resolution of the map'''
+        shadow = self._shadow(_slab)
+        npt.assert_allclose([0.2, 0, 0.2], shadow(self.points), atol=0.03)
+
+    def test_bake_error(self):
+        '''The light must be either a point or a direction'''
+        for kwargs in ({'direction': None},
+                       {'position': (0, 5, 0, 1), 'direction': (0, -1, 0, 0)}):
+            with self.assertRaises(ValueError) as cm:
+                self._shadow(**kwargs)
+            result, = cm.exception.args
+            expected = 'Exactly one of position and direction is required.'
+            self.assertEqual(expected, result)
+
+    def test_update1(self):
+        '''Stamping the density grid makes the map stale'''
+        shadow = self._shadow()
+        self.assertFalse(shadow.stale)
+        self.assertFalse(shadow.update())
+        self.grid.stamp(lambda xyz: np.zeros(len(xyz)))
+        self.assertTrue(shadow.stale)
+        self.assertTrue(shadow.update())
+        npt.assert_allclose(0, shadow(self.points), atol=1e-6)
+
+    def test_update2(self):
+        '''Moving the light makes the map stale'''
+        shadow = self._shadow()
+        shadow.direction = (0, 1, 0, 0)
+        self.assertIsNone(shadow.position)
+        self.assertTrue(shadow.stale)
+        shadow.update()
+        npt.assert_allclose([0, 0.2, 0], shadow(self.points), atol=1e-6)
+
+    def test_update3(self):
+        '''Other fields are baked again once invalidated'''
+        thickness = [0.2]
+
+        def slab(xyz):
+            return ((xyz[:, 1] >= 0.2)
+                    & (xyz[:, 1] <= 0.2 + thickness[0])).astype(np.float64)
+
+        shadow = self._shadow(slab)
+        thickness[0] = 0.4
+        self.assertFalse(shadow.update())
+        shadow.invalidate()
+        self.assertTrue(shadow.update())
+        npt.assert_allclose(0.4, shadow([[0, -0.5, 0, 1]]), atol=0.03)
+
+    def test_pickle1(self):
+        '''The density is not pickled along with the map'''
+        shadow = pickle.loads(pickle.dumps(self._shadow(_slab)))
+        self.assertIsNone(shadow.density)
+        self.assertFalse(shadow.stale)
+        npt.assert_allclose([0.2, 0, 0.2], shadow(self.points), atol=0.03)
+
+
+class BakeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (30, 20)
+        bbox = volpy.BBox([[-0.5, -0.5, 1.5, 1], [0.5, 0.5, 2.5, 1]])
+        self.grid = volpy.Grid(np.zeros((16, 16, 16)),
+                               transform=bbox.transform())
+        self.grid.stamp(lambda xyz: 4 * (xyz[:, 0] > 0))
+        self.scene = volpy.Scene(diffuse=self.grid)
+        self.light = volpy.Light(None, (1, 0.5, 0.25))
+        self.scene.lights.append(self.light)
+        self.shadow = self.light.bake(self.grid, (16, 16, 16),
+                                      transform=bbox.transform(),
+                                      direction=(1, -1, 0, 0))
+
+    def test_render1(self):
+        '''Baked shadows render like the same shadows given as a callable'''
+        self.assertIs(self.shadow, self.light.field)
+        grid = volpy.Grid(self.shadow.array, transform=self.shadow.transform)
+        expected = volpy.Scene(diffuse=self.grid)
+        expected.lights.append(volpy.Light(lambda xyz: grid(xyz),
+                                           self.light.color))
+        expected = expected.render(self.shape, workers=1)
+        for method in ('thread', 'fork', 'native'):
+            result = self.scene.render(self.shape, workers=2, method=method)
+            npt.assert_allclose(expected, result, atol=1e-5)
+
+    def test_render2(self):
+        '''Rendering bakes stale shadow maps first'''
+        before = self.scene.render(self.shape, workers=1)
+        self.grid.stamp(lambda xyz: 4 * (xyz[:, 0] > 0.2))
+        self.assertTrue(self.shadow.stale)
+        result = self.scene.render(self.shape, workers=1)
+        self.assertFalse(self.shadow.stale)
+        self.assertFalse(np.allclose(before, result))
@@ -0,0 +1,116 @@
+import volpy
+
+import numpy as np
+import numpy.testing as npt
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def _ball(xyz):
+    return np.where(np.linalg.norm(xyz[:, :3], axis=1) < 0.2, 1., 0.)
+
+
+class SparseGridTestCase(unittest.TestCase):
+
+    def setUp(self):
+        state = np.random.RandomState(0)
+        self.array = np.zeros((20, 21, 19))
+        self.array[3:7, 5:9, 2:4] = state.rand(4, 4, 2)
+        self.array[19, 20, 18] = 2
+        self.grid = volpy.SparseGrid.from_array(self.array, brick=4)
+        self.xyz = state.uniform(-0.6, 0.6, (1000, 4))
+        self.xyz[:, 3] = 1
+
+    def test_init1(self):
+        self.assertEqual(0, volpy.SparseGrid((4, 4, 4)).nbricks)
+        with self.assertRaises(ValueError):
+            volpy.SparseGrid((4, 4))
+        with self.assertRaises(ValueError):
+            volpy.SparseGrid((4, 0, 4))
+        with self.assertRaises(ValueError):
+            volpy.SparseGrid((4, 4, 4), brick=0)
+
+    def test_bricks1(self):
+        '''Only bricks holding values are stored'''
+        npt.assert_equal([5, 6, 5], self.grid.table.shape)
+        self.assertEqual(5, self.grid.nbricks)
+        self.assertEqual((5, 4, 4, 4), self.grid.bricks.shape)
+        self.assertEqual(-1, self.grid.table[2, 2, 2])
+        self.assertLess(self.grid.nbytes, self.array.nbytes / 4)
+
+    def test_call1(self):
+        '''Sparse grids sample like dense ones'''
+        expected = volpy.Grid(self.array)(self.xyz)
+        npt.assert_almost_equal(expected, self.grid(self.xyz), decimal=6)
+
+    def test_call2(self):
+        '''Unstored bricks and points outside have the background value'''
+        grid = volpy.SparseGrid.from_array(self.array + 3, background=3,
+                                           brick=4)
+        self.assertEqual(5, grid.nbricks)
+        result = grid([[0.2, 0.2, 0.2, 1], [0.6, 0, 0, 1]])
+        npt.assert_almost_equal([3, 3], result)
+
+    def test_call3(self):
+        '''Vector sparse grids'''
+        array = np.zeros((9, 9, 9, 3))
+        array[2:4, 2:4, 2:4] = [1, 2, 3]
+        grid = volpy.SparseGrid.from_array(array, brick=3)
+        expected = volpy.Grid(array)(self.xyz)
+        npt.assert_almost_equal(expected, grid(self.xyz), decimal=6)
+
+    def test_call_out1(self):
+        '''Sparse grid samples into a given output array'''
+        out = np.empty((2, len(self.xyz)), dtype=np.float32)[:, 0]
+        with self.assertRaises(ValueError):
+            self.grid(self.xyz, out=out)
+        out = np.empty((len(self.xyz), 2), dtype=np.float32)[:, 0]
+        self.assertIs(out, self.grid(self.xyz, out=out))
+        npt.assert_almost_equal(self.grid(self.xyz), out)
+
+    def test_stamp1(self):
+        grid = volpy.SparseGrid((32, 32, 32), brick=8)
+        grid.stamp(_ball)
+        dense = volpy.Grid(np.zeros((32, 32, 32)))
+        dense.stamp(_ball)
+        self.assertEqual(8, grid.nbricks)
+        npt.assert_almost_equal(dense(self.xyz), grid(self.xyz))
+
+    def test_pstamp1(self):
+        grid = volpy.SparseGrid((32, 32, 32), brick=8)
+        grid.pstamp(_ball, workers=2)
+        dense = volpy.Grid(np.zeros((32, 32, 32)))
+        dense.stamp(_ball)
+        npt.assert_almost_equal(dense(self.xyz), grid(self.xyz))
+
+    def test_clear1(self):
+        version = self.grid.version
+        self.grid.clear()
+        self.assertEqual(0, self.grid.nbricks)
+        self.assertLess(version, self.grid.version)
+        npt.assert_equal(0, self.grid(self.xyz))
+
+    def test_from_array1(self):
+        '''Sparse grids can be built from memory-mapped arrays'''
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'grid.npy')
+            np.save(path, self.array.astype(np.float32))
+            array = np.load(path, mmap_mode='r')
+            grid = volpy.SparseGrid.from_array(array, brick=4)
+            npt.assert_equal(self.grid.bricks, grid.bricks)
+            del array
+        finally:
+            shutil.rmtree(directory)
+
+    def test_render1(self):
+        '''Sparse density grids render like dense ones'''
+        scene = volpy.Scene(ambient=volpy.Element(volpy.Grid(self.array)))
+        expected = scene.render((16, 16), step=0.05)
+        scene.ambient = volpy.Element(self.grid)
+        npt.assert_almost_equal(self.grid.bbox(), scene.ambient.bbox())
+        result = scene.render((16, 16), step=0.05)
+        npt.assert_almost_equal(expected, result, decimal=5)
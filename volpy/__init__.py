@@ -5,7 +5,7 @@ Volpy
 A slightly fast volume rendering implementation for Python. Volpy has support
 for:
 
-  1. Multithreading or multiprocessing at the rendering step
+  1. Multithreading, multiprocessing or OpenMP at the rendering step
   2. Native implementation of ray casting
   3. Native access to NumPy arrays during rendering
   4. Support for ambient and diffuse lighting terms
@@ -24,7 +24,10 @@ from .camera import Camera
 from .scene import Scene, Element, Light
 from .version import __version__
 from .grid import Grid
+from .sparse import SparseGrid
+from .shadow import ShadowMap
 from .homogeneous import (translate, scale, rotatex, rotatey, rotatez, rotatexyz,
                           rotate_axis, cross)
 from .geometry import Geometry, BBox
-from .peval import peval
+from .peval import peval, openmp_enabled, get_num_threads, set_num_threads
+from .pool import WorkerPool
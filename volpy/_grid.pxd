@@ -0,0 +1,116 @@
+cimport numpy as np
+
+ctypedef np.float32_t GEOM_t
+ctypedef np.float32_t RESULT_t
+
+
+# The storage types of grid arrays.
+cdef enum GridType:
+    GRID_FLOAT64
+    GRID_FLOAT32
+    GRID_FLOAT16
+    GRID_UINT8
+    GRID_UINT16
+
+
+# A borrowed, GIL-free view of a volpy.Grid. The grid object (and therefore
+# its array) must be kept alive by the caller while the view is in use. The
+# value of a voxel is its stored value times the scale plus the offset.
+cdef struct GridView:
+    char *data
+    Py_ssize_t shape[3]
+    Py_ssize_t strides[4]
+    Py_ssize_t channels
+    GridType type
+    double scale
+    double offset
+    float transform[3][4]
+    float default
+
+
+# The most levels a mipmap view holds.
+cdef enum:
+    MAX_MIPMAP_LEVELS = 16
+
+
+# A borrowed, GIL-free view of a volpy.grid.Mipmaps pyramid. The spacings
+# are the smallest world-space voxel spacing of each level.
+cdef struct MipmapView:
+    GridView levels[MAX_MIPMAP_LEVELS]
+    double spacings[MAX_MIPMAP_LEVELS]
+    int count
+
+
+# A borrowed, GIL-free view of a volpy.SparseGrid. The table holds the index
+# of the brick of voxels at every brick coordinate, or -1 for bricks which
+# hold only the background value.
+cdef struct SparseView:
+    char *data
+    const Py_ssize_t *table
+    Py_ssize_t table_shape[3]
+    Py_ssize_t shape[3]
+    Py_ssize_t strides[5]
+    Py_ssize_t channels
+    Py_ssize_t brick
+    float transform[3][4]
+    float background
+
+
+# A borrowed, GIL-free view of a volpy.grid.Macrocells pyramid.
+cdef struct MacrocellView:
+    RESULT_t *maxs
+    Py_ssize_t *offsets
+    Py_ssize_t *shapes
+    int levels
+    int block
+    RESULT_t threshold
+    Py_ssize_t grid_shape[3]
+    double transform[3][4]
+
+
+cdef int num_threads() noexcept nogil
+
+cdef int grid_view_init(GridView *view, object grid) except -1
+
+cdef void grid_view_sample(
+    const GridView *view,
+    float x,
+    float y,
+    float z,
+    RESULT_t *result,
+) noexcept nogil
+
+cdef int mipmap_view_init(MipmapView *view, object mipmaps) except -1
+
+cdef void mipmap_view_sample(
+    const MipmapView *view,
+    float x,
+    float y,
+    float z,
+    double footprint,
+    RESULT_t *result,
+    RESULT_t *scratch,
+) noexcept nogil
+
+cdef int sparse_view_init(SparseView *view, object grid) except -1
+
+cdef void sparse_view_sample(
+    const SparseView *view,
+    float x,
+    float y,
+    float z,
+    RESULT_t *result,
+) noexcept nogil
+
+cdef int macrocell_view_init(MacrocellView *view, object macrocells) except -1
+
+cdef double macrocell_span(
+    const MacrocellView *view,
+    float x,
+    float y,
+    float z,
+    float dx,
+    float dy,
+    float dz,
+    double limit,
+) noexcept nogil
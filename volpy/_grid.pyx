@@ -1,66 +1,350 @@
 import numpy as np
+cimport cython
 cimport numpy as np
+cimport libc.math as math
+from cython.parallel cimport prange
 
-ctypedef np.float64_t GRID_t
-ctypedef np.float32_t GEOM_t
-ctypedef np.float32_t RESULT_t
+np.import_array()
 
-cpdef void grid_scalar_eval(
-    GRID_t [:, :, :] array,
-    GEOM_t [:, :] transform,
-    GEOM_t [:, :] xyz,
-    RESULT_t default,
-    RESULT_t [:] result,
-) nogil:
-    cdef int count = xyz.shape[0], idx
+
+cdef extern from *:
+    """
+    #ifdef _OPENMP
+    #include <omp.h>
+    static int volpy_openmp_enabled(void) { return 1; }
+    static int volpy_max_threads(void) { return omp_get_max_threads(); }
+    #else
+    static int volpy_openmp_enabled(void) { return 0; }
+    static int volpy_max_threads(void) { return 1; }
+    #endif
+    """
+    int volpy_openmp_enabled() noexcept nogil
+    int volpy_max_threads() noexcept nogil
+
+
+cdef extern from *:
+    """
+    static float volpy_half_to_float(unsigned short half) {
+        /* IEEE 754 binary16 to binary32, including subnormals, infinities
+           and NaNs. */
+        union { unsigned int bits; float value; } result;
+        unsigned int sign = (unsigned int) (half & 0x8000u) << 16;
+        unsigned int exponent = (half >> 10) & 0x1fu;
+        unsigned int mantissa = half & 0x3ffu;
+        if (exponent == 0x1fu) {
+            result.bits = sign | 0x7f800000u | (mantissa << 13);
+        } else if (exponent != 0) {
+            result.bits = sign | ((exponent + 112) << 23) | (mantissa << 13);
+        } else {
+            result.value = mantissa * (1.0f / 16777216.0f);
+            result.bits |= sign;
+        }
+        return result.value;
+    }
+    """
+    float volpy_half_to_float(unsigned short half) noexcept nogil
+
+
+# The storage types of the grid arrays which can be evaluated natively.
+_GRID_TYPES = {
+    np.dtype(np.float64): GRID_FLOAT64,
+    np.dtype(np.float32): GRID_FLOAT32,
+    np.dtype(np.float16): GRID_FLOAT16,
+    np.dtype(np.uint8): GRID_UINT8,
+    np.dtype(np.uint16): GRID_UINT16,
+}
+
+
+# Number of threads used by the parallel native kernels.
+cdef int _num_threads = volpy_max_threads()
+
+
+cdef int num_threads() noexcept nogil:
+    return _num_threads
+
+
+def openmp_enabled():
+    '''
+    Returns True if the native kernels were built with OpenMP support.
+
+    '''
+    return bool(volpy_openmp_enabled())
+
+
+def get_num_threads():
+    '''
+    Returns the number of threads used by the native kernels.
+
+    '''
+    return _num_threads
+
+
+def set_num_threads(int threads):
+    '''
+    Set the number of threads used by the native kernels. This has no effect
+    unless volpy was built with OpenMP support.
+
+    Parameters
+    ----------
+    threads : int
+        The number of threads. Defaults to the number of CPUs when OpenMP is
+        enabled.
+
+    '''
+    global _num_threads
+    if threads < 1:
+        raise ValueError('Must have at least 1 thread.')
+    _num_threads = threads
+
+
+def grid_eval(grid, GEOM_t [:, :] xyz, RESULT_t [:, ::1] result):
+    # Sample every channel of a grid at homogeneous world-space positions
+    # with w = 1.
+    cdef GridView view
+    cdef Py_ssize_t idx
+    grid_view_init(&view, grid)
     with nogil:
-        for idx in range(count):
-            result[idx] = grid_scalar_eval_at(array, transform, xyz, default,
-                                              idx)
+        for idx in prange(xyz.shape[0], num_threads=_num_threads,
+                          schedule='static'):
+            grid_view_sample(&view, xyz[idx, 0], xyz[idx, 1], xyz[idx, 2],
+                             &result[idx, 0])
 
 
-cpdef void grid_vector_eval(
-    GRID_t [:, :, :, :] array,
-    GEOM_t [:, :] transform,
-    GEOM_t [:, :] xyz,
-    RESULT_t default,
-    RESULT_t [:, :] result,
-) nogil:
-    cdef int count = xyz.shape[0], dim = array.shape[3], i, j
+def sparse_grid_eval(grid, GEOM_t [:, :] xyz, RESULT_t [:, ::1] result):
+    # Sample every channel of a sparse grid at homogeneous world-space
+    # positions with w = 1.
+    cdef SparseView view
+    cdef Py_ssize_t idx
+    sparse_view_init(&view, grid)
     with nogil:
-        for i in range(count):
-            for j in range(dim):
-                result[i, j] = grid_scalar_eval_at(array[:, :, :, j],
-                                                   transform, xyz, default, i)
+        for idx in prange(xyz.shape[0], num_threads=_num_threads,
+                          schedule='static'):
+            sparse_view_sample(&view, xyz[idx, 0], xyz[idx, 1], xyz[idx, 2],
+                               &result[idx, 0])
+
 
+def grid_resample(
+    grid,
+    RESULT_t [:, :, :, ::1] result,
+    int axis,
+    Py_ssize_t [:, ::1] index,
+    RESULT_t [:, ::1] weight,
+):
+    # Filter a grid along one axis into a (possibly) smaller array. Voxel a of
+    # the result along the axis is the sum of the grid voxels at the indices
+    # in row a of index, times the weights in row a of weight. The channels
+    # of the grid are the last axis of the result.
+    cdef GridView view
+    cdef Py_ssize_t i
+    grid_view_init(&view, grid)
+    with nogil:
+        for i in prange(result.shape[0], num_threads=_num_threads,
+                        schedule='static'):
+            _resample_slice(&view, result, axis, index, weight, i)
 
-cdef RESULT_t grid_scalar_eval_at(
-    GRID_t [:, :, :] array,
-    GEOM_t [:, :] transform,
+
+cdef void _resample_slice(
+    const GridView *view,
+    RESULT_t [:, :, :, ::1] result,
+    int axis,
+    Py_ssize_t [:, ::1] index,
+    RESULT_t [:, ::1] weight,
+    Py_ssize_t i,
+) noexcept nogil:
+    cdef Py_ssize_t[3] voxel
+    cdef Py_ssize_t j, k, c, t, a
+    cdef double value
+    for j in range(result.shape[1]):
+        for k in range(result.shape[2]):
+            voxel[0] = i
+            voxel[1] = j
+            voxel[2] = k
+            a = voxel[axis]
+            for c in range(result.shape[3]):
+                value = 0
+                for t in range(index.shape[1]):
+                    voxel[axis] = index[a, t]
+                    value += weight[a, t] * grid_view_voxel(
+                        view, voxel[0], voxel[1], voxel[2], c)
+                result[i, j, k, c] = value
+
+
+def mipmap_eval(
+    mipmaps,
     GEOM_t [:, :] xyz,
-    RESULT_t default,
-    int idx,
+    GEOM_t [:] footprint,
+    RESULT_t [:, ::1] result,
+    RESULT_t [:, ::1] scratch,
+):
+    # Sample every channel of a mipmap pyramid at homogeneous world-space
+    # positions with w = 1, at the level matching the footprint of each.
+    cdef MipmapView view
+    cdef Py_ssize_t idx
+    mipmap_view_init(&view, mipmaps)
+    with nogil:
+        for idx in prange(xyz.shape[0], num_threads=_num_threads,
+                          schedule='static'):
+            mipmap_view_sample(&view, xyz[idx, 0], xyz[idx, 1], xyz[idx, 2],
+                               footprint[idx], &result[idx, 0],
+                               &scratch[idx, 0])
+
+
+def grid_block_minmax(
+    grid,
+    int block,
+    RESULT_t [:, :, :] mins,
+    RESULT_t [:, :, :] maxs,
+    Py_ssize_t [:] lo,
+    Py_ssize_t [:] hi,
+):
+    # Each block covers the voxels [c * block, (c + 1) * block] along each
+    # axis, inclusive, so that every voxel touched by a trilinear lookup
+    # inside of the block is accounted for.
+    cdef GridView view
+    cdef Py_ssize_t a, b, c, i, j, k
+    cdef Py_ssize_t i1, j1, k1, start = lo[0], end = hi[0]
+    cdef RESULT_t value, low, high
+    grid_view_init(&view, grid)
+    with nogil:
+        for a in prange(start, end, num_threads=_num_threads,
+                        schedule='dynamic'):
+            i1 = min((a + 1) * block, view.shape[0] - 1)
+            for b in range(lo[1], hi[1]):
+                j1 = min((b + 1) * block, view.shape[1] - 1)
+                for c in range(lo[2], hi[2]):
+                    k1 = min((c + 1) * block, view.shape[2] - 1)
+                    low = grid_view_voxel(&view, a * block, b * block,
+                                          c * block, 0)
+                    high = low
+                    for i in range(a * block, i1 + 1):
+                        for j in range(b * block, j1 + 1):
+                            for k in range(c * block, k1 + 1):
+                                value = grid_view_voxel(&view, i, j, k, 0)
+                                if value < low:
+                                    low = value
+                                if value > high:
+                                    high = value
+                    mins[a, b, c] = low
+                    maxs[a, b, c] = high
+
+
+cpdef void grid_pyramid_reduce(
+    RESULT_t [:, :, :] child_mins,
+    RESULT_t [:, :, :] child_maxs,
+    RESULT_t [:, :, :] mins,
+    RESULT_t [:, :, :] maxs,
+    Py_ssize_t [:] lo,
+    Py_ssize_t [:] hi,
 ) nogil:
+    # Each parent cell is the union of the 2x2x2 child cells below it.
+    cdef Py_ssize_t a, b, c, i, j, k, start = lo[0], end = hi[0]
+    cdef RESULT_t low, high
+    with nogil:
+        for a in prange(start, end, num_threads=_num_threads,
+                        schedule='dynamic'):
+            for b in range(lo[1], hi[1]):
+                for c in range(lo[2], hi[2]):
+                    low = child_mins[2 * a, 2 * b, 2 * c]
+                    high = child_maxs[2 * a, 2 * b, 2 * c]
+                    for i in range(2 * a, min(2 * a + 2, child_mins.shape[0])):
+                        for j in range(2 * b,
+                                       min(2 * b + 2, child_mins.shape[1])):
+                            for k in range(2 * c,
+                                           min(2 * c + 2, child_mins.shape[2])):
+                                low = min(low, child_mins[i, j, k])
+                                high = max(high, child_maxs[i, j, k])
+                    mins[a, b, c] = low
+                    maxs[a, b, c] = high
+
+
+def grid_empty_span(
+    macrocells,
+    GEOM_t [:, :] positions,
+    GEOM_t [:, :] directions,
+    GEOM_t [:] limit,
+    GEOM_t [:] span,
+):
+    # For each ray, find the distance it can travel from its current position
+    # through macrocells whose maximum value is at most the threshold.
+    cdef MacrocellView view
+    cdef Py_ssize_t idx
+    macrocell_view_init(&view, macrocells)
+    with nogil:
+        for idx in prange(positions.shape[0], num_threads=_num_threads,
+                          schedule='dynamic'):
+            span[idx] = macrocell_span(
+                &view,
+                positions[idx, 0], positions[idx, 1], positions[idx, 2],
+                directions[idx, 0], directions[idx, 1], directions[idx, 2],
+                limit[idx],
+            )
+
+
+cdef int grid_view_init(GridView *view, object grid) except -1:
+    cdef np.ndarray array = grid.array
+    cdef np.ndarray transform = np.asarray(grid.transform, dtype=np.float32)
+    cdef int axis, col
+    if array.dtype not in _GRID_TYPES or array.ndim not in (3, 4):
+        raise ValueError('Unsupported grid array: %s %dD'
+                         % (array.dtype, array.ndim))
+    view.type = _GRID_TYPES[array.dtype]
+    view.scale = grid.scale
+    view.offset = grid.offset
+    view.data = <char *> np.PyArray_DATA(array)
+    for axis in range(3):
+        view.shape[axis] = array.shape[axis]
+        view.strides[axis] = array.strides[axis]
+        for col in range(4):
+            view.transform[axis][col] = transform[axis, col]
+    if array.ndim == 4:
+        view.channels = array.shape[3]
+        view.strides[3] = array.strides[3]
+    else:
+        view.channels = 1
+        view.strides[3] = 0
+    view.default = grid.default
+    return 0
+
+
+cdef void grid_view_sample(
+    const GridView *view,
+    float x,
+    float y,
+    float z,
+    RESULT_t *result,
+) noexcept nogil:
+    # Trilinear interpolation of all channels of the grid at a world-space
+    # position. The corner offsets and weights are computed once and shared
+    # by every channel.
     cdef float i, j, k, q0, q1, q2, p0, p1, p2
-    cdef int i0, j0, k0, i1, j1, k1
+    cdef float[8] weights
+    cdef Py_ssize_t[8] offsets
+    cdef Py_ssize_t i0, j0, k0, i1, j1, k1, c
 
-    grid_transform(xyz, transform, idx, &i, &j, &k)
+    i = (view.transform[0][0] * x + view.transform[0][1] * y +
+         view.transform[0][2] * z + view.transform[0][3])
+    j = (view.transform[1][0] * x + view.transform[1][1] * y +
+         view.transform[1][2] * z + view.transform[1][3])
+    k = (view.transform[2][0] * x + view.transform[2][1] * y +
+         view.transform[2][2] * z + view.transform[2][3])
     if (
         i < -0.5 or i > 0.5
         or j < -0.5 or j > 0.5
         or k < -0.5 or k > 0.5
     ):
-        return default
-    i += 0.5
-    j += 0.5
-    k += 0.5
-
-    i0 = int(i)
-    j0 = int(j)
-    k0 = int(k)
-    i1 = i0 + 1 if i0 < array.shape[0] - 1 else i0
-    j1 = j0 + 1 if j0 < array.shape[1] - 1 else j0
-    k1 = k0 + 1 if k0 < array.shape[2] - 1 else k0
+        for c in range(view.channels):
+            result[c] = view.default
+        return
+    i = (i + 0.5) * (view.shape[0] - 1)
+    j = (j + 0.5) * (view.shape[1] - 1)
+    k = (k + 0.5) * (view.shape[2] - 1)
+
+    i0 = <Py_ssize_t> i
+    j0 = <Py_ssize_t> j
+    k0 = <Py_ssize_t> k
+    i1 = i0 + 1 if i0 < view.shape[0] - 1 else i0
+    j1 = j0 + 1 if j0 < view.shape[1] - 1 else j0
+    k1 = k0 + 1 if k0 < view.shape[2] - 1 else k0
 
     q0 = i - i0
     q1 = j - j0
@@ -69,35 +353,348 @@ cdef RESULT_t grid_scalar_eval_at(
     p1 = 1 - q1
     p2 = 1 - q2
 
-    return (
-        array[i0, j0, k0] * p0 * p1 * p2 +
-        array[i1, j0, k0] * q0 * p1 * p2 +
-        array[i0, j1, k0] * p0 * q1 * p2 +
-        array[i1, j1, k0] * q0 * q1 * p2 +
-        array[i0, j0, k1] * p0 * p1 * q2 +
-        array[i1, j0, k1] * q0 * p1 * q2 +
-        array[i0, j1, k1] * p0 * q1 * q2 +
-        array[i1, j1, k1] * q0 * q1 * q2
-    )
+    weights[0] = p0 * p1 * p2
+    weights[1] = q0 * p1 * p2
+    weights[2] = p0 * q1 * p2
+    weights[3] = q0 * q1 * p2
+    weights[4] = p0 * p1 * q2
+    weights[5] = q0 * p1 * q2
+    weights[6] = p0 * q1 * q2
+    weights[7] = q0 * q1 * q2
 
+    i0 *= view.strides[0]
+    i1 *= view.strides[0]
+    j0 *= view.strides[1]
+    j1 *= view.strides[1]
+    k0 *= view.strides[2]
+    k1 *= view.strides[2]
+    offsets[0] = i0 + j0 + k0
+    offsets[1] = i1 + j0 + k0
+    offsets[2] = i0 + j1 + k0
+    offsets[3] = i1 + j1 + k0
+    offsets[4] = i0 + j0 + k1
+    offsets[5] = i1 + j0 + k1
+    offsets[6] = i0 + j1 + k1
+    offsets[7] = i1 + j1 + k1
 
-cdef void grid_transform(
-    GEOM_t [:, :] xyz,
-    GEOM_t [:, :] transform,
-    int idx,
-    float *i,
-    float *j,
-    float *k,
-) nogil:
-    i[0] = (transform[0, 0] * xyz[idx, 0] +
-            transform[0, 1] * xyz[idx, 1] +
-            transform[0, 2] * xyz[idx, 2] +
-            transform[0, 3] * xyz[idx, 3])
-    j[0] = (transform[1, 0] * xyz[idx, 0] +
-            transform[1, 1] * xyz[idx, 1] +
-            transform[1, 2] * xyz[idx, 2] +
-            transform[1, 3] * xyz[idx, 3])
-    k[0] = (transform[2, 0] * xyz[idx, 0] +
-            transform[2, 1] * xyz[idx, 1] +
-            transform[2, 2] * xyz[idx, 2] +
-            transform[2, 3] * xyz[idx, 3])
+    for c in range(view.channels):
+        result[c] = _interpolate(view.type, view.data + c * view.strides[3],
+                                 offsets, weights) * view.scale + view.offset
+
+
+cdef inline double _interpolate(
+    GridType type,
+    const char *data,
+    const Py_ssize_t *offsets,
+    const float *weights,
+) noexcept nogil:
+    # Weighted sum of the stored values at the corners of a cell. The type is
+    # dispatched once per cell rather than once per corner.
+    cdef double value = 0
+    cdef int corner
+    if type == GRID_FLOAT64:
+        for corner in range(8):
+            value += (<const np.float64_t *> (data + offsets[corner]))[0] \
+                * weights[corner]
+    elif type == GRID_FLOAT32:
+        for corner in range(8):
+            value += (<const np.float32_t *> (data + offsets[corner]))[0] \
+                * weights[corner]
+    elif type == GRID_FLOAT16:
+        for corner in range(8):
+            value += volpy_half_to_float(
+                (<const np.uint16_t *> (data + offsets[corner]))[0]
+            ) * weights[corner]
+    elif type == GRID_UINT8:
+        for corner in range(8):
+            value += (<const np.uint8_t *> (data + offsets[corner]))[0] \
+                * weights[corner]
+    else:
+        for corner in range(8):
+            value += (<const np.uint16_t *> (data + offsets[corner]))[0] \
+                * weights[corner]
+    return value
+
+
+cdef inline double grid_view_voxel(
+    const GridView *view,
+    Py_ssize_t i,
+    Py_ssize_t j,
+    Py_ssize_t k,
+    Py_ssize_t c,
+) noexcept nogil:
+    # The value of a channel of a voxel.
+    cdef const char *data = (view.data + i * view.strides[0]
+                             + j * view.strides[1] + k * view.strides[2]
+                             + c * view.strides[3])
+    cdef double value
+    if view.type == GRID_FLOAT64:
+        value = (<const np.float64_t *> data)[0]
+    elif view.type == GRID_FLOAT32:
+        value = (<const np.float32_t *> data)[0]
+    elif view.type == GRID_FLOAT16:
+        value = volpy_half_to_float((<const np.uint16_t *> data)[0])
+    elif view.type == GRID_UINT8:
+        value = (<const np.uint8_t *> data)[0]
+    else:
+        value = (<const np.uint16_t *> data)[0]
+    return value * view.scale + view.offset
+
+
+cdef int mipmap_view_init(MipmapView *view, object mipmaps) except -1:
+    cdef int level
+    if mipmaps.levels > MAX_MIPMAP_LEVELS:
+        raise ValueError('Too many mipmap levels: %d' % mipmaps.levels)
+    for level in range(mipmaps.levels):
+        grid_view_init(&view.levels[level], mipmaps.grids[level])
+        view.spacings[level] = mipmaps.spacings[level]
+    view.count = mipmaps.levels
+    return 0
+
+
+@cython.cdivision(True)
+cdef void mipmap_view_sample(
+    const MipmapView *view,
+    float x,
+    float y,
+    float z,
+    double footprint,
+    RESULT_t *result,
+    RESULT_t *scratch,
+) noexcept nogil:
+    # Sample the coarsest level whose voxels are no wider than the footprint,
+    # blended linearly toward the next coarser level. The scratch space holds
+    # the channels of one sample.
+    cdef int level = 0
+    cdef double weight
+    cdef Py_ssize_t c
+    while level + 1 < view.count and view.spacings[level + 1] <= footprint:
+        level += 1
+    grid_view_sample(&view.levels[level], x, y, z, result)
+    if level + 1 == view.count or footprint <= view.spacings[level]:
+        return
+    weight = ((footprint - view.spacings[level])
+              / (view.spacings[level + 1] - view.spacings[level]))
+    grid_view_sample(&view.levels[level + 1], x, y, z, scratch)
+    for c in range(view.levels[level].channels):
+        result[c] += weight * (scratch[c] - result[c])
+
+
+cdef int sparse_view_init(SparseView *view, object grid) except -1:
+    cdef np.ndarray bricks = grid._bricks
+    cdef np.ndarray table = grid.table
+    cdef np.ndarray transform = np.asarray(grid.transform, dtype=np.float32)
+    cdef int axis, col
+    if (
+        bricks.dtype != np.float32 or not bricks.flags.c_contiguous
+        or table.dtype != np.intp or not table.flags.c_contiguous
+    ):
+        raise ValueError('Unsupported sparse grid storage.')
+    view.data = <char *> np.PyArray_DATA(bricks)
+    view.table = <const Py_ssize_t *> np.PyArray_DATA(table)
+    for axis in range(3):
+        view.table_shape[axis] = table.shape[axis]
+        view.shape[axis] = grid.shape[axis]
+        for col in range(4):
+            view.transform[axis][col] = transform[axis, col]
+    for axis in range(4):
+        view.strides[axis] = bricks.strides[axis]
+    if bricks.ndim == 5:
+        view.channels = bricks.shape[4]
+        view.strides[4] = bricks.strides[4]
+    else:
+        view.channels = 1
+        view.strides[4] = 0
+    view.brick = grid.brick
+    view.background = grid.background
+    return 0
+
+
+@cython.cdivision(True)
+cdef void sparse_view_sample(
+    const SparseView *view,
+    float x,
+    float y,
+    float z,
+    RESULT_t *result,
+) noexcept nogil:
+    # Trilinear interpolation of all channels of a sparse grid at a
+    # world-space position. Corners in unallocated bricks take the
+    # background value.
+    cdef float i, j, k, q0, q1, q2, p0, p1, p2
+    cdef float[8] weights
+    cdef const char *corners[8]
+    cdef Py_ssize_t[2] index_i
+    cdef Py_ssize_t[2] index_j
+    cdef Py_ssize_t[2] index_k
+    cdef Py_ssize_t brick, i0, j0, k0, c
+    cdef int corner, a, b
+    cdef double value
+
+    i = (view.transform[0][0] * x + view.transform[0][1] * y +
+         view.transform[0][2] * z + view.transform[0][3])
+    j = (view.transform[1][0] * x + view.transform[1][1] * y +
+         view.transform[1][2] * z + view.transform[1][3])
+    k = (view.transform[2][0] * x + view.transform[2][1] * y +
+         view.transform[2][2] * z + view.transform[2][3])
+    if (
+        i < -0.5 or i > 0.5
+        or j < -0.5 or j > 0.5
+        or k < -0.5 or k > 0.5
+    ):
+        for c in range(view.channels):
+            result[c] = view.background
+        return
+    i = (i + 0.5) * (view.shape[0] - 1)
+    j = (j + 0.5) * (view.shape[1] - 1)
+    k = (k + 0.5) * (view.shape[2] - 1)
+
+    i0 = <Py_ssize_t> i
+    j0 = <Py_ssize_t> j
+    k0 = <Py_ssize_t> k
+    index_i[0] = i0
+    index_j[0] = j0
+    index_k[0] = k0
+    index_i[1] = i0 + 1 if i0 < view.shape[0] - 1 else i0
+    index_j[1] = j0 + 1 if j0 < view.shape[1] - 1 else j0
+    index_k[1] = k0 + 1 if k0 < view.shape[2] - 1 else k0
+
+    q0 = i - i0
+    q1 = j - j0
+    q2 = k - k0
+    p0 = 1 - q0
+    p1 = 1 - q1
+    p2 = 1 - q2
+
+    weights[0] = p0 * p1 * p2
+    weights[1] = q0 * p1 * p2
+    weights[2] = p0 * q1 * p2
+    weights[3] = q0 * q1 * p2
+    weights[4] = p0 * p1 * q2
+    weights[5] = q0 * p1 * q2
+    weights[6] = p0 * q1 * q2
+    weights[7] = q0 * q1 * q2
+
+    # Bit 0 of a corner selects its i index, bit 1 its j index and bit 2 its
+    # k index, in the same order as the weights.
+    for corner in range(8):
+        a = corner & 1
+        b = (corner >> 1) & 1
+        i0 = index_i[a]
+        j0 = index_j[b]
+        k0 = index_k[corner >> 2]
+        brick = view.table[
+            ((i0 // view.brick) * view.table_shape[1] + j0 // view.brick)
+            * view.table_shape[2] + k0 // view.brick
+        ]
+        if brick < 0:
+            corners[corner] = NULL
+        else:
+            corners[corner] = (view.data + brick * view.strides[0]
+                               + (i0 % view.brick) * view.strides[1]
+                               + (j0 % view.brick) * view.strides[2]
+                               + (k0 % view.brick) * view.strides[3])
+
+    for c in range(view.channels):
+        value = 0
+        for corner in range(8):
+            if corners[corner] == NULL:
+                value += view.background * weights[corner]
+            else:
+                value += (<const RESULT_t *> (corners[corner]
+                                              + c * view.strides[4]))[0] \
+                    * weights[corner]
+        result[c] = value
+
+
+cdef int macrocell_view_init(MacrocellView *view, object macrocells) except -1:
+    cdef RESULT_t [:] maxs = macrocells._max
+    cdef Py_ssize_t [:] offsets = macrocells.offsets
+    cdef Py_ssize_t [:, ::1] shapes = macrocells.shapes
+    cdef double [:, :] transform = macrocells._index_transform()
+    cdef int axis, col
+    view.maxs = &maxs[0]
+    view.offsets = &offsets[0]
+    view.shapes = &shapes[0, 0]
+    view.levels = offsets.shape[0]
+    view.block = macrocells.block
+    view.threshold = macrocells.threshold
+    for axis in range(3):
+        view.grid_shape[axis] = macrocells.grid.array.shape[axis]
+        for col in range(4):
+            view.transform[axis][col] = transform[axis, col]
+    return 0
+
+
+@cython.cdivision(True)
+cdef double macrocell_span(
+    const MacrocellView *view,
+    float x,
+    float y,
+    float z,
+    float dx,
+    float dy,
+    float dz,
+    double limit,
+) noexcept nogil:
+    # Walk a ray from its position through macrocells whose maximum value is
+    # at most the threshold, using the coarsest empty level at every point,
+    # and return the distance travelled. The view transform maps world
+    # coordinates to voxel index coordinates.
+    cdef Py_ssize_t level, size, offset
+    cdef Py_ssize_t[3] cell
+    cdef const Py_ssize_t *shape
+    cdef int axis
+    cdef double[3] p
+    cdef double[3] d
+    cdef double[3] u
+    cdef double t, texit, tedge, eps, dmax = 0
+    cdef bint empty
+    for axis in range(3):
+        p[axis] = (view.transform[axis][0] * x +
+                   view.transform[axis][1] * y +
+                   view.transform[axis][2] * z +
+                   view.transform[axis][3])
+        d[axis] = (view.transform[axis][0] * dx +
+                   view.transform[axis][1] * dy +
+                   view.transform[axis][2] * dz)
+        dmax = max(dmax, math.fabs(d[axis]))
+    # Step over cell boundaries by a small fraction of a voxel so that
+    # rounding can never leave a ray stuck on a boundary.
+    eps = 1e-4 / dmax if dmax > 0 else 0
+    t = 0
+    while t < limit:
+        for axis in range(3):
+            u[axis] = p[axis] + t * d[axis]
+        if (
+            u[0] < 0 or u[0] > view.grid_shape[0] - 1
+            or u[1] < 0 or u[1] > view.grid_shape[1] - 1
+            or u[2] < 0 or u[2] > view.grid_shape[2] - 1
+        ):
+            break
+        empty = False
+        for level in range(view.levels - 1, -1, -1):
+            size = view.block << level
+            shape = view.shapes + 3 * level
+            for axis in range(3):
+                cell[axis] = min(<Py_ssize_t> (u[axis] / size),
+                                 shape[axis] - 1)
+            offset = (view.offsets[level]
+                      + (cell[0] * shape[1] + cell[1]) * shape[2] + cell[2])
+            if view.maxs[offset] <= view.threshold:
+                empty = True
+                break
+        if not empty:
+            break
+        texit = limit
+        for axis in range(3):
+            if d[axis] > 0:
+                tedge = (min((cell[axis] + 1) * size,
+                             view.grid_shape[axis] - 1) - u[axis]) / d[axis]
+            elif d[axis] < 0:
+                tedge = (cell[axis] * size - u[axis]) / d[axis]
+            else:
+                continue
+            texit = min(texit, tedge)
+        t += max(texit, eps)
+    return min(t, limit)
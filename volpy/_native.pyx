@@ -1,10 +1,57 @@
+import inspect
+
 import numpy as np
+cimport cython
 cimport numpy as np
 cimport libc.math as math
+from libc.stdlib cimport malloc, free
+from cython.parallel cimport prange
+
+from ._grid cimport (GridView, MacrocellView, MipmapView, grid_view_init,
+                     grid_view_sample, macrocell_view_init, macrocell_span,
+                     mipmap_view_init, mipmap_view_sample, num_threads)
+from .grid import DTYPES, Grid
 
 DTYPE = np.float32
 ctypedef np.float32_t DTYPE_t
 
+# Adaptive steps double for as long as the optical depth of a step changes by
+# at most this much from one sample to the next.
+cdef float ADAPTIVE_TOL = 1e-3
+
+
+# GIL-free descriptions of the scene, used to march scenes whose fields are
+# all constants or grids without calling back into Python.
+cdef struct ElementView:
+    bint present
+    bint density_grid
+    float density
+    GridView density_view
+    bint density_mipmapped
+    MipmapView density_mipmaps
+    bint color_grid
+    float color[3]
+    GridView color_view
+    bint color_mipmapped
+    MipmapView color_mipmaps
+    MacrocellView macrocells
+
+
+cdef struct LightView:
+    GridView field
+    float color[3]
+
+
+cdef struct SceneView:
+    ElementView ambient
+    ElementView diffuse
+    LightView *lights
+    int light_count
+    float scatter
+    bint skippable
+    float footprint
+    float near
+
 
 def cast_rays(
     scene,
@@ -12,44 +59,664 @@ def cast_rays(
     np.ndarray[DTYPE_t, ndim=2] directions,
     float step,
     float tol,
+    bint compact=True,
+    bounds=None,
+    threads=None,
+    out=None,
+    max_step=None,
+    int batch=1,
+    float footprint=0,
 ):
-    cdef float distance = scene.camera.near, far = scene.camera.far
-    cdef int ray_count = positions.shape[0]
-    cdef float optical_length = scene.scatter * step
-
-    cdef np.ndarray[DTYPE_t, ndim=2] light = np.zeros((ray_count, 4), dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=1] transmissivity = np.ones((ray_count,), dtype=DTYPE)
-
-    cdef np.ndarray[DTYPE_t, ndim=1] ambient_density = np.zeros(ray_count, dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=2] ambient_color = np.ones((ray_count, 3),
-                                                          dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=1] diffuse_density = np.zeros(ray_count, dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=2] diffuse_color = np.ones((ray_count, 3),
-                                                          dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=1] light_dsm = np.zeros(ray_count, dtype=DTYPE)
-    cdef np.ndarray[DTYPE_t, ndim=2] light_field = np.zeros((ray_count, 3),
-                                                            dtype=DTYPE)
-
-    while (
-        distance < far
-        and np.any(transmissivity > tol)
-    ):
-        # XXX Cull rays which have no transmissivity
-        _handle_element(scene.ambient, positions, ambient_density, ambient_color)
-        _handle_element(scene.diffuse, positions, diffuse_density, diffuse_color)
+    # The rays are given as structure of arrays: positions and directions are
+    # (3, n) arrays holding one contiguous row per axis. They are marched in
+    # place. The light gathered by the rays is returned in an (n, 4) array.
+    # The field callbacks are evaluated at batch samples of each ray at once.
+    # When marched natively, the grids with mipmaps are sampled at the level
+    # matching the footprint of each sample, which is footprint times its
+    # distance from the eye.
+    cdef float near = scene.camera.near, far = scene.camera.far
+    cdef int ray_count = positions.shape[1], live_count
+    cdef int thread_count = num_threads() if threads is None else threads
+    cdef float scatter = scene.scatter
+    # Rays take steps of between step and max_step.
+    cdef float longest = step if max_step is None else max_step
+    if longest < step:
+        raise ValueError('Maximum step must be at least the step size.')
+    if batch < 1:
+        raise ValueError('Batch size must be positive.')
+
+    # Every ray is stored exactly once, when it retires or at the end.
+    if out is None:
+        result = np.empty((ray_count, 4), dtype=DTYPE)
+    elif out.shape != (ray_count, 4):
+        raise ValueError('Output must have shape (%d, 4).' % ray_count)
+    else:
+        result = out
+    cdef np.ndarray[DTYPE_t, ndim=2] light
+    cdef np.ndarray[DTYPE_t, ndim=1] transmissivity
+
+    # Indices of the rays still being marched. Only these rays are passed to
+    # the field callbacks when compaction is enabled.
+    cdef np.ndarray[np.intp_t, ndim=1] live = np.arange(ray_count, dtype=np.intp)
+    cdef np.ndarray alive, dead
+
+    # Distance marched by each ray from the near plane, and the distance at
+    # which it leaves the scene bounds.
+    cdef np.ndarray[DTYPE_t, ndim=1] distance = np.zeros(ray_count, dtype=DTYPE)
+    cdef np.ndarray[DTYPE_t, ndim=1] stop = np.full(ray_count, far - near,
+                                                    dtype=DTYPE)
+
+    cdef np.ndarray[DTYPE_t, ndim=1] ambient_density, diffuse_density, light_dsm
+    cdef np.ndarray[DTYPE_t, ndim=2] ambient_color, diffuse_color, light_field
+    cdef np.ndarray[DTYPE_t, ndim=2] homogeneous
+
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=DTYPE)
+        _clip(positions, directions, bounds[0], bounds[1], distance, stop,
+              step, thread_count)
+
+    # Empty space can only be skipped if every element can vouch for it.
+    macrocells = _scene_macrocells(scene)
+
+    if _fusable(scene):
+        if result.dtype == DTYPE and result.flags.c_contiguous:
+            # March straight into the output.
+            light = result
+        else:
+            light = np.empty((ray_count, 4), dtype=DTYPE)
+        _march_fused(scene, positions, directions, light, distance, stop,
+                     step, longest, tol, len(macrocells) > 0, footprint,
+                     thread_count)
+        if light is not result:
+            result[...] = light
+        return result
+
+    # The light gathered by each ray so far, one row per color channel.
+    light = np.zeros((3, ray_count), dtype=DTYPE)
+    transmissivity = np.ones(ray_count, dtype=DTYPE)
+
+    # The field callbacks take the homogeneous (n * batch, 4) positions of
+    # the next batch of samples of each ray, which are gathered from the rays
+    # before each call. The samples of a ray are consecutive.
+    cdef int sample_count = ray_count * batch
+    homogeneous = np.empty((sample_count, 4), dtype=DTYPE)
+    homogeneous[:, 3] = 1
+
+    # Buffers for the values returned by the field callbacks. Fields which
+    # take an out argument sample straight into them.
+    ambient_fills = _element_fills(scene.ambient)
+    diffuse_fills = _element_fills(scene.diffuse)
+    light_fills = [_fills(scene_light.field) for scene_light in scene.lights]
+    ambient_density = np.zeros(sample_count, dtype=DTYPE)
+    ambient_color = np.ones((sample_count, 3), dtype=DTYPE)
+    diffuse_density = np.zeros(sample_count, dtype=DTYPE)
+    diffuse_color = np.ones((sample_count, 3), dtype=DTYPE)
+    light_dsm = np.zeros(sample_count, dtype=DTYPE)
+    light_field = np.zeros((sample_count, 3), dtype=DTYPE)
+
+    # The length of the last step of each ray, the density it was taken from
+    # and the light and transmissivity from before it, used to adapt the steps.
+    cdef np.ndarray[DTYPE_t, ndim=1] steps = np.full(ray_count, step,
+                                                     dtype=DTYPE)
+    cdef np.ndarray[DTYPE_t, ndim=1] previous = np.full(ray_count, np.nan,
+                                                        dtype=DTYPE)
+    cdef np.ndarray[DTYPE_t, ndim=2] checkpoint = np.empty((4, ray_count),
+                                                           dtype=DTYPE)
+
+    # Which rays are still being marched, and which are not.
+    alive = np.empty(ray_count, dtype=bool)
+    dead = np.empty(ray_count, dtype=bool)
+
+    while True:
+        if macrocells:
+            _skip_empty(macrocells, positions, directions, distance, stop,
+                        steps, previous, step, thread_count)
+        np.greater(transmissivity, tol, out=alive)
+        np.less(distance, stop, out=dead)
+        np.logical_and(alive, dead, out=alive)
+        np.logical_not(alive, out=dead)
+        live_count = np.count_nonzero(alive)
+        if live_count == 0:
+            break
+        if compact and live_count < live.shape[0]:
+            # Retire the rays which have no transmissivity left and gather the
+            # live ones into the front of the working buffers.
+            _store(result, live, light, transmissivity, dead)
+            live = live[alive]
+            # Gather each row, so that it stays contiguous.
+            positions = positions.compress(alive, axis=1)
+            directions = directions.compress(alive, axis=1)
+            light = light.compress(alive, axis=1)
+            transmissivity = transmissivity[alive]
+            distance = distance[alive]
+            stop = stop[alive]
+            steps = steps[alive]
+            previous = previous[alive]
+            checkpoint = checkpoint.compress(alive, axis=1)
+            sample_count = live_count * batch
+            homogeneous = homogeneous[:sample_count]
+            ambient_density = ambient_density[:sample_count]
+            ambient_color = ambient_color[:sample_count]
+            diffuse_density = diffuse_density[:sample_count]
+            diffuse_color = diffuse_color[:sample_count]
+            light_dsm = light_dsm[:sample_count]
+            light_field = light_field[:sample_count]
+            alive = alive[:live_count]
+            dead = dead[:live_count]
+
+        _homogenize(positions, directions, steps, homogeneous, batch,
+                    thread_count)
+        _handle_element(scene.ambient, homogeneous, ambient_density,
+                        ambient_color, ambient_fills)
+        _handle_element(scene.diffuse, homogeneous, diffuse_density,
+                        diffuse_color, diffuse_fills)
 
         # Fetch lighting information only if a diffuse density was provided.
         if scene.diffuse is not None:
-            _handle_lights(scene, positions, light_dsm, light_field)
+            _handle_lights(scene, homogeneous, light_dsm, light_field,
+                           light_fills, thread_count)
 
         _march(positions, directions, transmissivity,
                ambient_density, ambient_color,
                diffuse_density, diffuse_color,
                light_field,
-               light, step, optical_length)
-        distance += step
-    light[:, 3] = np.reshape(1 - transmissivity, ray_count)
-    return light
+               light, distance, stop, steps, previous, checkpoint, batch,
+               step, longest, tol, scatter, thread_count)
+    _store(result, live, light, transmissivity, None)
+    return result
+
+
+def camera_rays(camera, shape, rows, cols, threads=None):
+    # Casts the rays of a Camera through the pixels of an image of the given
+    # shape, in the slices of rows and columns or at the pairs of row and
+    # column indices, like Camera.cast() does for their screen coordinates.
+    # The rays are written straight into the returned (3, n) arrays, like
+    # the rays taken by cast_rays().
+    cdef int width = shape[0], height = shape[1]
+    cdef int thread_count = num_threads() if threads is None else threads
+    cdef Py_ssize_t row0 = 0, col0 = 0, tile_width = 0, count
+    cdef np.intp_t[:] row_index, col_index
+    if isinstance(rows, slice):
+        row0, row1, _ = rows.indices(height)
+        col0, col1, _ = cols.indices(width)
+        tile_width = max(0, col1 - col0)
+        count = max(0, row1 - row0) * tile_width
+        row_index = col_index = np.empty(0, dtype=np.intp)
+    else:
+        row_index = np.asarray(rows, dtype=np.intp)
+        col_index = np.asarray(cols, dtype=np.intp)
+        count = row_index.shape[0]
+    origins = np.empty((3, count), dtype=DTYPE)
+    directions = np.empty((3, count), dtype=DTYPE)
+    cdef DTYPE_t [:, ::1] origins_view = origins
+    cdef DTYPE_t [:, ::1] directions_view = directions
+
+    # The rows of the basis are the eye, view, up and right vectors.
+    cdef double[4][4] basis
+    cdef int i, j
+    for i, vector in enumerate((camera.eye, camera.view, camera.up,
+                                camera.right)):
+        for j in range(4):
+            basis[i][j] = vector[j]
+    cdef double tan_hfov = camera._tan_hfov, tan_vfov = camera._tan_vfov
+    cdef double near = camera.near
+
+    cdef Py_ssize_t k, row, col
+    for k in prange(count, nogil=True, num_threads=thread_count,
+                    schedule='static'):
+        if tile_width > 0:
+            row = row0 + k // tile_width
+            col = col0 + k % tile_width
+        else:
+            row = row_index[k]
+            col = col_index[k]
+        _camera_ray(basis, near,
+                    (2 * _screen(col, width) - 1) * tan_hfov,
+                    (2 * _screen(row, height) - 1) * tan_vfov,
+                    &origins_view[0, k], &directions_view[0, k], count)
+    return origins, directions
+
+
+cdef inline void _camera_ray(
+    const double[4][4] basis,
+    double near,
+    double x,
+    double y,
+    DTYPE_t *origin,
+    DTYPE_t *direction,
+    Py_ssize_t stride,
+) noexcept nogil:
+    # Casts the ray through the point (x, y) of the image plane at unit
+    # distance from the eye, and moves its origin onto the near plane. The
+    # components of the ray are stride elements apart.
+    cdef double[4] vector
+    cdef double norm = 0
+    cdef int i
+    for i in range(4):
+        vector[i] = basis[1][i] + y * basis[2][i] + x * basis[3][i]
+        norm += vector[i] * vector[i]
+    norm = math.sqrt(norm)
+    for i in range(3):
+        direction[i * stride] = vector[i] / norm
+        origin[i * stride] = basis[0][i] + near * direction[i * stride]
+
+
+@cython.cdivision(True)
+cdef inline double _screen(Py_ssize_t index, int count) noexcept nogil:
+    # The screen coordinate of a pixel. The first pixel is at 1.
+    if count < 2:
+        return 0
+    return <double> (count - 1 - index) / (count - 1)
+
+
+def bake_shadow_map(shadow, density, light, float step, threads=None):
+    # Integrates a scalar density grid along the straight path from every
+    # voxel of a shadow map grid to a light, and stores the optical depths in
+    # the map. The light is a homogeneous position, or the direction it
+    # shines in with w = 0. The paths are clipped to the bounds of the
+    # density grid.
+    cdef GridView view
+    cdef int thread_count = num_threads() if threads is None else threads
+    cdef np.float64_t [:, :, :] depth = shadow.array
+    cdef double[3][4] itransform
+    cdef double[4] source
+    cdef double[3] lower
+    cdef double[3] upper
+    cdef int axis, col
+    if not _is_grid(density, 1):
+        raise ValueError('Shadow maps require a scalar density grid.')
+    if step <= 0:
+        raise ValueError('Step must be positive.')
+    grid_view_init(&view, density)
+    bounds = density.bbox()
+    for axis in range(3):
+        for col in range(4):
+            itransform[axis][col] = shadow.itransform[axis, col]
+        lower[axis] = bounds[0, axis]
+        upper[axis] = bounds[1, axis]
+    for col in range(4):
+        source[col] = light[col]
+
+    cdef Py_ssize_t nx = depth.shape[0], ny = depth.shape[1]
+    cdef Py_ssize_t nz = depth.shape[2], voxel, i, j, k
+    for voxel in prange(nx * ny * nz, nogil=True, num_threads=thread_count,
+                        schedule='dynamic', chunksize=64):
+        i = voxel // (ny * nz)
+        j = voxel // nz % ny
+        k = voxel % nz
+        depth[i, j, k] = _shadow_depth(&view, itransform, source, lower,
+                                       upper, _voxel_coordinate(i, nx),
+                                       _voxel_coordinate(j, ny),
+                                       _voxel_coordinate(k, nz), step)
+
+
+@cython.cdivision(True)
+cdef inline double _voxel_coordinate(Py_ssize_t index,
+                                     Py_ssize_t count) noexcept nogil:
+    # The normalized grid coordinate of a voxel, like Grid.igspace().
+    if count < 2:
+        return 0
+    return <double> index / (count - 1) - 0.5
+
+
+@cython.cdivision(True)
+cdef double _shadow_depth(
+    const GridView *view,
+    const double[3][4] itransform,
+    const double[4] source,
+    const double[3] lower,
+    const double[3] upper,
+    double u,
+    double v,
+    double w,
+    float step,
+) noexcept nogil:
+    # March from the voxel at normalized grid coordinates (u, v, w) of a
+    # shadow map to the light, summing the density at the midpoint of every
+    # step.
+    cdef double[3] p
+    cdef double[3] d
+    cdef double t0 = 0, t1 = math.INFINITY, ta, tb, norm = 0, a, b, total = 0
+    cdef DTYPE_t density
+    cdef int axis
+    for axis in range(3):
+        p[axis] = (itransform[axis][0] * u + itransform[axis][1] * v
+                   + itransform[axis][2] * w + itransform[axis][3])
+        if source[3] == 0:
+            d[axis] = -source[axis]
+        else:
+            d[axis] = source[axis] / source[3] - p[axis]
+        norm += d[axis] * d[axis]
+    norm = math.sqrt(norm)
+    if norm == 0:
+        return 0
+    if source[3] != 0:
+        t1 = norm
+    for axis in range(3):
+        d[axis] /= norm
+        if d[axis] == 0:
+            if p[axis] < lower[axis] or p[axis] > upper[axis]:
+                return 0
+            continue
+        ta = (lower[axis] - p[axis]) / d[axis]
+        tb = (upper[axis] - p[axis]) / d[axis]
+        if ta > tb:
+            ta, tb = tb, ta
+        t0 = max(t0, ta)
+        t1 = min(t1, tb)
+
+    a = t0
+    while a < t1:
+        b = min(a + step, t1)
+        grid_view_sample(view, p[0] + (a + b) / 2 * d[0],
+                         p[1] + (a + b) / 2 * d[1],
+                         p[2] + (a + b) / 2 * d[2], &density)
+        total += density * (b - a)
+        a = b
+    return total
+
+
+def _store(
+    result,
+    np.ndarray[np.intp_t, ndim=1] live,
+    np.ndarray[DTYPE_t, ndim=2] light,
+    np.ndarray[DTYPE_t, ndim=1] transmissivity,
+    mask,
+):
+    # Scatter the state of the live rays (or the masked subset of them) back
+    # into the caller's ray order.
+    if mask is not None:
+        live = live[mask]
+        light = light[:, mask]
+        transmissivity = transmissivity[mask]
+    result[live, :3] = light.T
+    result[live, 3] = 1 - transmissivity
+
+
+def _scene_macrocells(scene):
+    macrocells = []
+    for element in (scene.ambient, scene.diffuse):
+        if element is None:
+            continue
+        pyramid = getattr(element.density, 'macrocells', None)
+        if pyramid is None:
+            return []
+        macrocells.append(pyramid)
+    return macrocells
+
+
+def _skip_empty(
+    macrocells,
+    np.ndarray[DTYPE_t, ndim=2] positions,
+    np.ndarray[DTYPE_t, ndim=2] directions,
+    np.ndarray[DTYPE_t, ndim=1] distance,
+    np.ndarray[DTYPE_t, ndim=1] stop,
+    np.ndarray[DTYPE_t, ndim=1] steps,
+    np.ndarray[DTYPE_t, ndim=1] previous,
+    float step,
+    int threads,
+):
+    limit = stop - distance
+    span = macrocells[0].empty_span(positions.T, directions.T, limit)
+    for pyramid in macrocells[1:]:
+        np.minimum(span, pyramid.empty_span(positions.T, directions.T, limit),
+                   out=span)
+    _advance(positions, directions, distance, span, step, threads)
+    # Rays which skipped ahead start adapting their steps afresh.
+    skipped = span > 0
+    steps[skipped] = step
+    previous[skipped] = np.nan
+
+
+def _fusable(scene):
+    # Whether every field in the scene can be evaluated natively.
+    for element in (scene.ambient, scene.diffuse):
+        if element is None:
+            continue
+        if not (
+            isinstance(element.density, (int, float))
+            or _is_grid(element.density, 1)
+        ):
+            return False
+        if not (
+            element.color is None
+            or isinstance(element.color, (tuple, list, np.ndarray))
+            or _is_grid(element.color, 3)
+        ):
+            return False
+    if scene.diffuse is not None:
+        for light in scene.lights:
+            if not _is_grid(light.field, 1):
+                return False
+    return True
+
+
+def _is_grid(field, channels):
+    if not isinstance(field, Grid) or field.array.dtype not in DTYPES:
+        return False
+    if channels == 1:
+        return field.array.ndim == 3
+    return field.array.ndim == 4 and field.array.shape[3] == channels
+
+
+cdef int _element_view_init(ElementView *view, element) except -1:
+    cdef int c
+    view.present = element is not None
+    view.density_mipmapped = False
+    view.color_mipmapped = False
+    if not view.present:
+        return 0
+    view.density_grid = isinstance(element.density, Grid)
+    if view.density_grid:
+        grid_view_init(&view.density_view, element.density)
+        if element.density.macrocells is not None:
+            macrocell_view_init(&view.macrocells, element.density.macrocells)
+        if element.density.mipmaps is not None:
+            mipmap_view_init(&view.density_mipmaps, element.density.mipmaps)
+            view.density_mipmapped = True
+    else:
+        view.density = element.density
+    view.color_grid = isinstance(element.color, Grid)
+    if view.color_grid:
+        grid_view_init(&view.color_view, element.color)
+        if element.color.mipmaps is not None:
+            mipmap_view_init(&view.color_mipmaps, element.color.mipmaps)
+            view.color_mipmapped = True
+    else:
+        color = (1, 1, 1) if element.color is None else element.color
+        color = np.broadcast_to(np.asarray(color, dtype=DTYPE), (3,))
+        for c in range(3):
+            view.color[c] = color[c]
+    return 0
+
+
+cdef _march_fused(
+    scene,
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:, ::1] light,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] stop,
+    float step,
+    float max_step,
+    float tol,
+    bint skippable,
+    float footprint,
+    int threads,
+):
+    # March each ray to completion in turn. The fields are sampled natively,
+    # so the whole march runs without the GIL.
+    cdef SceneView view
+    cdef int idx, c
+    view.scatter = scene.scatter
+    view.skippable = skippable
+    view.near = scene.camera.near
+    view.lights = NULL
+    view.light_count = 0
+    _element_view_init(&view.ambient, scene.ambient)
+    _element_view_init(&view.diffuse, scene.diffuse)
+    # The level of detail only matters if there are mipmaps to sample.
+    if (
+        view.ambient.density_mipmapped or view.ambient.color_mipmapped
+        or view.diffuse.density_mipmapped or view.diffuse.color_mipmapped
+    ):
+        view.footprint = footprint
+    else:
+        view.footprint = 0
+    if view.diffuse.present and scene.lights:
+        view.lights = <LightView *> malloc(len(scene.lights)
+                                           * sizeof(LightView))
+        if view.lights == NULL:
+            raise MemoryError()
+    try:
+        if view.lights != NULL:
+            for idx, scene_light in enumerate(scene.lights):
+                grid_view_init(&view.lights[idx].field, scene_light.field)
+                color = np.broadcast_to(
+                    np.asarray(scene_light.color, dtype=DTYPE), (3,))
+                for c in range(3):
+                    view.lights[idx].color[c] = color[c]
+                view.light_count += 1
+        # Rays vary wildly in length, so hand them out dynamically.
+        for idx in prange(positions.shape[1], nogil=True,
+                          num_threads=threads, schedule='dynamic',
+                          chunksize=16):
+            _march_ray(&view, positions, directions, light, distance, stop,
+                       idx, step, max_step, tol)
+    finally:
+        free(view.lights)
+
+
+cdef void _march_ray(
+    const SceneView *view,
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:, ::1] light,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] stop,
+    int idx,
+    float step,
+    float max_step,
+    float tol,
+) noexcept nogil:
+    # The whole state of the ray is kept in locals until it is stored as a
+    # row of light.
+    cdef float x = positions[0, idx], y = positions[1, idx]
+    cdef float z = positions[2, idx]
+    cdef float dx = directions[0, idx], dy = directions[1, idx]
+    cdef float dz = directions[2, idx]
+    cdef float t = distance[idx], far = stop[idx]
+    cdef float h = step, previous = math.NAN, transmissivity = 1
+    cdef float ambient_density = 0, diffuse_density = 0, dsm, skip
+    cdef float footprint, fine
+    cdef double span
+    cdef float[3] ambient_color
+    cdef float[3] diffuse_color
+    cdef float[3] light_field
+    cdef float[3] total
+    cdef float[4] checkpoint
+    cdef int c, k
+
+    for c in range(3):
+        total[c] = 0
+        checkpoint[c] = 0
+        ambient_color[c] = 1
+        diffuse_color[c] = 1
+        light_field[c] = 0
+    checkpoint[3] = transmissivity
+
+    while t < far and transmissivity > tol:
+        if view.skippable:
+            span = far - t
+            if view.ambient.present:
+                span = macrocell_span(&view.ambient.macrocells,
+                                      x, y, z, dx, dy, dz, span)
+            if view.diffuse.present:
+                span = macrocell_span(&view.diffuse.macrocells,
+                                      x, y, z, dx, dy, dz, span)
+            if span > 0:
+                skip = math.ceil(span / step) * step
+                x += skip * dx
+                y += skip * dy
+                z += skip * dz
+                t += skip
+                h = step
+                previous = math.NAN
+                continue
+
+        # Coarser mipmap levels are sampled at coarser steps, which stop
+        # short of overshooting the end of the ray.
+        footprint = view.footprint * (view.near + t)
+        fine = max(step, min(footprint, far - t))
+        if view.ambient.present:
+            _sample_element(&view.ambient, x, y, z, footprint,
+                            &ambient_density, ambient_color)
+        if view.diffuse.present:
+            _sample_element(&view.diffuse, x, y, z, footprint,
+                            &diffuse_density, diffuse_color)
+            light_field[0] = light_field[1] = light_field[2] = 0
+            for k in range(view.light_count):
+                grid_view_sample(&view.lights[k].field, x, y, z, &dsm)
+                dsm = math.exp(-dsm * view.scatter)
+                for c in range(3):
+                    light_field[c] += view.lights[k].color[c] * dsm
+
+        skip = _adapt_step(ambient_density + diffuse_density, &previous, h,
+                           fine, max(max_step, fine), view.scatter)
+        if skip < 0:
+            for c in range(3):
+                total[c] = checkpoint[c]
+            transmissivity = checkpoint[3]
+            h = fine
+        else:
+            for c in range(3):
+                checkpoint[c] = total[c]
+            checkpoint[3] = transmissivity
+            h = skip
+            _composite(ambient_density, ambient_color,
+                       diffuse_density, diffuse_color,
+                       light_field, view.scatter * h,
+                       &transmissivity, total, 1)
+
+        x += skip * dx
+        y += skip * dy
+        z += skip * dz
+        t += skip
+
+    light[idx, 0] = total[0]
+    light[idx, 1] = total[1]
+    light[idx, 2] = total[2]
+    light[idx, 3] = 1 - transmissivity
+
+
+cdef inline void _sample_element(
+    const ElementView *view,
+    float x,
+    float y,
+    float z,
+    float footprint,
+    float *density,
+    float *color,
+) noexcept nogil:
+    # Grids with mipmaps are sampled at the level matching the footprint of
+    # the sample, if it is given.
+    cdef float[3] scratch
+    if view.density_grid and view.density_mipmapped and footprint > 0:
+        mipmap_view_sample(&view.density_mipmaps, x, y, z, footprint,
+                           density, scratch)
+    elif view.density_grid:
+        grid_view_sample(&view.density_view, x, y, z, density)
+    else:
+        density[0] = view.density
+    if view.color_grid and view.color_mipmapped and footprint > 0:
+        mipmap_view_sample(&view.color_mipmaps, x, y, z, footprint, color,
+                           scratch)
+    elif view.color_grid:
+        grid_view_sample(&view.color_view, x, y, z, color)
+    else:
+        color[0] = view.color[0]
+        color[1] = view.color[1]
+        color[2] = view.color[2]
 
 
 def _handle_lights(
@@ -57,87 +724,332 @@ def _handle_lights(
     np.ndarray[DTYPE_t, ndim=2] positions,
     np.ndarray[DTYPE_t, ndim=1] dsm,
     np.ndarray[DTYPE_t, ndim=2] color,
+    fills,
+    int threads,
 ):
     # XXX Add phase function.
     color.fill(0)
-    for light in scene.lights:
-        dsm[:] = light.field(positions)
-        color += light.color * np.exp(-dsm * scene.scatter).reshape(len(dsm), 1)
+    for light, light_fills in zip(scene.lights, fills):
+        _sample(light.field, positions, dsm, light_fills)
+        _add_light(color, dsm, np.asarray(light.color, dtype=DTYPE),
+                   scene.scatter, threads)
+
+
+cdef _add_light(
+    DTYPE_t [:, ::1] color,
+    DTYPE_t [:] dsm,
+    DTYPE_t [:] light_color,
+    float scatter,
+    int threads,
+):
+    # Add the color of a light, attenuated by its deep shadow map.
+    cdef float attenuation
+    cdef int idx
+    with nogil:
+        for idx in prange(color.shape[0], num_threads=threads,
+                          schedule='static'):
+            attenuation = math.exp(-dsm[idx] * scatter)
+            color[idx, 0] += light_color[0] * attenuation
+            color[idx, 1] += light_color[1] * attenuation
+            color[idx, 2] += light_color[2] * attenuation
 
 
 def _handle_element(
     element,
     np.ndarray[DTYPE_t, ndim=2] positions,
     np.ndarray[DTYPE_t, ndim=1] density,
-    np.ndarray[DTYPE_t, ndim=2] color
+    np.ndarray[DTYPE_t, ndim=2] color,
+    fills,
 ):
     if element is None:
         return
     if isinstance(element.density, (int, float)):
         density[:] = element.density
     else:
-        density[:] = element.density(positions)
+        _sample(element.density, positions, density, fills[0])
     if isinstance(element.color, (tuple, list, np.ndarray)):
         color[:] = element.color
     elif element.color is not None:
-        color[:] = element.color(positions)
+        _sample(element.color, positions, color, fills[1])
+
+
+def _sample(field, positions, out, bint fills):
+    if fills:
+        field(positions, out=out)
+    else:
+        out[:] = field(positions)
+
+
+def _element_fills(element):
+    if element is None:
+        return False, False
+    return _fills(element.density), _fills(element.color)
+
+
+def _fills(field):
+    # Whether a field can sample into a given array: fields opt in by taking
+    # an out argument, like Grid.__call__().
+    try:
+        return 'out' in inspect.signature(field).parameters
+    except (TypeError, ValueError):
+        return False
 
 
 cdef _march(
-    DTYPE_t [:, :] positions,
-    DTYPE_t [:, :] directions,
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
     DTYPE_t [:] transmissivity,
     DTYPE_t [:] ambient_density,
-    DTYPE_t [:, :] ambient_color,
+    DTYPE_t [:, ::1] ambient_color,
     DTYPE_t [:] diffuse_density,
-    DTYPE_t [:, :] diffuse_color,
-    DTYPE_t [:, :] light_field,
-    DTYPE_t [:, :] light,
+    DTYPE_t [:, ::1] diffuse_color,
+    DTYPE_t [:, ::1] light_field,
+    DTYPE_t [:, ::1] light,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] stop,
+    DTYPE_t [:] steps,
+    DTYPE_t [:] previous,
+    DTYPE_t [:, ::1] checkpoint,
+    int batch,
     float step,
-    float optical_length,
+    float max_step,
+    float tol,
+    float scatter,
+    int threads,
 ):
+    cdef int idx
+    for idx in prange(positions.shape[1], nogil=True, num_threads=threads,
+                      schedule='static'):
+        _march_batch(positions, directions, transmissivity,
+                     ambient_density, ambient_color,
+                     diffuse_density, diffuse_color,
+                     light_field, light, distance, stop, steps, previous,
+                     checkpoint, idx, batch, step, max_step, tol, scatter)
+
+
+cdef void _march_batch(
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:] transmissivity,
+    DTYPE_t [:] ambient_density,
+    DTYPE_t [:, ::1] ambient_color,
+    DTYPE_t [:] diffuse_density,
+    DTYPE_t [:, ::1] diffuse_color,
+    DTYPE_t [:, ::1] light_field,
+    DTYPE_t [:, ::1] light,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] stop,
+    DTYPE_t [:] steps,
+    DTYPE_t [:] previous,
+    DTYPE_t [:, ::1] checkpoint,
+    int idx,
+    int batch,
+    float step,
+    float max_step,
+    float tol,
+    float scatter,
+) noexcept nogil:
+    # Composite the batch of samples of a ray, which lie one step of the ray
+    # apart, and move it on to its next sample. Only the last sample of the
+    # batch adapts the step, since the others are already taken. The rest of
+    # the batch is dropped where the ray ends or must undo its last step.
+    cdef Py_ssize_t stride = light.shape[1], sample
+    cdef float last = steps[idx], h, advance = 0
+    cdef int j, c
+    for j in range(batch):
+        if distance[idx] + advance >= stop[idx] or transmissivity[idx] <= tol:
+            break
+        sample = <Py_ssize_t> idx * batch + j
+        h = _adapt_step(ambient_density[sample] + diffuse_density[sample],
+                        &previous[idx], last, step, max_step, scatter)
+        if h < 0:
+            for c in range(3):
+                light[c, idx] = checkpoint[c, idx]
+            transmissivity[idx] = checkpoint[3, idx]
+            steps[idx] = step
+            # Cast the ray back to its last sample.
+            advance += h
+            break
+        if j < batch - 1:
+            h = last
+        for c in range(3):
+            checkpoint[c, idx] = light[c, idx]
+        checkpoint[3, idx] = transmissivity[idx]
+        steps[idx] = h
+        _composite(ambient_density[sample], &ambient_color[sample, 0],
+                   diffuse_density[sample], &diffuse_color[sample, 0],
+                   &light_field[sample, 0], scatter * h,
+                   &transmissivity[idx], &light[0, idx], stride)
+        advance += h
+
+    positions[0, idx] += advance * directions[0, idx]
+    positions[1, idx] += advance * directions[1, idx]
+    positions[2, idx] += advance * directions[2, idx]
+    distance[idx] += advance
+
+
+cdef inline float _adapt_step(
+    float density,
+    DTYPE_t *previous,
+    float last,
+    float step,
+    float max_step,
+    float scatter,
+) noexcept nogil:
+    # Returns the length of the next step of a ray from its density at the
+    # current sample and the length of its last step. The step doubles up to
+    # max_step while the density is steady and falls back to step as soon as
+    # it changes. If it changes after a longer step, the result is -last: the
+    # ray must undo its last step and take it again at the finest step.
+    cdef float change = math.fabs(density - previous[0]) * scatter * last
+    if change <= ADAPTIVE_TOL:
+        previous[0] = density
+        return min(2 * last, max_step)
+    elif last > step:
+        previous[0] = math.NAN
+        return -last
+    previous[0] = density
+    return step
+
+
+cdef inline void _composite(
+    float ambient_density,
+    const float *ambient_color,
+    float diffuse_density,
+    const float *diffuse_color,
+    const float *light_field,
+    float optical_length,
+    DTYPE_t *transmissivity,
+    float *light,
+    Py_ssize_t stride,
+) noexcept nogil:
+    # Composite one sample of a ray behind the light gathered so far. The
+    # color channels of the light are stride elements apart.
     cdef float weight, total_density, dt
     cdef float[3] total_color
+    total_density = ambient_density + diffuse_density
+    dt = math.exp(-optical_length * total_density)
+
+    if total_density > 0:
+        # Add ambient component
+        total_color[0] = ambient_color[0] * ambient_density
+        total_color[1] = ambient_color[1] * ambient_density
+        total_color[2] = ambient_color[2] * ambient_density
+
+        # Add diffuse component
+        total_color[0] += light_field[0] * diffuse_color[0] * diffuse_density
+        total_color[1] += light_field[1] * diffuse_color[1] * diffuse_density
+        total_color[2] += light_field[2] * diffuse_color[2] * diffuse_density
+
+        # Weight all color contributions with respect to the total density.
+        total_color[0] /= total_density
+        total_color[1] /= total_density
+        total_color[2] /= total_density
+
+        weight = (1 - dt) * transmissivity[0]
+        light[0] += total_color[0] * weight
+        light[stride] += total_color[1] * weight
+        light[2 * stride] += total_color[2] * weight
+
+    transmissivity[0] *= dt
+
+
+@cython.cdivision(True)
+cdef _clip(
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:] lower,
+    DTYPE_t [:] upper,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] stop,
+    float step,
+    int threads,
+):
+    # Slab test each ray against the axis-aligned box [lower, upper]. Rays
+    # are advanced to their first sample inside the box (keeping samples on
+    # the same lattice as an unclipped march) and their stop distance is
+    # shortened to where they leave the box.
+    cdef float t0, t1, ta, tb, enter
+    cdef int idx, axis
+    with nogil:
+        for idx in prange(positions.shape[1], num_threads=threads,
+                          schedule='static'):
+            t0 = 0
+            t1 = stop[idx]
+            for axis in range(3):
+                if directions[axis, idx] == 0:
+                    if (
+                        positions[axis, idx] < lower[axis]
+                        or positions[axis, idx] > upper[axis]
+                    ):
+                        t1 = -1
+                    continue
+                ta = ((lower[axis] - positions[axis, idx])
+                      / directions[axis, idx])
+                tb = ((upper[axis] - positions[axis, idx])
+                      / directions[axis, idx])
+                if ta > tb:
+                    ta, tb = tb, ta
+                t0 = max(t0, ta)
+                t1 = min(t1, tb)
+            if t0 > t1:
+                stop[idx] = 0
+                continue
+            enter = math.ceil(t0 / step) * step
+            distance[idx] = enter
+            stop[idx] = t1
+            positions[0, idx] += enter * directions[0, idx]
+            positions[1, idx] += enter * directions[1, idx]
+            positions[2, idx] += enter * directions[2, idx]
+
+
+
+cdef _homogenize(
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:] steps,
+    DTYPE_t [:, ::1] homogeneous,
+    int batch,
+    int threads,
+):
+    # Gather the positions of the next batch of samples of each ray, one step
+    # apart, into the rows of homogeneous points.
+    cdef Py_ssize_t sample
+    cdef float offset
+    cdef int idx, j
+    with nogil:
+        for idx in prange(positions.shape[1], num_threads=threads,
+                          schedule='static'):
+            for j in range(batch):
+                sample = <Py_ssize_t> idx * batch + j
+                offset = j * steps[idx]
+                homogeneous[sample, 0] = (positions[0, idx]
+                                          + offset * directions[0, idx])
+                homogeneous[sample, 1] = (positions[1, idx]
+                                          + offset * directions[1, idx])
+                homogeneous[sample, 2] = (positions[2, idx]
+                                          + offset * directions[2, idx])
+
+
+cdef _advance(
+    DTYPE_t [:, ::1] positions,
+    DTYPE_t [:, ::1] directions,
+    DTYPE_t [:] distance,
+    DTYPE_t [:] span,
+    float step,
+    int threads,
+):
+    # Move each ray past every sample which lies within its span, staying on
+    # the step lattice.
+    cdef float skip
+    cdef int idx
     with nogil:
-        for idx in range(positions.shape[0]):
-            total_density = ambient_density[idx] + diffuse_density[idx]
-            dt = math.exp(-optical_length * total_density)
-
-            if total_density > 0:
-                # Add ambient component
-                total_color[0] = ambient_color[idx, 0] * ambient_density[idx]
-                total_color[1] = ambient_color[idx, 1] * ambient_density[idx]
-                total_color[2] = ambient_color[idx, 2] * ambient_density[idx]
-
-                # Add diffuse component
-                total_color[0] += (light_field[idx, 0]
-                                   * diffuse_color[idx, 0]
-                                   * diffuse_density[idx])
-                total_color[1] += (light_field[idx, 1]
-                                   * diffuse_color[idx, 1]
-                                   * diffuse_density[idx])
-                total_color[2] += (light_field[idx, 2]
-                                   * diffuse_color[idx, 2]
-                                   * diffuse_density[idx])
-
-                # Weight all color contributions with respect to the total
-                # density.
-                total_color[0] /= total_density
-                total_color[1] /= total_density
-                total_color[2] /= total_density
-
-                weight = (1 - dt) * transmissivity[idx]
-                total_color[0] *= weight
-                total_color[1] *= weight
-                total_color[2] *= weight
-
-                light[idx, 0] += total_color[0]
-                light[idx, 1] += total_color[1]
-                light[idx, 2] += total_color[2]
-
-            transmissivity[idx] *= dt
-
-            # Cast the rays forward one step.
-            positions[idx, 0] += step * directions[idx, 0]
-            positions[idx, 1] += step * directions[idx, 1]
-            positions[idx, 2] += step * directions[idx, 2]
+        for idx in prange(positions.shape[1], num_threads=threads,
+                          schedule='static'):
+            if span[idx] <= 0:
+                continue
+            skip = math.ceil(span[idx] / step) * step
+            positions[0, idx] += skip * directions[0, idx]
+            positions[1, idx] += skip * directions[1, idx]
+            positions[2, idx] += skip * directions[2, idx]
+            distance[idx] += skip
@@ -0,0 +1,150 @@
+'''
+Memory-mapped arrays which are shared with worker processes by reference.
+
+'''
+import numpy as np
+
+import mmap
+import os
+import tempfile
+
+# Prefer a memory-backed file system for the backing files.
+SHM_DIR = '/dev/shm'
+
+
+class SharedArray(object):
+    '''
+    An array stored in a memory-mapped temporary file. Pickling a SharedArray
+    only pickles the location of the file, so a worker process which unpickles
+    it maps the same memory instead of receiving a copy.
+
+    The process which created the array owns the file and must ``release()``
+    it. Mappings which are already open stay valid after that.
+    '''
+
+    def __init__(self, path, shape, dtype, owner=False):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self._array = None
+
+    @classmethod
+    def empty(cls, shape, dtype):
+        '''
+        Create a new shared array with uninitialized contents.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The shape of the array.
+        dtype : data-type
+            The data type of the array.
+
+        Returns
+        -------
+        shared : SharedArray
+            The new array, owned by the calling process.
+
+        '''
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        path = _allocate(nbytes)
+        return cls(path, shape, dtype, owner=True)
+
+    @classmethod
+    def copy(cls, array):
+        '''
+        Create a new shared array holding a copy of an array.
+
+        Parameters
+        ----------
+        array : array-like
+            The array to copy.
+
+        Returns
+        -------
+        shared : SharedArray
+            The new array, owned by the calling process.
+
+        '''
+        array = np.asarray(array)
+        shared = cls.empty(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def array(self):
+        '''
+        Returns the shared memory as a NumPy array.
+
+        '''
+        if self._array is None:
+            self._array = np.memmap(self.path, dtype=self.dtype, mode='r+',
+                                    shape=self.shape)
+        return self._array
+
+    def release(self):
+        '''
+        Remove the backing file if this process owns it.
+
+        '''
+        self._array = None
+        if self.owner:
+            self.owner = False
+            os.unlink(self.path)
+
+    def __getstate__(self):
+        return {
+            'path': self.path,
+            'shape': self.shape,
+            'dtype': self.dtype,
+            'owner': False,
+            '_array': None,
+        }
+
+
+def is_mapped(array):
+    '''
+    Returns True if an array is exactly the contents of a memory-mapped file,
+    so that it can be shared by reopening the file.
+
+    '''
+    return (
+        isinstance(array, np.memmap)
+        and isinstance(array.base, mmap.mmap)
+        and array.filename is not None
+        and array.mode in ('r', 'r+', 'w+')
+    )
+
+
+def reopen(array):
+    '''
+    Returns the arguments needed to map the file of a mapped array again.
+
+    '''
+    mode = 'r' if array.mode == 'r' else 'r+'
+    fortran = array.flags.f_contiguous and not array.flags.c_contiguous
+    order = 'F' if fortran else 'C'
+    return (array.filename, array.dtype, mode, array.offset, array.shape,
+            order)
+
+
+def _allocate(nbytes):
+    # Reserve the space up front: running out of room in a tmpfs while
+    # writing through a mapping kills the process with SIGBUS instead of
+    # raising an error.
+    directories = [tempfile.gettempdir()]
+    if os.path.isdir(SHM_DIR):
+        directories.insert(0, SHM_DIR)
+    for directory in directories:
+        fd, path = tempfile.mkstemp(prefix='volpy-', dir=directory)
+        try:
+            os.posix_fallocate(fd, 0, nbytes)
+        except OSError:
+            os.unlink(path)
+            if directory == directories[-1]:
+                raise
+            continue
+        finally:
+            os.close(fd)
+        return path
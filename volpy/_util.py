@@ -92,7 +92,9 @@ def normalize(v):
         v[:] = v / np.linalg.norm(v, 2)
         return v
     elif v.ndim == 2:
-        v[:] /= ascolumn(np.linalg.norm(v, 2, axis=1))
+        # Avoid the temporary copy of v made by np.linalg.norm().
+        norm = np.sqrt(np.einsum('ij,ij->i', v, v))
+        v /= ascolumn(norm)
         return v
     raise ValueError('Unsupported ndim: %d' % v.ndim)
 
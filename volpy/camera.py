@@ -102,28 +102,22 @@ class Camera(object):
         x = ascolumn((2. * imx - 1.) * self._tan_hfov)
         y = ascolumn((2. * imy - 1.) * self._tan_vfov)
 
-        # Set up some arrays for broadcasting.
-        count = len(x)
-        shape = (count, 4)
-        up = np.tile(self.up, count).reshape(shape)
-        right = np.tile(self.right, count).reshape(shape)
-        view = np.tile(self.view, count).reshape(shape)
-        origins = np.tile(self.eye, count).reshape(shape)
-        origins = origins.astype(self.dtype)
-
-        buffer1 = np.ndarray(shape, dtype=self.dtype)
-        buffer2 = np.ndarray(shape, dtype=self.dtype)
+        # The camera basis is broadcast against the image components, so only
+        # the two output arrays are allocated.
+        shape = (len(x), 4)
+        directions = np.ndarray(shape, dtype=self.dtype)
+        origins = np.ndarray(shape, dtype=self.dtype)
 
         # Compute the directions array.
-        np.multiply(y, up, out=buffer1)
-        np.multiply(x, right, out=buffer2)
-        directions = buffer1 + buffer2
-        np.add(view, directions, out=directions)
+        np.multiply(y, self.up, out=directions)
+        np.multiply(x, self.right, out=origins)
+        np.add(directions, origins, out=directions)
+        np.add(self.view, directions, out=directions)
         normalize(directions)
 
         # Project rays to the near plane, and store it in the origins array.
-        np.multiply(directions, self.near, out=buffer1)
-        np.add(origins, buffer1, out=origins)
+        np.multiply(directions, self.near, out=origins)
+        np.add(self.eye, origins, out=origins)
         return origins, directions
 
     def _update(self):
@@ -4,12 +4,20 @@ Fast grid evaluation for NumPy arrays.
 '''
 import numpy as np
 
-from ._grid import grid_scalar_eval, grid_vector_eval
+import weakref
+
+from . import _shm
+from ._grid import (grid_eval, grid_resample, grid_block_minmax,
+                    grid_pyramid_reduce, grid_empty_span, mipmap_eval)
 from .peval import peval
 
 MIN_COORDINATE = np.array([-0.5, -0.5, -0.5, 1])
 MAX_COORDINATE = np.array([0.5, 0.5, 0.5, 1])
 
+# The array types which grids store and evaluate without conversion.
+DTYPES = tuple(np.dtype(t) for t in (np.float64, np.float32, np.float16,
+                                     np.uint8, np.uint16))
+
 
 class Grid(object):
     '''
@@ -23,44 +31,263 @@ class Grid(object):
         [-0.5, -0.5, -0,5] x [0.5, 0.5, 0.5].
     '''
 
-    def __init__(self, array, transform=None, default=0):
+    def __init__(self, array, transform=None, default=0, scale=1, offset=0):
         '''
         Grid constructor.
 
         Parameters
         ----------
         array : array-like
-            Any scalar or vector array.
+            Any scalar or vector array. Arrays of float64, float32, float16,
+            uint8 or uint16 are stored as they are, without a copy. Anything
+            else is converted to float64.
         transform : array-like
             A 4x4 transformation matrix which maps world coordinates to the
             default normalized grid coordinates.
         default : float
             A default value for points outside of the grid. This value will be
             broadcasted into the result for vector arrays.
+        scale : float
+            The value of a voxel is its stored value times ``scale`` plus
+            ``offset``. Together they let an integer array hold quantized
+            values.
+        offset : float
+            See ``scale``.
         '''
-        self.array = np.asarray(array, dtype=np.float64)
+        array = np.asanyarray(array)
+        if array.dtype not in DTYPES:
+            native = array.dtype.newbyteorder('=')
+            array = array.astype(native if native in DTYPES else np.float64)
+        self.array = array
         self.default = default
+        self.scale = scale
+        self.offset = offset
         if transform is None:
             transform = np.eye(4, dtype=np.float32)
         self.transform = np.asarray(transform, dtype=np.float32)
         self.itransform = np.linalg.inv(self.transform)
+        self.macrocells = None
+        self.mipmaps = None
+        # Counts the changes made to the values through the grid, so that
+        # anything derived from them can tell when it is out of date.
+        self.version = 0
+
+    def __call__(self, xyz, out=None):
+        '''
+        Sample the grid at a set of positions.
+
+        Parameters
+        ----------
+        xyz : array
+            A ``(n, 4)`` array of homogeneous world-space positions.
+        out : array or None
+            A float32 array of shape ``(n,)``, or ``(n, d)`` for a grid of
+            ``d``-vectors, to store the samples in. If None, a new array is
+            allocated.
+
+        Returns
+        -------
+        samples : array
+            The trilinearly interpolated samples. This is ``out`` if it was
+            given.
 
-    def __call__(self, xyz):
+        '''
         xyz = np.asarray(xyz, dtype=np.float32)
         count = xyz.shape[0]
         ndim = self.array.ndim
         if ndim == 3:
-            result = np.ndarray((count,), dtype=np.float32)
-            grid_scalar_eval(self.array, self.transform, xyz, self.default,
-                             result)
-            return result
+            shape = (count,)
+            channels = 1
         elif ndim == 4:
-            dim = self.array.shape[3]
-            result = np.ndarray((count, dim), dtype=np.float32)
-            grid_vector_eval(self.array, self.transform, xyz, self.default,
-                             result)
-            return result
-        raise ValueError('Unsupported grid ndim: %d' % ndim)
+            shape = (count, self.array.shape[3])
+            channels = self.array.shape[3]
+        else:
+            raise ValueError('Unsupported grid ndim: %d' % ndim)
+        if out is None:
+            out = np.ndarray(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError('Output must have shape %s.' % (shape,))
+        elif out.dtype != np.float32:
+            raise ValueError('Output must be float32.')
+        if out.flags.c_contiguous:
+            grid_eval(self, xyz, out.reshape((count, channels)))
+        else:
+            samples = np.ndarray((count, channels), dtype=np.float32)
+            grid_eval(self, xyz, samples)
+            out[...] = samples.reshape(shape)
+        return out
+
+    @classmethod
+    def load(cls, path, transform=None, default=0, scale=1, offset=0,
+             mmap_mode='r'):
+        '''
+        Open a grid stored in a ``.npy`` file, such as one written by
+        ``save()``. By default the file is memory-mapped instead of read, so
+        the grid is ready at once and only the parts of it which are sampled
+        are paged in from disk. This allows rendering volumes which do not
+        fit in memory. Mapped grids are pickled by reference to the file.
+
+        Building macrocells, or baking shadow maps from the grid, reads all
+        of it once. Arrays of a type which grids do not store natively are
+        converted, which also reads all of it.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+        transform : array-like
+            See ``Grid()``.
+        default : float
+            See ``Grid()``.
+        scale : float
+            See ``Grid()``.
+        offset : float
+            See ``Grid()``.
+        mmap_mode : str or None
+            The mode to map the file with, as for ``np.load()``. With 'r' the
+            grid is read only. With 'r+' stamping writes through to the
+            file. If None, the file is read into memory.
+
+        Returns
+        -------
+        grid : Grid
+            The new grid.
+
+        '''
+        array = np.load(path, mmap_mode=mmap_mode)
+        return cls(array, transform=transform, default=default, scale=scale,
+                   offset=offset)
+
+    def save(self, path):
+        '''
+        Write the grid array to a ``.npy`` file which ``load()`` can open.
+        The transform, default, scale and offset are not saved.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+
+        '''
+        np.save(path, self.array)
+
+    def share(self):
+        '''
+        Move the grid array into shared memory. Worker processes of fork mode
+        renders then map the array instead of receiving a pickled copy of it.
+        Arrays which are memory-mapped from a file are already shared this
+        way. The shared memory is freed along with the grid.
+
+        Returns
+        -------
+        grid : Grid
+            The grid itself.
+
+        '''
+        if not _shm.is_mapped(self.array):
+            shared = _shm.SharedArray.copy(self.array)
+            self.array = shared.array
+            self._finalizer = weakref.finalize(self, shared.release)
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_finalizer', None)
+        if _shm.is_mapped(self.array):
+            # Pickle memory-mapped arrays by reference to their file.
+            state['array'] = None
+            state['_mapped'] = _shm.reopen(self.array)
+        return state
+
+    def __setstate__(self, state):
+        mapped = state.pop('_mapped', None)
+        if mapped is not None:
+            filename, dtype, mode, offset, shape, order = mapped
+            state['array'] = np.memmap(filename, dtype=dtype, mode=mode,
+                                       offset=offset, shape=shape,
+                                       order=order)
+        self.__dict__.update(state)
+
+    def build_macrocells(self, block=8, threshold=0.):
+        '''
+        Build a min/max macrocell pyramid over the grid. Rendering uses it to
+        skip over regions of the grid which are empty. The pyramid is kept up
+        to date by ``stamp()`` and ``pstamp()``.
+
+        Parameters
+        ----------
+        block : int
+            The width in voxels of the finest macrocells.
+        threshold : float
+            Macrocells whose maximum value is at most this are considered
+            empty.
+
+        Returns
+        -------
+        macrocells : Macrocells
+            The new pyramid, which is also stored in ``self.macrocells``.
+
+        '''
+        self.macrocells = Macrocells(self, block=block, threshold=threshold)
+        return self.macrocells
+
+    def build_mipmaps(self, levels=None):
+        '''
+        Build a pyramid of downsampled copies of the grid. Rendering with a
+        ``lod`` uses it to sample distant parts of the grid at a resolution
+        which matches their size on screen. The pyramid is kept up to date by
+        ``stamp()`` and ``pstamp()``.
+
+        Parameters
+        ----------
+        levels : int or None
+            The most levels to build, including the grid itself. If None,
+            build levels until they are a single voxel wide.
+
+        Returns
+        -------
+        mipmaps : Mipmaps
+            The new pyramid, which is also stored in ``self.mipmaps``.
+
+        '''
+        self.mipmaps = Mipmaps(self, levels=levels)
+        return self.mipmaps
+
+    def bbox(self):
+        '''
+        Returns the world-space axis-aligned bounding box of the grid.
+
+        Returns
+        -------
+        corners : array
+            A ``(2, 4)`` array holding the minimum and maximum homogeneous
+            corners of the box, suitable for ``volpy.BBox``.
+
+        '''
+        corners = np.array([[i, j, k, 1]
+                            for i in (MIN_COORDINATE[0], MAX_COORDINATE[0])
+                            for j in (MIN_COORDINATE[1], MAX_COORDINATE[1])
+                            for k in (MIN_COORDINATE[2], MAX_COORDINATE[2])])
+        wspace = self.gwspace(corners)
+        wspace /= wspace[:, 3:]
+        return np.array([wspace.min(axis=0), wspace.max(axis=0)])
+
+    def spacing(self):
+        '''
+        Returns the world-space distance between neighboring voxels along each
+        axis of the grid.
+
+        Returns
+        -------
+        spacing : array
+            A shape ``(3,)`` array of distances. Axes with a single voxel have
+            infinite spacing.
+
+        '''
+        shape = np.array(self.array.shape[:3], dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            voxel = (MAX_COORDINATE[:3] - MIN_COORDINATE[:3]) / (shape - 1)
+        return voxel * np.linalg.norm(self.itransform[:3, :3], axis=0)
 
     @property
     def nelements(self):
@@ -126,7 +353,7 @@ class Grid(object):
             An ``(nelements, 4)`` array containing the world-space coordinates.
 
         '''
-        return np.dot(gspace, self.itransform)
+        return np.dot(gspace, self.itransform.T)
 
     def stamp(self, field):
         '''
@@ -143,7 +370,7 @@ class Grid(object):
         '''
         return self._stamp(field)
 
-    def pstamp(self, field, method='thread', workers=None):
+    def pstamp(self, field, method='thread', workers=None, pool=None):
         '''
         Like ``stamp()`` but use ``volpy.peval()`` to do the evaluation.
 
@@ -162,12 +389,16 @@ class Grid(object):
         workers : int or None
             Number of worker threads/processes. If None, use the number of CPUs
             returned by ``multiprocessing.cpu_count()``.
+        pool : WorkerPool or None
+            A pool of workers to evaluate with. If given, ``method`` and
+            ``workers`` are taken from the pool.
 
         '''
         return self._stamp(field, parallel=True, method=method,
-                           workers=workers)
+                           workers=workers, pool=pool)
 
-    def _stamp(self, field, parallel=False, method='thread', workers=None):
+    def _stamp(self, field, parallel=False, method='thread', workers=None,
+               pool=None):
         '''
         Common internal implementation for stamp() and pstamp().
 
@@ -176,8 +407,270 @@ class Grid(object):
         gspace = self.igspace(indices)
         wspace = self.gwspace(gspace)
         if parallel:
-            result = peval(field, wspace, method=method, workers=workers)
+            result = peval(field, wspace, method=method, workers=workers,
+                           pool=pool)
         else:
             result = field(wspace)
         i, j, k = indices.transpose()
-        self.array[i, j, k] = result
+        self.array[i, j, k] = self._encode(result)
+        self.version += 1
+        if self.macrocells is not None:
+            self.macrocells.update()
+        if self.mipmaps is not None:
+            self.mipmaps.update()
+
+    def _encode(self, values):
+        # Convert values to the stored representation, rounding and clamping
+        # them to the range of integer arrays.
+        values = np.asarray(values)
+        if self.scale != 1 or self.offset != 0:
+            values = (values - self.offset) / self.scale
+        if self.array.dtype.kind == 'u':
+            info = np.iinfo(self.array.dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        return values
+
+
+class Macrocells(object):
+    '''
+    A hierarchy of min/max summaries over blocks of a scalar ``Grid``.
+
+    Level 0 summarizes blocks of ``block`` voxels along each axis, including
+    the shared voxels on their far faces, and each coarser level summarizes
+    2x2x2 cells of the level below it. All levels live in one flat buffer so
+    they can be walked natively.
+    '''
+
+    def __init__(self, grid, block=8, threshold=0.):
+        if grid.array.ndim != 3:
+            raise ValueError('Macrocells require a scalar grid.')
+        if block < 1:
+            raise ValueError('Block size must be at least 1.')
+        self.grid = grid
+        self.block = block
+        self.threshold = threshold
+
+        shape = np.maximum(1, -(-(np.array(grid.array.shape) - 1) // block))
+        shapes = [shape]
+        while shape.max() > 1:
+            shape = -(-shape // 2)
+            shapes.append(shape)
+        self.shapes = np.array(shapes, dtype=np.intp)
+        sizes = np.prod(self.shapes, axis=1)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self.offsets = self.offsets.astype(np.intp)
+        self._min = np.empty(sizes.sum(), dtype=np.float32)
+        self._max = np.empty(sizes.sum(), dtype=np.float32)
+        self.mins = self._levels(self._min)
+        self.maxs = self._levels(self._max)
+        self.update()
+
+    @property
+    def levels(self):
+        '''
+        Returns the number of levels in the pyramid.
+
+        '''
+        return len(self.shapes)
+
+    def update(self, lo=None, hi=None):
+        '''
+        Recompute the macrocells which cover a region of the grid.
+
+        Parameters
+        ----------
+        lo : array-like or None
+            The first voxel index of the changed region, or None for the
+            whole grid.
+        hi : array-like or None
+            One past the last voxel index of the changed region, or None for
+            the whole grid.
+
+        '''
+        shape = np.array(self.grid.array.shape, dtype=np.intp)
+        lo = np.zeros(3, dtype=np.intp) if lo is None else np.asarray(lo)
+        hi = shape if hi is None else np.asarray(hi)
+
+        # A voxel is shared by the blocks on either side of a block boundary.
+        lo = np.maximum(0, (lo - 1) // self.block).astype(np.intp)
+        hi = np.minimum(self.shapes[0],
+                        (hi - 1) // self.block + 1).astype(np.intp)
+        grid_block_minmax(self.grid, self.block, self.mins[0],
+                          self.maxs[0], lo, hi)
+        for level in range(1, self.levels):
+            lo = (lo // 2).astype(np.intp)
+            hi = ((hi - 1) // 2 + 1).astype(np.intp)
+            grid_pyramid_reduce(self.mins[level - 1], self.maxs[level - 1],
+                                self.mins[level], self.maxs[level], lo, hi)
+
+    def empty_span(self, positions, directions, limit):
+        '''
+        Compute how far rays can travel through empty macrocells.
+
+        Parameters
+        ----------
+        positions : array
+            An ``(n, 3)`` or ``(n, 4)`` float32 array of ray positions.
+        directions : array
+            An ``(n, 3)`` or ``(n, 4)`` float32 array of ray directions.
+        limit : array
+            An ``(n,)`` float32 array holding the farthest distance of
+            interest along each ray.
+
+        Returns
+        -------
+        span : array
+            An ``(n,)`` float32 array. Everything along each ray up to this
+            distance from its position lies in empty macrocells.
+
+        '''
+        span = np.zeros(len(positions), dtype=np.float32)
+        grid_empty_span(self, positions, directions, limit, span)
+        return span
+
+    def _levels(self, flat):
+        return [flat[offset:offset + np.prod(shape)].reshape(shape)
+                for offset, shape in zip(self.offsets, self.shapes)]
+
+    def _index_transform(self):
+        # Compose the grid transform with the map from normalized grid
+        # coordinates to voxel indices.
+        extent = np.array(self.grid.array.shape[:3], dtype=np.float64) - 1
+        transform = self.grid.transform[:3].astype(np.float64)
+        transform[:, 3] += MAX_COORDINATE[:3]
+        return transform * extent.reshape(3, 1)
+
+
+class Mipmaps(object):
+    '''
+    A pyramid of successively downsampled copies of a ``Grid``.
+
+    Level 0 is the grid itself, and each coarser level has about half as
+    many voxels along each axis. Each level is filtered from the one below
+    it with a tent filter two of its voxels wide. All levels cover the same
+    box and are stored as float32 grids.
+    '''
+
+    # The most levels the native sampler supports.
+    MAX_LEVELS = 16
+
+    def __init__(self, grid, levels=None):
+        if levels is None:
+            levels = self.MAX_LEVELS
+        elif not 1 <= levels <= self.MAX_LEVELS:
+            raise ValueError('Must have between 1 and %d levels.'
+                             % self.MAX_LEVELS)
+        self.grid = grid
+        self.max_levels = levels
+        self.update()
+
+    @property
+    def levels(self):
+        '''
+        Returns the number of levels in the pyramid.
+
+        '''
+        return len(self.grids)
+
+    def update(self):
+        '''
+        Recompute the downsampled levels from the grid.
+
+        '''
+        grids = [self.grid]
+        shape = self.grid.array.shape[:3]
+        while len(grids) < self.max_levels and max(shape) > 1:
+            shape = tuple(1 if n <= 2 else (n - 2) // 2 + 2 for n in shape)
+            level = grids[-1]
+            for axis in range(3):
+                level = _resample(level, axis, shape[axis])
+            grids.append(level)
+        self.grids = grids
+        self.spacings = np.array([_voxel_width(grid) for grid in grids])
+
+    def sample(self, xyz, footprint, out=None):
+        '''
+        Sample the pyramid at a set of positions, each at the level whose
+        voxels match the width of its footprint. Footprints between the
+        voxel spacings of two levels blend the levels linearly.
+
+        Parameters
+        ----------
+        xyz : array
+            A ``(n, 4)`` array of homogeneous world-space positions.
+        footprint : float or array
+            The world-space width of the region each sample stands for,
+            either for all of the samples or as an ``(n,)`` array.
+        out : array or None
+            See ``Grid.__call__()``.
+
+        Returns
+        -------
+        samples : array
+            The samples. This is ``out`` if it was given.
+
+        '''
+        xyz = np.asarray(xyz, dtype=np.float32)
+        count = xyz.shape[0]
+        footprint = np.ascontiguousarray(
+            np.broadcast_to(footprint, (count,)), dtype=np.float32)
+        array = self.grid.array
+        shape = (count,) + array.shape[3:]
+        channels = array.shape[3] if array.ndim == 4 else 1
+        if out is None:
+            out = np.ndarray(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError('Output must have shape %s.' % (shape,))
+        elif out.dtype != np.float32:
+            raise ValueError('Output must be float32.')
+        samples = out
+        if not out.flags.c_contiguous:
+            samples = np.ndarray(shape, dtype=np.float32)
+        scratch = np.ndarray((count, channels), dtype=np.float32)
+        mipmap_eval(self, xyz, footprint, samples.reshape((count, channels)),
+                    scratch)
+        if samples is not out:
+            out[...] = samples
+        return out
+
+
+def _voxel_width(grid):
+    # The smallest world-space spacing of the voxels of a grid, where an axis
+    # with a single voxel counts as one voxel across.
+    intervals = np.maximum(np.array(grid.array.shape[:3]) - 1, 1)
+    extent = ((MAX_COORDINATE[:3] - MIN_COORDINATE[:3])
+              * np.linalg.norm(grid.itransform[:3, :3], axis=0))
+    return (extent / intervals).min()
+
+
+def _resample(grid, axis, count):
+    # Filter a grid down to count voxels along an axis.
+    array = grid.array
+    if array.shape[axis] == count and array.dtype == np.float32:
+        return grid
+    channels = array.shape[3] if array.ndim == 4 else 1
+    shape = list(array.shape[:3])
+    shape[axis] = count
+    result = np.empty(shape + [channels], dtype=np.float32)
+    index, weight = _tent(array.shape[axis], count)
+    grid_resample(grid, result, axis, index, weight)
+    return Grid(result.reshape(tuple(shape) + array.shape[3:]),
+                transform=grid.transform, default=grid.default)
+
+
+def _tent(n, count):
+    # The voxels and weights of a tent filter which resamples n voxels to
+    # count voxels over the same extent. The filter is two new voxels wide,
+    # and its weights are renormalized where it overhangs the edges.
+    if count == 1:
+        return (np.arange(n, dtype=np.intp).reshape((1, n)),
+                np.full((1, n), 1. / n, dtype=np.float32))
+    radius = (n - 1.) / (count - 1)
+    centers = np.arange(count) * radius
+    taps = int(np.ceil(2 * radius)) + 1
+    index = np.ceil(centers - radius).astype(np.intp)[:, None] + np.arange(taps)
+    weight = np.maximum(0, 1 - np.abs(index - centers[:, None]) / radius)
+    weight[(index < 0) | (index >= n)] = 0
+    weight /= weight.sum(axis=1, keepdims=True)
+    index = np.clip(index, 0, n - 1)
+    return index, weight.astype(np.float32)
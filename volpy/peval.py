@@ -3,11 +3,14 @@ Parallel evalulation function.
 '''
 
 import multiprocessing
-import threading
 import numpy as np
 
+from ._grid import openmp_enabled, get_num_threads, set_num_threads
+from .pool import WorkerPool, METHODS
 
-def peval(func, xyz, method='thread', workers=None):
+
+def peval(func, xyz, method='thread', workers=None, pool=None, out=None,
+          chunksize=None):
     '''
     Evaluate a function in parallel using multiple threads or processes.
 
@@ -28,51 +31,62 @@ def peval(func, xyz, method='thread', workers=None):
     workers : int or None
         Number of worker threads/processes. If None, use the number of CPUs
         returned by ``multiprocessing.cpu_count()``.
+    pool : WorkerPool or None
+        A pool of workers to evaluate with. If given, ``method`` and
+        ``workers`` are taken from the pool. If None, a pool is started for
+        this evaluation and shut down afterwards.
+    out : array or None
+        An array with one row for each position to store the result in. With
+        'thread', every worker writes its chunk of the result directly into
+        it. If None, a new array is allocated.
+    chunksize : int or None
+        Number of positions per call to ``func``. The chunks are handed out
+        to the workers one at a time, so that workers which finish early take
+        over the remaining ones. If None, the positions are divided into four
+        chunks per worker.
 
     Returns
     -------
     result : array
-        Exactly the same value as ``func(array)``.
+        Exactly the same value as ``func(array)``. This is ``out`` if it was
+        given.
 
     '''
-    if workers is None:
+    if pool is not None:
+        method, workers = pool.method, pool.workers
+    elif workers is None:
         workers = multiprocessing.cpu_count()
     elif workers < 1:
         raise ValueError('Must have at least 1 worker.')
+    if method not in METHODS:
+        raise ValueError('Invalid method: %s' % method)
+    if out is not None and len(out) != len(xyz):
+        raise ValueError('Output must have %d rows.' % len(xyz))
+    if chunksize is None:
+        chunksize = max(1, -(-len(xyz) // (4 * workers)))
+    elif chunksize < 1:
+        raise ValueError('Chunk size must be positive.')
     jobs = []
-    chunksize = max(1, int(len(xyz) / workers))
     for i in range(0, len(xyz), chunksize):
-        chunk = xyz[i:i + chunksize]
-        jobs.append(_Job(func, chunk))
-    if method == 'thread':
-        return _peval_thread(jobs)
-    elif method == 'fork':
-        return _peval_fork(jobs)
+        rows = slice(i, i + chunksize)
+        # Threads can write into the output themselves.
+        if out is not None and method == 'thread':
+            jobs.append(_Job(func, xyz[rows], out[rows]))
+        else:
+            jobs.append(_Job(func, xyz[rows]))
+    if pool is None:
+        with WorkerPool(method, min(workers, len(jobs))) as pool:
+            results = pool.map(_run_job, jobs)
     else:
-        raise ValueError('Invalid method: %s' % method)
-
-
-def _peval_thread(jobs):
-    wait = []
-    for job in jobs:
-        thread = _EvalThread(job)
-        thread.start()
-        wait.append(thread)
-    wait[0].join()
-    result = wait[0].job.result
-    for thread in wait[1:]:
-        thread.join()
-        result = np.append(result, thread.job.result, axis=0)
-    return result
-
-
-def _peval_fork(jobs):
-    pool = multiprocessing.Pool(len(jobs))
-    results = pool.map(_run_job, jobs)
-    result = results[0]
-    for r in results[1:]:
-        result = np.append(result, r, axis=0)
-    return result
+        results = pool.map(_run_job, jobs)
+    if out is None:
+        return np.concatenate(results)
+    if method != 'thread':
+        start = 0
+        for result in results:
+            out[start:start + len(result)] = result
+            start += len(result)
+    return out
 
 
 def _run_job(job):
@@ -82,20 +96,14 @@ def _run_job(job):
 
 class _Job(object):
 
-    def __init__(self, func, xyz):
+    def __init__(self, func, xyz, out=None):
         self.func = func
         self.xyz = xyz
+        self.out = out
         self.result = None
 
     def run(self):
-        self.result = self.func(self.xyz)
-
-
-class _EvalThread(threading.Thread):
-
-    def __init__(self, job):
-        super().__init__()
-        self.job = job
-
-    def run(self):
-        self.job.run()
+        if self.out is None:
+            self.result = self.func(self.xyz)
+        else:
+            self.out[...] = self.func(self.xyz)
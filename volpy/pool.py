@@ -0,0 +1,122 @@
+'''
+Persistent worker pools for rendering and parallel evaluation.
+'''
+
+import multiprocessing
+import multiprocessing.pool
+
+METHODS = ('thread', 'fork')
+
+
+class WorkerPool(object):
+    '''
+    A long-lived pool of worker threads or processes which can be shared by
+    many calls to ``Scene.render()``, ``peval()`` and ``Grid.pstamp()``, so
+    that the cost of starting the workers is only paid once.
+
+    The pool should be shut down with ``close()`` when it is no longer needed,
+    or used as a context manager:
+
+        >>> with volpy.WorkerPool('fork') as pool:
+        ...     for camera in cameras:
+        ...         scene.camera = camera
+        ...         images.append(scene.render((1920, 1080), pool=pool))
+    '''
+
+    def __init__(self, method='thread', workers=None):
+        '''
+        WorkerPool constructor.
+
+        Parameters
+        ----------
+        method : str
+            Either 'thread' or 'fork'. With 'thread' the workers are threads.
+            With 'fork' the workers are processes.
+        workers : int or None
+            Number of worker threads/processes. If None, use the number of
+            CPUs returned by ``multiprocessing.cpu_count()``.
+        '''
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        elif workers < 1:
+            raise ValueError('Must have at least 1 worker.')
+        if method == 'thread':
+            pool = multiprocessing.pool.ThreadPool(workers)
+        elif method == 'fork':
+            pool = multiprocessing.Pool(workers)
+        else:
+            raise ValueError('Invalid method: %s' % method)
+        self.method = method
+        self.workers = workers
+        self._pool = pool
+        self._closed = False
+
+    @property
+    def closed(self):
+        '''
+        Returns True if the pool has been shut down.
+
+        '''
+        return self._closed
+
+    def map(self, func, iterable):
+        '''
+        Apply a function to every item of an iterable using the workers. The
+        items are handed out one at a time as workers become idle.
+
+        Parameters
+        ----------
+        func : callable
+            The function to apply. With the 'fork' method it must be
+            picklable, as must the items.
+        iterable : iterable
+            The items to apply the function to.
+
+        Returns
+        -------
+        results : list
+            The results in the same order as the items.
+
+        '''
+        if self._closed:
+            raise ValueError('Pool is closed.')
+        return self._pool.map(func, iterable, chunksize=1)
+
+    def imap_unordered(self, func, iterable):
+        '''
+        Like ``map()``, but return an iterator which yields each result as
+        soon as it is ready, in no particular order.
+
+        Parameters
+        ----------
+        func : callable
+            The function to apply. With the 'fork' method it must be
+            picklable, as must the items.
+        iterable : iterable
+            The items to apply the function to.
+
+        Returns
+        -------
+        results : iterator
+            The results in the order they are completed.
+
+        '''
+        if self._closed:
+            raise ValueError('Pool is closed.')
+        return self._pool.imap_unordered(func, iterable, chunksize=1)
+
+    def close(self):
+        '''
+        Shut down the pool after waiting for outstanding work to finish.
+
+        '''
+        if not self._closed:
+            self._closed = True
+            self._pool.close()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,16 +1,22 @@
 import numpy as np
 
-import threading
+from contextlib import contextmanager, ExitStack
+from functools import partial
 import multiprocessing
 
+from . import _shm
 from .camera import Camera
-from ._util import cartesian
-from ._native import cast_rays
+from .geometry import BBox
+from .grid import Grid
+from .pool import WorkerPool, METHODS
+from .shadow import ShadowMap
+from .sparse import SparseGrid
+from ._native import cast_rays, camera_rays
 
 
 class Element(object):
 
-    def __init__(self, density, color=None):
+    def __init__(self, density, color=None, bounds=None):
         '''
         Element constructor.
 
@@ -19,14 +25,49 @@ class Element(object):
         density : callable
             A callable which takes an (N, 3) array of positions and returns a
             shape (N,) array representing the density at each of the positions.
+            If it also takes an ``out`` keyword argument, like ``Grid`` does,
+            it is passed a float32 array to store the densities in instead,
+            which saves allocating a new array for every step of the rays.
         color : callable or None
             A callable which takes a (N, 3) array of positions and returns a
             shape (N, 3) array representing the normalized red, green, and blue
             color values at each of the positions. If color is None, it is
-            assumed to be white throughout.
+            assumed to be white throughout. It may take an ``out`` argument
+            like ``density``.
+        bounds : BBox, array-like or None
+            The world-space box outside of which the density is zero, either
+            as a ``BBox`` or a ``(2, 4)`` array of its corners. Rays are only
+            sampled inside of it. If None and the density is a ``Grid`` with a
+            zero default value, or a ``SparseGrid`` with a zero background
+            value, the extent of the grid is used.
         '''
         self.density = density
         self.color = color
+        self.bounds = bounds
+
+    def bbox(self):
+        '''
+        Returns the world-space bounding box of the element.
+
+        Returns
+        -------
+        corners : array or None
+            A ``(2, 4)`` array holding the minimum and maximum corners of the
+            box, or None if the element is unbounded.
+
+        '''
+        if isinstance(self.bounds, BBox):
+            return np.array(self.bounds.corners, dtype=np.float64)
+        elif self.bounds is not None:
+            return np.array(self.bounds, dtype=np.float64)
+        elif isinstance(self.density, Grid) and self.density.default == 0:
+            return self.density.bbox()
+        elif (
+            isinstance(self.density, SparseGrid)
+            and self.density.background == 0
+        ):
+            return self.density.bbox()
+        return None
 
 
 class Light(object):
@@ -40,13 +81,36 @@ class Light(object):
         field : callable
             A callable which takes an (N, 3) array of positions and returns a
             shape (N,) array representing the amount of shadowing at each
-            position.
+            position. It may take an ``out`` argument like the density of an
+            ``Element``.
         color : tuple
             Tuple of 3 floats representing the RGB color of the light.
         '''
         self.field = field
         self.color = color
 
+    def bake(self, density, shape, transform=None, position=None,
+             direction=None, step=None):
+        '''
+        Bake the shadows which a density casts from this light into a
+        ``ShadowMap``, and use the map as the field of the light.
+
+        Parameters
+        ----------
+        density, shape, transform, position, direction, step
+            As in ``ShadowMap``.
+
+        Returns
+        -------
+        shadow : ShadowMap
+            The new field of the light.
+
+        '''
+        self.field = ShadowMap(density, shape, transform=transform,
+                               position=position, direction=direction,
+                               step=step)
+        return self.field
+
 
 class Scene(object):
 
@@ -76,7 +140,9 @@ class Scene(object):
         self.lights = []
 
     def render(self, shape, step=None, workers=None, tol=1e-6,
-               method='thread'):
+               method='thread', compact=True, pool=None, out=None,
+               tile=(64, 64), max_step=None, coarse=None, coarse_tol=1e-2,
+               batch=1, lod=0):
         '''
         Render an image.
 
@@ -85,7 +151,9 @@ class Scene(object):
         shape : tuple of int of length 2
             The desired shape of the output image.
         step : float or None
-            The ray step size. If None, step exactly 100 times.
+            The ray step size. If None, step exactly 100 times, or with
+            ``max_step`` step by the voxel spacing of the density grids in the
+            scene if there are any.
         workers : int or None
             Number of worker threads/processes. If None, use the number of CPUs
             returned by ``multiprocessing.cpu_count()``.
@@ -94,20 +162,205 @@ class Scene(object):
             no ray's transmissivity is above this value, the trace is stopped
             early.
         method : str
-            Either 'thread' or 'fork'. Determines the concurrency method used
-            for rendering. With 'thread' multiple threads are launched. With
-            'fork' multiple processes are launched. Note that threads are more
-            likely to have less CPU utilization due to the GIL. Processes are
-            not as likely, but their memory will be duplicated.
+            Either 'thread', 'fork' or 'native'. Determines the concurrency
+            method used for rendering. With 'thread' multiple threads are
+            launched. With 'fork' multiple processes are launched. Note that
+            threads are more likely to have less CPU utilization due to the
+            GIL. Processes are not as likely, but their memory will be
+            duplicated. With 'native' all rays are cast from the calling
+            thread and the native kernels are parallelized with OpenMP
+            instead, see ``volpy.set_num_threads()``; ``workers`` is ignored.
+        compact : bool
+            If True, rays whose transmissivity drops to ``tol`` or below are
+            removed from the working set, so the density, color and light
+            callables are only evaluated at the positions of live rays.
+        pool : WorkerPool or None
+            A pool of workers to render with. If given, ``method`` and
+            ``workers`` are taken from the pool. If None, a pool is started
+            for this render and shut down afterwards.
+        out : numpy.ndarray or None
+            A C-contiguous floating point array of shape
+            ``(shape[1], shape[0], 4)`` to render into. If None, a float32
+            image is allocated.
+        tile : tuple of int of length 2
+            The shape of the tiles the image is divided into, in the same
+            order as ``shape``. Workers take tiles from a shared queue one at
+            a time, so smaller tiles balance the load better when some parts
+            of the image are more expensive than others, at the cost of more
+            overhead per tile. With 'native', the image is rendered in strips
+            of whole rows ``tile[1]`` high, and OpenMP balances the load of
+            individual rays instead.
+        max_step : float or None
+            If given, rays adapt their step size: the step doubles, up to
+            ``max_step``, for as long as the density sampled along the ray is
+            steady, and falls back to ``step`` wherever it changes. Each
+            sample is weighted by the length of its step. If None, every step
+            is ``step`` long.
+        coarse : int or None
+            If given, only every ``coarse``-th pixel along each axis (and the
+            last pixel) is traced at first. This divides the image into blocks
+            of pixels between the traced ones. The remaining pixels of a block
+            are traced only if its corner pixels differ by more than
+            ``coarse_tol`` in any channel, and are interpolated bilinearly
+            otherwise. If None, every pixel is traced.
+        coarse_tol : float
+            The tolerance for refining blocks of coarsely traced pixels.
+        batch : int
+            The number of consecutive samples of each ray which the density,
+            color and light callables are evaluated at in one call. Larger
+            batches make fewer calls into Python, at the cost of memory for
+            the samples and of samples wasted past where a ray ends or its
+            step changes. Scenes which are marched natively, such as those of
+            ``Grid`` fields only, are not affected.
+        lod : float
+            The level of detail of grids with mipmaps, see
+            ``Grid.build_mipmaps()``. Each sample uses the mipmap level whose
+            voxels are ``lod`` times as wide as a pixel at the distance of
+            the sample. Larger values render distant parts of the grids
+            faster but blurrier. If 0, the full resolution grids are used.
+            Only scenes which are marched natively are affected.
 
         Returns
         -------
         image : numpy.ndarray
             A 2D image of shape ``(shape[1], shape[0], 4)`` containing the
             results. The color channel is RGBA format with floating point
-            depth.
+            depth. This is ``out`` if it was given.
 
         '''
+        step, workers = self._render_args(shape, step, workers, tol, max_step,
+                                          batch, lod)
+        _check_tile(tile)
+        if coarse is not None and coarse < 1:
+            raise ValueError('Coarse spacing must be positive.')
+        if pool is not None:
+            method = pool.method
+        if method != 'native' and method not in METHODS:
+            raise ValueError('Invalid method: %s' % method)
+        image_shape = (shape[1], shape[0], 4)
+        if out is not None:
+            if out.shape != image_shape:
+                raise ValueError('Output must have shape %s.' % (image_shape,))
+            if not out.flags.c_contiguous:
+                raise ValueError('Output must be C-contiguous.')
+
+        self._update_shadows()
+        bounds = self.bbox()
+        if method == 'native':
+            # Render the image in strips of whole rows, which the rays can be
+            # written into directly, and let OpenMP balance the rays.
+            tile = (shape[0], tile[1])
+
+        shared = None
+        if method == 'fork':
+            # The worker processes write their tiles into shared memory.
+            dtype = np.float32 if out is None else out.dtype
+            shared = _shm.SharedArray.empty(image_shape, dtype)
+            target = shared
+        elif out is None:
+            out = target = np.empty(image_shape, dtype=np.float32)
+        else:
+            target = out
+        try:
+            job = partial(TileJob, self, shape, step=step, tol=tol,
+                          compact=compact, bounds=bounds, max_step=max_step,
+                          batch=batch,
+                          footprint=lod * self._pixel_footprint(shape),
+                          threads=None if method == 'native' else 1,
+                          out=target)
+            if coarse is None:
+                jobs = [job(rows, cols) for rows, cols in _tiles(shape, tile)]
+                for _ in _render_tiles(jobs, workers, method, pool):
+                    pass
+            else:
+                image = out if shared is None else shared.array
+                chunk = None if method == 'native' else tile[0] * tile[1]
+                _render_coarse(self, image, job, coarse, coarse_tol, chunk,
+                               workers, method, pool)
+            if shared is not None and out is None:
+                # The image stays mapped after its backing file is removed.
+                out = np.asarray(shared.array)
+            elif shared is not None:
+                out[...] = shared.array
+        finally:
+            if shared is not None:
+                shared.release()
+        return out
+
+    def render_tiles(self, shape, tile=(64, 64), step=None, workers=None,
+                     tol=1e-6, method='thread', compact=True, pool=None,
+                     max_step=None, batch=1, lod=0):
+        '''
+        Render an image tile by tile, yielding each tile as soon as it is
+        finished. Only the rays of the tiles being rendered are held in
+        memory, so partial results are available early and huge images can be
+        rendered in pieces.
+
+        Parameters
+        ----------
+        shape : tuple of int of length 2
+            The desired shape of the output image.
+        tile : tuple of int of length 2
+            The shape of the tiles, in the same order as ``shape``. Tiles on
+            the far edges of the image may be smaller.
+        step, workers, tol, method, compact, pool, max_step, batch, lod
+            As in ``render()``. With 'native' the tiles are rendered one after
+            the other in the calling thread.
+
+        Yields
+        ------
+        rows : slice
+            The rows of the image covered by the tile.
+        cols : slice
+            The columns of the image covered by the tile.
+        tile : numpy.ndarray
+            A float32 array holding the pixels of the tile, so that
+            ``image[rows, cols] = tile`` fills in the corresponding part of
+            the image returned by ``render()``.
+
+        '''
+        step, workers = self._render_args(shape, step, workers, tol, max_step,
+                                          batch, lod)
+        _check_tile(tile)
+        if pool is not None:
+            method = pool.method
+        if method != 'native' and method not in METHODS:
+            raise ValueError('Invalid method: %s' % method)
+        self._update_shadows()
+        job = partial(TileJob, self, shape, step=step, tol=tol,
+                      compact=compact, bounds=self.bbox(), max_step=max_step,
+                      batch=batch,
+                      footprint=lod * self._pixel_footprint(shape),
+                      threads=None if method == 'native' else 1)
+        jobs = [job(rows, cols) for rows, cols in _tiles(shape, tile)]
+        return _render_tiles(jobs, workers, method, pool)
+
+    def bbox(self):
+        '''
+        Returns the world-space bounding box of all scene elements.
+
+        Returns
+        -------
+        corners : array or None
+            A ``(2, 4)`` array holding the minimum and maximum corners of the
+            box, or None if any element is unbounded.
+
+        '''
+        boxes = []
+        for element in (self.ambient, self.diffuse):
+            if element is None:
+                continue
+            box = element.bbox()
+            if box is None:
+                return None
+            boxes.append(box)
+        if not boxes:
+            return None
+        return np.array([np.min([box[0] for box in boxes], axis=0),
+                         np.max([box[1] for box in boxes], axis=0)])
+
+    def _render_args(self, shape, step, workers, tol, max_step=None,
+                     batch=1, lod=0):
         if workers is None:
             workers = multiprocessing.cpu_count()
         elif workers < 1:
@@ -116,99 +369,264 @@ class Scene(object):
             raise ValueError('Tolerance must be >0.')
         if not len(shape) == 2:
             raise ValueError('Shape must have length 2')
-        if step is None:
-            step = (self.camera.far - self.camera.near) / 100
         if self.ambient is None and self.diffuse is None:
             raise ValueError('At least one scene element is required.')
-
-        origins, directions = self._linspace_rays(shape)
-        pixels = shape[0] * shape[1]
-        image = np.zeros((pixels, 4))
-
-        light = _cast_rays(self, origins, directions, step, workers, tol,
-                           method)
-        image += light
-        return image[::-1].reshape((shape[1], shape[0], 4))
-
-    def _linspace_rays(self, shape):
-        imy, imx = cartesian([np.linspace(0, 1, shape[1]),
-                              np.linspace(0, 1, shape[0])]).transpose()
-        return self.camera.cast(imx, imy)
-
-
-class Job(object):
-
-    def __init__(self, scene, positions, directions, step, tol):
-        self.positions = positions
-        self.directions = directions
+        if step is None and max_step is not None:
+            step = self._voxel_step()
+        if step is None:
+            step = (self.camera.far - self.camera.near) / 100
+        if max_step is not None and max_step < step:
+            raise ValueError('Maximum step must be at least the step size.')
+        if batch < 1:
+            raise ValueError('Batch size must be positive.')
+        if lod < 0:
+            raise ValueError('Level of detail must not be negative.')
+        return step, workers
+
+    def _update_shadows(self):
+        # Bake the stale shadow maps once, before any worker samples them.
+        if self.diffuse is None:
+            return
+        for light in self.lights:
+            if isinstance(light.field, ShadowMap):
+                light.field.update()
+
+    def _pixel_footprint(self, shape):
+        # The width of a pixel at unit distance from the eye.
+        return 2 * self.camera._tan_hfov / max(1, shape[0] - 1)
+
+    def _voxel_step(self):
+        # The smallest voxel spacing of the density grids, if there are any.
+        spacings = [element.density.spacing().min()
+                    for element in (self.ambient, self.diffuse)
+                    if element is not None
+                    and isinstance(element.density, (Grid, SparseGrid))]
+        if spacings and np.isfinite(min(spacings)):
+            return min(spacings)
+        return None
+
+    def _linspace_rays(self, shape, rows=slice(None), cols=slice(None),
+                       threads=None):
+        # Casts the rays of the pixels of the image in the given slices of
+        # rows and columns, or at the given pairs of row and column indices.
+        # Pixel (0, 0) of the image is at screen coordinates (1, 1). The
+        # rays are returned as (3, n) arrays of positions and directions.
+        if type(self.camera).cast is Camera.cast:
+            return camera_rays(self.camera, shape, rows, cols, threads)
+        imy = np.linspace(0, 1, shape[1])[::-1][rows]
+        imx = np.linspace(0, 1, shape[0])[::-1][cols]
+        if isinstance(rows, slice):
+            imy, imx = np.repeat(imy, len(imx)), np.tile(imx, len(imy))
+        origins, directions = self.camera.cast(imx, imy)
+        return (np.ascontiguousarray(origins[:, :3].T, dtype=np.float32),
+                np.ascontiguousarray(directions[:, :3].T, dtype=np.float32))
+
+
+class TileJob(object):
+
+    def __init__(self, scene, shape, rows, cols, step, tol, compact=True,
+                 bounds=None, max_step=None, batch=1, footprint=0,
+                 threads=None, out=None):
         self.scene = scene
+        self.shape = shape
+        self.rows = rows
+        self.cols = cols
         self.step = step
         self.tol = tol
-
-
-class TraceRay(threading.Thread):
-
-    def __init__(self, job):
-        super().__init__()
-        self.job = job
-        self.light = None
-
-    def run(self):
-        self.light = _run_job(self.job)
+        self.compact = compact
+        self.bounds = bounds
+        self.max_step = max_step
+        self.batch = batch
+        self.footprint = footprint
+        self.threads = threads
+        # The image, or a SharedArray of it, to write the tile into. If None,
+        # the tile is returned instead. Instead of slices, rows and cols may
+        # be arrays of the row and column indices of a set of pixels.
+        self.out = out
 
 
 def _default_camera():
     return Camera(eye=(0., 0., 0., 1), view=(0., 0., 1., 0))
 
 
-def _cast_rays(scene, positions, directions, step, workers, tol, method):
-    jobs = []
-    chunk_size = max(1, int(len(positions) / workers))
-    for i in range(0, len(positions), chunk_size):
-        job = Job(
-            scene=scene,
-            positions=positions[i:i + chunk_size],
-            directions=directions[i:i + chunk_size],
-            step=step,
-            tol=tol,
-        )
-        jobs.append(job)
-
-    if method == 'thread':
-        return _cast_rays_thread(jobs)
-    elif method == 'fork':
-        return _cast_rays_fork(jobs)
-    else:
-        raise ValueError('Invalid method: %s' % method)
-
-
-def _cast_rays_thread(jobs):
-    wait = []
-    for job in jobs:
-        thread = TraceRay(job)
-        wait.append(thread)
-        thread.start()
-
-    wait[0].join()
-    light = wait[0].light
-    for thread in wait[1:]:
-        thread.join()
-        light = np.append(light, thread.light, axis=0)
-    return light
-
-
-def _cast_rays_fork(jobs):
-    pool = multiprocessing.Pool(len(jobs))
-    results = pool.map(_run_job, jobs)
-    light = results[0]
-    for result in results[1:]:
-        light = np.append(light, result, axis=0)
-    return light
-
-
-def _run_job(job):
-    return cast_rays(job.scene, job.positions, job.directions, job.step,
-                     job.tol)
+@contextmanager
+def _shared_grids(scene):
+    # Temporarily move the arrays of the grids in a scene into shared memory,
+    # unless they already are.
+    restore = []
+    try:
+        for grid in _scene_grids(scene):
+            if not _shm.is_mapped(grid.array):
+                shared = _shm.SharedArray.copy(grid.array)
+                restore.append((grid, grid.array, shared))
+                grid.array = shared.array
+        yield
+    finally:
+        for grid, array, shared in restore:
+            grid.array = array
+            shared.release()
+
+
+def _scene_grids(scene):
+    grids = []
+    for element in (scene.ambient, scene.diffuse):
+        if element is not None:
+            grids.extend([element.density, element.color])
+    grids.extend(light.field for light in scene.lights)
+    unique = {}
+    for grid in grids:
+        if isinstance(grid, Grid):
+            unique[id(grid)] = grid
+    return list(unique.values())
+
+
+def _check_tile(tile):
+    if not len(tile) == 2:
+        raise ValueError('Tile shape must have length 2')
+    if min(tile) < 1:
+        raise ValueError('Tile shape must be positive.')
+
+
+def _tiles(shape, tile):
+    width, height = shape
+    for y in range(0, height, tile[1]):
+        for x in range(0, width, tile[0]):
+            yield (slice(y, min(y + tile[1], height)),
+                   slice(x, min(x + tile[0], width)))
+
+
+def _render_tiles(jobs, workers, method, pool):
+    if method == 'native':
+        for job in jobs:
+            yield _run_tile(job)
+        return
+    with ExitStack() as stack:
+        if method == 'fork' and jobs:
+            stack.enter_context(_shared_grids(jobs[0].scene))
+        # The pool is shut down before the grids leave shared memory.
+        if pool is None:
+            pool = stack.enter_context(
+                WorkerPool(method, max(1, min(workers, len(jobs)))))
+        for result in pool.imap_unordered(_run_tile, jobs):
+            yield result
+
+
+def _render_coarse(scene, image, job, coarse, coarse_tol, chunk, workers,
+                   method, pool):
+    height, width = image.shape[:2]
+    rows, cols = _lattice(height, coarse), _lattice(width, coarse)
+    if len(rows) < 2 or len(cols) < 2:
+        rows, cols = np.indices((height, width)).reshape((2, -1))
+        _trace_pixels(job, rows, cols, chunk, workers, method, pool)
+        return
+
+    with ExitStack() as stack:
+        # Share the grids and the workers between both passes.
+        if method == 'fork':
+            stack.enter_context(_shared_grids(scene))
+        if pool is None and method != 'native':
+            pool = stack.enter_context(WorkerPool(method, workers))
+
+        # Trace the corners of the blocks.
+        lattice = np.meshgrid(rows, cols, indexing='ij')
+        _trace_pixels(job, lattice[0].ravel(), lattice[1].ravel(), chunk,
+                      workers, method, pool)
+        corners = image[np.ix_(rows, cols)].astype(np.float32)
+        blocks = np.stack([corners[:-1, :-1], corners[:-1, 1:],
+                           corners[1:, :-1], corners[1:, 1:]])
+        refine = (blocks.max(axis=0) - blocks.min(axis=0)).max(axis=2)
+        refine = refine > coarse_tol
+
+        # Interpolate every pixel between the corners, a row of blocks at a
+        # time, then trace the pixels of every block which must be refined.
+        # Pixels on the edges of a block are shared with its neighbors.
+        block_cols, weight_cols = _block_weights(width, cols)
+        top = _lerp(corners[0, block_cols], corners[0, block_cols + 1],
+                    weight_cols)
+        for i in range(len(rows) - 1):
+            bottom = _lerp(corners[i + 1, block_cols],
+                           corners[i + 1, block_cols + 1], weight_cols)
+            weights = np.linspace(0, 1, rows[i + 1] - rows[i] + 1)
+            image[rows[i]:rows[i + 1] + 1] = _lerp(
+                top, bottom, weights.reshape((-1, 1, 1)))
+            top = bottom
+        inside = np.zeros((height, width), dtype=bool)
+        for block_rows in _block_edges(height, rows):
+            for block_cols in _block_edges(width, cols):
+                inside |= refine[np.ix_(block_rows, block_cols)]
+        inside[np.ix_(rows, cols)] = False
+        pixels = np.nonzero(inside)
+        del inside
+        _trace_pixels(job, pixels[0], pixels[1], chunk, workers, method,
+                      pool)
+
+
+def _lattice(count, spacing):
+    # The indices of every spacing-th pixel, and of the last one.
+    return np.unique(np.append(np.arange(0, count, spacing), count - 1))
+
+
+def _block_weights(count, lattice):
+    # The block of each pixel along an axis, and its weight for the far edge
+    # of the block.
+    index = np.arange(count)
+    blocks = np.searchsorted(lattice, index, side='right') - 1
+    blocks = np.clip(blocks, 0, len(lattice) - 2)
+    lower, upper = lattice[blocks], lattice[blocks + 1]
+    weights = (index - lower) / (upper - lower)
+    return blocks, weights.reshape((-1, 1)).astype(np.float32)
+
+
+def _block_edges(count, lattice):
+    # The blocks on either side of each pixel along an axis. The two are
+    # the same except for pixels on the edges between blocks.
+    index = np.arange(count)
+    last = len(lattice) - 2
+    yield np.clip(np.searchsorted(lattice, index) - 1, 0, last)
+    yield np.clip(np.searchsorted(lattice, index, side='right') - 1, 0, last)
+
+
+def _lerp(a, b, weight):
+    return a * (1 - weight) + b * weight
+
+
+def _trace_pixels(job, rows, cols, chunk, workers, method, pool):
+    chunk = chunk or max(1, len(rows))
+    jobs = [job(rows[i:i + chunk], cols[i:i + chunk])
+            for i in range(0, len(rows), chunk)]
+    for _ in _render_tiles(jobs, workers, method, pool):
+        pass
+
+
+def _run_tile(job):
+    rows, cols = job.rows, job.cols
+    origins, directions = job.scene._linspace_rays(job.shape, rows, cols,
+                                                   job.threads)
+    image = job.out
+    if isinstance(image, _shm.SharedArray):
+        image = image.array
+    if (
+        image is not None
+        and isinstance(rows, slice)
+        and cols.indices(job.shape[0]) == (0, job.shape[0], 1)
+    ):
+        # Whole rows of the image are contiguous, so cast straight into them.
+        cast_rays(job.scene, origins, directions, job.step, job.tol,
+                  job.compact, job.bounds, job.threads,
+                  image[rows].reshape((-1, 4)), job.max_step, job.batch,
+                  job.footprint)
+        return rows, cols, None
+    tile = np.empty((origins.shape[1], 4), dtype=np.float32)
+    cast_rays(job.scene, origins, directions, job.step, job.tol, job.compact,
+              job.bounds, job.threads, tile, job.max_step, job.batch,
+              job.footprint)
+    if isinstance(rows, slice):
+        tile = tile.reshape((rows.stop - rows.start, cols.stop - cols.start,
+                             4))
+    if image is None:
+        return rows, cols, tile
+    image[rows, cols] = tile
+    return rows, cols, None
 
 
 def _wrap_element(element):
@@ -0,0 +1,181 @@
+'''
+Deep shadow maps baked from density fields.
+
+'''
+import numpy as np
+
+from .grid import DTYPES, Grid
+from ._native import bake_shadow_map
+
+
+class ShadowMap(Grid):
+    '''
+    A ``Grid`` holding the optical depth between each of its voxels and a
+    light: the integral of a density field along the straight path from the
+    voxel to the light. It is meant to be the field of a ``Light``, so that
+    rendering fetches the shadowing from the grid instead of evaluating it at
+    every sample.
+
+    The map is baked natively when it is created. It becomes stale when the
+    light or the density is replaced, when its density is a ``Grid`` which
+    has been stamped since, or when ``invalidate()`` is called, and is baked
+    again by ``update()``. ``Scene.render()`` updates the shadow maps of the
+    lights of the scene before rendering.
+
+        >>> light = volpy.Light(None)
+        >>> light.bake(grid, (64, 64, 64), transform=grid.transform,
+        ...            position=(0, 5, 2, 1))
+        >>> scene.lights.append(light)
+    '''
+
+    def __init__(self, density, shape, transform=None, position=None,
+                 direction=None, step=None):
+        '''
+        ShadowMap constructor.
+
+        Parameters
+        ----------
+        density : callable
+            The density field which casts the shadows, usually the density
+            of the diffuse element. If it is a scalar ``Grid``, the paths to
+            the light are clipped to its bounds. Any other field is stamped
+            into a grid with the shape and transform of the map first, and
+            only casts shadows within the bounds of the map.
+        shape : tuple of int of length 3
+            The shape of the map.
+        transform : array-like or None
+            A 4x4 transformation matrix which maps world coordinates to the
+            normalized grid coordinates of the map, as in ``Grid``.
+        position : array-like or None
+            The homogeneous world-space position of a point light.
+        direction : array-like or None
+            The world-space direction that a directional light shines in.
+            Exactly one of ``position`` and ``direction`` must be given.
+        step : float or None
+            The length of the steps taken towards the light. If None, the
+            smallest voxel spacing of the density grid, or of the map for
+            other fields, is used.
+        '''
+        if (position is None) == (direction is None):
+            raise ValueError('Exactly one of position and direction is '
+                             'required.')
+        super(ShadowMap, self).__init__(np.zeros(shape), transform=transform)
+        self._density = density
+        self._position = self._direction = None
+        # The version of the density grid which the map was baked from.
+        self._baked = None
+        self._stale = True
+        if position is None:
+            self.direction = direction
+        else:
+            self.position = position
+        self.step = step
+        self.update()
+
+    @property
+    def density(self):
+        '''
+        The density field which casts the shadows.
+
+        '''
+        return self._density
+
+    @density.setter
+    def density(self, density):
+        self._density = density
+        self.invalidate()
+
+    @property
+    def position(self):
+        '''
+        The position of a point light, or None for a directional light.
+        Setting it turns the light into a point light.
+
+        '''
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        position = np.array(position, dtype=np.float64)
+        self._position = position / position[3]
+        self._direction = None
+        self.invalidate()
+
+    @property
+    def direction(self):
+        '''
+        The direction of a directional light, or None for a point light.
+        Setting it turns the light into a directional light.
+
+        '''
+        return self._direction
+
+    @direction.setter
+    def direction(self, direction):
+        direction = np.array(direction, dtype=np.float64)[:3]
+        self._direction = direction / np.linalg.norm(direction)
+        self._position = None
+        self.invalidate()
+
+    @property
+    def stale(self):
+        '''
+        Returns True if the map must be baked again.
+
+        '''
+        return (
+            self._stale
+            or self._baked != getattr(self._density, 'version', None)
+        )
+
+    def invalidate(self):
+        '''
+        Mark the map as stale, for example after a density field which is not
+        a ``Grid`` has changed.
+
+        '''
+        self._stale = True
+
+    def update(self):
+        '''
+        Bake the map again if it is stale.
+
+        Returns
+        -------
+        baked : bool
+            True if the map was baked.
+
+        '''
+        if not self.stale:
+            return False
+        version = getattr(self._density, 'version', None)
+        density = self._density
+        if not (
+            isinstance(density, Grid)
+            and density.array.ndim == 3
+            and density.array.dtype in DTYPES
+        ):
+            density = Grid(np.zeros(self.array.shape),
+                           transform=self.transform)
+            density.stamp(self._density)
+        step = self.step
+        if step is None:
+            step = density.spacing().min()
+        if self._position is not None:
+            light = self._position
+        else:
+            light = np.append(self._direction, 0)
+        bake_shadow_map(self, density, light, step)
+        self._baked = version
+        self._stale = False
+        self.version += 1
+        if self.macrocells is not None:
+            self.macrocells.update()
+        return True
+
+    def __getstate__(self):
+        # Worker processes only sample the map, so the density is left
+        # behind. It need not be picklable.
+        state = super(ShadowMap, self).__getstate__()
+        state.update(_density=None, _baked=None, _stale=False)
+        return state
@@ -0,0 +1,295 @@
+'''
+Sparse grids which only store the parts of a volume that are not empty.
+
+'''
+import numpy as np
+
+from ._grid import sparse_grid_eval
+from .grid import MIN_COORDINATE, MAX_COORDINATE
+from .peval import peval
+from .pool import WorkerPool
+
+
+class SparseGrid(object):
+    '''
+    A grid which divides its voxels into bricks of ``brick`` voxels along
+    each axis, and only stores the bricks holding a value other than the
+    background value. Like ``volpy.Grid`` it is evaluated natively, and it
+    uses the same normalized grid coordinate space and transform.
+
+    The bricks are found through a table with one entry per brick, so a
+    sparse grid needs about ``1 / brick**3`` of the memory of the equivalent
+    dense grid, plus the memory of its stored bricks.
+    '''
+
+    def __init__(self, shape, transform=None, background=0, brick=8):
+        '''
+        SparseGrid constructor.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The shape of the equivalent dense array: ``(nx, ny, nz)`` for a
+            scalar grid or ``(nx, ny, nz, d)`` for a grid of ``d``-vectors.
+        transform : array-like
+            A 4x4 transformation matrix which maps world coordinates to the
+            default normalized grid coordinates.
+        background : float
+            The value of the voxels in bricks which are not stored, and of
+            points outside of the grid.
+        brick : int
+            The width in voxels of the bricks.
+        '''
+        shape = tuple(int(n) for n in shape)
+        if len(shape) not in (3, 4):
+            raise ValueError('Unsupported grid ndim: %d' % len(shape))
+        if min(shape) < 1:
+            raise ValueError('Shape must be positive.')
+        if brick < 1:
+            raise ValueError('Brick size must be at least 1.')
+        self.shape = shape
+        self.background = background
+        self.brick = brick
+        if transform is None:
+            transform = np.eye(4, dtype=np.float32)
+        self.transform = np.asarray(transform, dtype=np.float32)
+        self.itransform = np.linalg.inv(self.transform)
+        self.version = 0
+        self.clear()
+
+    @classmethod
+    def from_array(cls, array, transform=None, background=0, brick=8):
+        '''
+        Create a sparse grid holding the values of a dense array. The array
+        is read one slab of bricks at a time, so it may be memory-mapped, as
+        by ``np.load(path, mmap_mode='r')``, and larger than memory.
+
+        Parameters
+        ----------
+        array : array-like
+            A scalar or vector array.
+        transform : array-like
+            See ``SparseGrid()``.
+        background : float
+            See ``SparseGrid()``.
+        brick : int
+            See ``SparseGrid()``.
+
+        Returns
+        -------
+        grid : SparseGrid
+            The new grid.
+
+        '''
+        array = np.asanyarray(array)
+        grid = cls(array.shape, transform=transform, background=background,
+                   brick=brick)
+        grid._build(lambda lo, hi: array[lo:hi])
+        return grid
+
+    @property
+    def bricks(self):
+        '''
+        Returns the stored bricks as an array of shape
+        ``(nbricks, brick, brick, brick)``, or
+        ``(nbricks, brick, brick, brick, d)`` for a grid of ``d``-vectors.
+
+        '''
+        return self._bricks
+
+    @property
+    def nbricks(self):
+        '''
+        Returns the number of stored bricks.
+
+        '''
+        return len(self._bricks)
+
+    @property
+    def nbytes(self):
+        '''
+        Returns the number of bytes used by the bricks and the brick table.
+
+        '''
+        return self._bricks.nbytes + self.table.nbytes
+
+    def clear(self):
+        '''
+        Free all of the bricks, so that every voxel has the background value.
+
+        '''
+        shape = -(-np.array(self.shape[:3]) // self.brick)
+        self.table = np.full(shape, -1, dtype=np.intp)
+        self._bricks = np.empty((0,) + self._brick_shape(), dtype=np.float32)
+        self.version += 1
+
+    def __call__(self, xyz, out=None):
+        '''
+        Sample the grid at a set of positions.
+
+        Parameters
+        ----------
+        xyz : array
+            A ``(n, 4)`` array of homogeneous world-space positions.
+        out : array or None
+            A float32 array of shape ``(n,)``, or ``(n, d)`` for a grid of
+            ``d``-vectors, to store the samples in. If None, a new array is
+            allocated.
+
+        Returns
+        -------
+        samples : array
+            The trilinearly interpolated samples. This is ``out`` if it was
+            given.
+
+        '''
+        xyz = np.asarray(xyz, dtype=np.float32)
+        count = xyz.shape[0]
+        channels = self.shape[3] if len(self.shape) == 4 else 1
+        shape = (count,) + self.shape[3:]
+        if out is None:
+            out = np.ndarray(shape, dtype=np.float32)
+        elif out.shape != shape:
+            raise ValueError('Output must have shape %s.' % (shape,))
+        elif out.dtype != np.float32:
+            raise ValueError('Output must be float32.')
+        if out.flags.c_contiguous:
+            sparse_grid_eval(self, xyz, out.reshape((count, channels)))
+        else:
+            samples = np.ndarray((count, channels), dtype=np.float32)
+            sparse_grid_eval(self, xyz, samples)
+            out[...] = samples.reshape(shape)
+        return out
+
+    def bbox(self):
+        '''
+        Returns the world-space axis-aligned bounding box of the grid.
+
+        Returns
+        -------
+        corners : array
+            A ``(2, 4)`` array holding the minimum and maximum homogeneous
+            corners of the box, suitable for ``volpy.BBox``.
+
+        '''
+        corners = np.array([[i, j, k, 1]
+                            for i in (MIN_COORDINATE[0], MAX_COORDINATE[0])
+                            for j in (MIN_COORDINATE[1], MAX_COORDINATE[1])
+                            for k in (MIN_COORDINATE[2], MAX_COORDINATE[2])])
+        wspace = np.dot(corners, self.itransform.T)
+        wspace /= wspace[:, 3:]
+        return np.array([wspace.min(axis=0), wspace.max(axis=0)])
+
+    def spacing(self):
+        '''
+        Returns the world-space distance between neighboring voxels along each
+        axis of the grid.
+
+        Returns
+        -------
+        spacing : array
+            A shape ``(3,)`` array of distances. Axes with a single voxel have
+            infinite spacing.
+
+        '''
+        shape = np.array(self.shape[:3], dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            voxel = (MAX_COORDINATE[:3] - MIN_COORDINATE[:3]) / (shape - 1)
+        return voxel * np.linalg.norm(self.itransform[:3, :3], axis=0)
+
+    def stamp(self, field):
+        '''
+        Overwrite the values of the grid with the equivalent world-space values
+        of the given field. The field is evaluated one slab of bricks at a
+        time, and only the bricks holding a value other than the background
+        value are stored.
+
+        Parameters
+        ----------
+        field : callable
+            A field function. Will be called with the world-space coordinates
+            of the voxels of a slab of bricks.
+
+        '''
+        return self._stamp(field)
+
+    def pstamp(self, field, method='thread', workers=None, pool=None):
+        '''
+        Like ``stamp()`` but use ``volpy.peval()`` to do the evaluation.
+
+        Parameters
+        ----------
+        field : callable
+            A field function. Will be called with the world-space coordinates
+            of some of the voxels of a slab of bricks.
+        method : str
+            Either 'thread' or 'fork'. See ``Grid.pstamp()``.
+        workers : int or None
+            Number of worker threads/processes. If None, use the number of CPUs
+            returned by ``multiprocessing.cpu_count()``.
+        pool : WorkerPool or None
+            A pool of workers to evaluate with. If None, a pool is started for
+            the whole stamp and shut down afterwards.
+
+        '''
+        if pool is not None:
+            return self._stamp(field, pool=pool)
+        with WorkerPool(method, workers) as pool:
+            return self._stamp(field, pool=pool)
+
+    def _stamp(self, field, pool=None):
+        '''
+        Common internal implementation for stamp() and pstamp().
+
+        '''
+        def evaluate(lo, hi):
+            wspace = self._wspace(lo, hi)
+            if pool is not None:
+                return peval(field, wspace, pool=pool)
+            return field(wspace)
+        self._build(evaluate)
+
+    def _build(self, values):
+        # Replace the bricks one slab of bricks at a time. values(lo, hi)
+        # returns the values of the voxels whose first index is in [lo, hi).
+        b = self.brick
+        nx, ny, nz = self.shape[:3]
+        tail = self.shape[3:]
+        table = np.full(self.table.shape, -1, dtype=np.intp)
+        _, tj, tk = table.shape
+        order = (1, 3, 0, 2, 4) + tuple(range(5, 5 + len(tail)))
+        bricks = []
+        count = 0
+        for a in range(table.shape[0]):
+            lo, hi = a * b, min((a + 1) * b, nx)
+            slab = np.full((b, tj * b, tk * b) + tail, self.background,
+                           dtype=np.float32)
+            slab[:hi - lo, :ny, :nz] = np.reshape(values(lo, hi),
+                                                  (hi - lo, ny, nz) + tail)
+            # Split the slab into its bricks, ordered like the table.
+            slab = slab.reshape((b, tj, b, tk, b) + tail).transpose(order)
+            slab = slab.reshape((tj * tk,) + self._brick_shape())
+            stored = np.flatnonzero(
+                (slab != self.background).reshape((tj * tk, -1)).any(axis=1))
+            bricks.append(slab[stored])
+            table[a].flat[stored] = np.arange(count, count + len(stored))
+            count += len(stored)
+        self.table = table
+        self._bricks = np.concatenate(bricks)
+        self.version += 1
+
+    def _brick_shape(self):
+        return (self.brick,) * 3 + self.shape[3:]
+
+    def _wspace(self, lo, hi):
+        # The world-space coordinates of the voxels whose first index is in
+        # [lo, hi), in C order.
+        axes = [np.arange(lo, hi), np.arange(self.shape[1]),
+                np.arange(self.shape[2])]
+        gspace = []
+        for axis, n in zip(axes, self.shape[:3]):
+            gspace.append(axis / (n - 1.) - 0.5 if n > 1 else axis * 0.)
+        gspace = np.meshgrid(*gspace, indexing='ij')
+        gspace = np.stack([g.ravel() for g in gspace]
+                          + [np.ones(gspace[0].size)], axis=1)
+        return np.dot(gspace, self.itransform.T)